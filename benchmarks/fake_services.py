@@ -0,0 +1,434 @@
+"""
+Serviços falsos para testes de carga: uma Bot API do Telegram e um SIMLAM, ambos em aiohttp.
+
+- FakeBotApi responde o que o python-telegram-bot usa (getMe, deleteWebhook, getUpdates com long
+  polling, sendMessage, editMessageText...), registra cada envio com o instante em que chegou e
+  pode devolver 429 (RetryAfter) em uma fração das mensagens, como o Telegram faz sob flood.
+- FakeSimlam reproduz o fluxo que simlam_scraper.buscar_processo percorre (página de busca com
+  VIEWSTATE, postback AJAX com o painel ctl00_baseBody_upGrid, página do processo, postback que
+  devolve o window.open do PDF e o PDF em si), com latência e taxa de erro configuráveis, além da
+  grade paginada de uma busca ampla (simlam_scraper.harvest_grid). Cada processo tem uma "versão":
+  `bump` acrescenta uma tramitação nova, que o bot deve notificar.
+  Com `client_rate`, limita as requisições por IP de cliente (429 acima do limite), como o SIMLAM real.
+- FakeProxy é um proxy HTTP de encaminhamento que se apresenta ao SIMLAM falso com um IP próprio
+  (X-Forwarded-For); serve de rota de saída local para o pool do egress.py e pode ser "bloqueado".
+
+Usados por benchmarks/loadtest.py; não fazem parte do bot.
+"""
+
+import asyncio
+import base64
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, web
+
+_BASE_DATE = datetime(2024, 1, 1, 8, 0, 0)
+_PDF_EVENTS = 5  # tramitações mais recentes que entram no PDF
+_GRID_CONTROL = "ctl00$baseBody$gvProcessos"  # GridView de resultados, alvo dos postbacks de paginação
+
+
+async def start_site(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, int]:
+    """Sobe `app` e retorna (runner, porta). Com port=0, o sistema escolhe uma porta livre."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+# --- Bot API ---
+
+
+class FakeBotApi:
+    """
+    Bot API em memória. As mensagens dos "usuários" entram por `push_message`; as respostas do bot
+    são repassadas a `on_send(chat_id, text, instante)` (time.monotonic) à medida que chegam, e as
+    edições de mensagens já enviadas, a `on_edit` (mesma assinatura).
+    """
+
+    def __init__(self, retry_after_rate: float = 0.0, retry_after_seconds: int = 1,
+                 on_send: Optional[Callable[[int, str, float], None]] = None,
+                 on_edit: Optional[Callable[[int, str, float], None]] = None, seed: Optional[int] = None):
+        self.retry_after_rate = retry_after_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.on_send = on_send
+        self.on_edit = on_edit
+        self._random = random.Random(seed)
+        self._updates: List[Dict] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Event()
+        self.polling = asyncio.Event()  # o bot já chamou getUpdates ao menos uma vez
+        self.calls: Dict[str, int] = {}
+        self.retry_after_injected = 0
+        self.bot_user = {"id": 1, "is_bot": True, "first_name": "Carga", "username": "loadtest_bot"}
+
+    def push_message(self, chat_id: int, text: str) -> int:
+        """Enfileira uma mensagem de texto do chat `chat_id` (com a entidade de comando, se for um)."""
+        message = {
+            "message_id": self._new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Usuario {chat_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append({"update_id": update_id, "message": message})
+        self._new_updates.set()
+        return update_id
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        return app
+
+    # --- Internos ---
+
+    def _new_message_id(self) -> int:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    @staticmethod
+    def _chat(chat_id: int) -> Dict:
+        if chat_id < 0:
+            return {"id": chat_id, "type": "group", "title": f"Grupo {chat_id}"}
+        return {"id": chat_id, "type": "private", "first_name": f"Usuario {chat_id}"}
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def _params(self, request: web.Request) -> Dict:
+        # O PTB manda form-urlencoded (valores não-texto vêm serializados em JSON); aceita JSON também.
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post()) if request.body_exists else dict(request.query)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await self._params(request)
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return self._ok(True)  # setMyCommands, deleteWebhook, answerCallbackQuery...
+        return await handler(params)
+
+    async def _api_getMe(self, params: Dict) -> web.Response:
+        return self._ok(self.bot_user)
+
+    async def _api_getUpdates(self, params: Dict) -> web.Response:
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 10.0)
+        # Updates com id menor que o offset já foram confirmados pelo bot.
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._ok(self._updates[:100])
+
+    async def _api_sendMessage(self, params: Dict) -> web.Response:
+        if self.retry_after_rate and self._random.random() < self.retry_after_rate:
+            self.retry_after_injected += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after_seconds}",
+                "parameters": {"retry_after": self.retry_after_seconds},
+            }, status=429)
+        chat_id = int(params["chat_id"])
+        text = params.get("text", "")
+        if self.on_send:
+            self.on_send(chat_id, text, time.monotonic())
+        return self._ok({
+            "message_id": self._new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self.bot_user,
+            "text": text,
+        })
+
+    async def _api_editMessageText(self, params: Dict) -> web.Response:
+        chat_id = int(params["chat_id"])
+        if self.on_edit:
+            self.on_edit(chat_id, params.get("text", ""), time.monotonic())
+        return self._ok({
+            "message_id": int(params["message_id"]),
+            "date": int(time.time()),
+            "edit_date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self.bot_user,
+            "text": params.get("text", ""),
+        })
+
+
+# --- SIMLAM ---
+
+
+class FakeSimlam:
+    """
+    SIMLAM falso sob /simlam/. Qualquer número bem formado "existe"; o primeiro acesso cria o
+    processo na versão 1. `latency` é o intervalo (mín., máx.) de espera por requisição;
+    `error_rate` é a fração de respostas 500 e `pdf_error_rate` a de erros do SIMLAM ao gerar o PDF.
+    `client_rate` (requisições/s por IP de cliente, 0 = sem limite) responde 429 a quem passar dele.
+
+    Uma busca incompleta (ex.: "/2024" ou "0001") lista os processos já conhecidos que a contêm, em
+    páginas de `grid_page_size` linhas, com a paginação por postback do GridView (o termo viaja no
+    __VIEWSTATE devolvido como hiddenField, como no ASP.NET).
+    """
+
+    def __init__(self, latency: Tuple[float, float] = (0.05, 0.3), error_rate: float = 0.0,
+                 pdf_error_rate: float = 0.0, client_rate: float = 0.0, seed: Optional[int] = None,
+                 grid_page_size: int = 10):
+        self.latency = latency
+        self.grid_page_size = grid_page_size
+        self.error_rate = error_rate
+        self.pdf_error_rate = pdf_error_rate
+        self.client_rate = client_rate
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # cliente -> (fichas, instante)
+        self.rate_limited = 0
+        self.requests_by_client: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self.versions: Dict[str, int] = {}
+        self._ids: Dict[str, int] = {}
+        self._numbers: Dict[int, str] = {}
+        self._pdf_cache: Dict[Tuple[str, int], bytes] = {}
+        self.requests: Dict[str, int] = {}
+        self.errors_injected = 0
+        self.pdfs_served = 0
+
+    def timestamp(self, numero: str, version: Optional[int] = None) -> str:
+        """Data/hora de envio da tramitação mais recente (o 'timestamp' que o bot guarda)."""
+        version = self.versions.setdefault(numero, 1) if version is None else version
+        when = _BASE_DATE + timedelta(days=self._entity_id(numero) % 365, minutes=version)
+        return when.strftime("%d/%m/%Y %H:%M:%S")
+
+    def bump(self, numero: str) -> None:
+        """Registra uma nova tramitação no processo."""
+        self.versions[numero] = self.versions.get(numero, 1) + 1
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/simlam/ListarProcessos.aspx", self._search_page)
+        app.router.add_post("/simlam/ListarProcessos.aspx", self._search)
+        app.router.add_get("/simlam/VisualizarProcesso.aspx", self._details_page)
+        app.router.add_post("/simlam/VisualizarProcesso.aspx", self._generate_pdf)
+        app.router.add_get("/simlam/Relatorio.pdf", self._pdf)
+        return app
+
+    # --- Internos ---
+
+    def _entity_id(self, numero: str) -> int:
+        if numero not in self._ids:
+            entity_id = len(self._ids) + 1000
+            self._ids[numero] = entity_id
+            self._numbers[entity_id] = numero
+        return self._ids[numero]
+
+    def _allow(self, client: str) -> bool:
+        """Balde de fichas por cliente: até `client_rate` requisições/s, com rajada de um segundo."""
+        now = time.monotonic()
+        capacity = max(1.0, self.client_rate)
+        tokens, last = self._buckets.get(client, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * self.client_rate)
+        allowed = tokens >= 1.0
+        self._buckets[client] = (tokens - 1.0 if allowed else tokens, now)
+        return allowed
+
+    async def _simulate(self, request: web.Request, page: str) -> None:
+        self.requests[page] = self.requests.get(page, 0) + 1
+        client = request.headers.get("X-Forwarded-For") or request.remote or "?"
+        self.requests_by_client[client] = self.requests_by_client.get(client, 0) + 1
+        if self.client_rate and not self._allow(client):
+            self.rate_limited += 1
+            raise web.HTTPTooManyRequests(text="Muitas requisições (simulado).")
+        await asyncio.sleep(self._random.uniform(*self.latency))
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors_injected += 1
+            raise web.HTTPInternalServerError(text="Erro no servidor (simulado).")
+
+    @staticmethod
+    def _form_page(body: str) -> web.Response:
+        html = (
+            "<html><body><form method='post'>"
+            "<input type='hidden' name='__VIEWSTATE' value='dkc2dGF0ZQ==' />"
+            "<input type='hidden' name='__VIEWSTATEGENERATOR' value='CA0B0334' />"
+            "<input type='hidden' name='__EVENTVALIDATION' value='ZXZlbnQ=' />"
+            f"{body}</form></body></html>"
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    @staticmethod
+    def _ajax(panel_id: str, content: str, hidden: Optional[Dict[str, str]] = None) -> web.Response:
+        # Formato do ScriptManager do ASP.NET: "tamanho|tipo|id|conteúdo|".
+        parts = [("updatePanel", panel_id, content)]
+        parts += [("hiddenField", name, value) for name, value in (hidden or {}).items()]
+        text = "".join(f"{len(value)}|{kind}|{part_id}|{value}|" for kind, part_id, value in parts)
+        return web.Response(text=text, content_type="text/plain")
+
+    async def _search_page(self, request: web.Request) -> web.Response:
+        await self._simulate(request, "search_page")
+        return self._form_page("<input name='ctl00$baseBody$txtBusca' />")
+
+    async def _search(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        if form.get("__EVENTTARGET") == _GRID_CONTROL:
+            # Troca de página: o termo da busca vem do __VIEWSTATE devolvido na resposta anterior.
+            await self._simulate(request, "search_page_change")
+            try:
+                term = base64.b64decode(form.get("__VIEWSTATE", "")).decode().partition("busca:")[2]
+                page = int(form.get("__EVENTARGUMENT", "").partition("$")[2])
+            except ValueError:
+                raise web.HTTPInternalServerError(text="Estado da página inválido (simulado).")
+            if not term:
+                raise web.HTTPInternalServerError(text="Estado da página inválido (simulado).")
+        else:
+            await self._simulate(request, "search")
+            term, page = form.get("ctl00$baseBody$txtBusca", "").strip(), 1
+        numeros = self._matches(term)
+        if not numeros:
+            return self._ajax("ctl00_baseBody_upGrid", "<table><tr><td>Nenhum registro encontrado.</td></tr></table>")
+        state = base64.b64encode(f"busca:{term}".encode()).decode()
+        return self._ajax("ctl00_baseBody_upGrid", self._grid(numeros, page), {"__VIEWSTATE": state})
+
+    def _matches(self, term: str) -> List[str]:
+        if not term.replace("/", "").isdigit():
+            return []
+        if "/" in term and all(term.split("/")):
+            self.versions.setdefault(term, 1)
+            return [term]
+        return sorted(numero for numero in self.versions if term in numero)
+
+    def _grid(self, numeros: List[str], page: int) -> str:
+        pages = max(1, -(-len(numeros) // self.grid_page_size))
+        page = min(max(1, page), pages)
+        rows = ["<tr><th>Número</th><th>Situação</th><th>Setor atual</th><th></th></tr>"]
+        for numero in numeros[(page - 1) * self.grid_page_size: page * self.grid_page_size]:
+            rows.append(
+                f"<tr><td>{numero}</td><td>Em análise</td><td>SETOR {(self.versions[numero] + 1) % 7}</td>"
+                f"<td><a title='Visualizar' onclick='abrirProcesso({self._entity_id(numero)})'>Visualizar</a></td></tr>"
+            )
+        if pages > 1:
+            links = [
+                f"<span>{p}</span>" if p == page
+                else f"<a href=\"javascript:__doPostBack('{_GRID_CONTROL}','Page${p}')\">{p}</a>"
+                for p in range(1, pages + 1)
+            ]
+            rows.append(f"<tr class='pager'><td colspan='4'>{' '.join(links)}</td></tr>")
+        return f"<table>{''.join(rows)}</table>"
+
+    def _numero(self, request: web.Request) -> str:
+        try:
+            return self._numbers[int(request.query["id"])]
+        except (KeyError, ValueError):
+            raise web.HTTPNotFound()
+
+    async def _details_page(self, request: web.Request) -> web.Response:
+        await self._simulate(request, "details_page")
+        return self._form_page(f"<span>Processo {self._numero(request)}</span>")
+
+    async def _generate_pdf(self, request: web.Request) -> web.Response:
+        await self._simulate(request, "generate_pdf")
+        numero = self._numero(request)
+        if self.pdf_error_rate and self._random.random() < self.pdf_error_rate:
+            self.errors_injected += 1
+            script = "Mensagem.publicar('Erro', 'ORA-00060: deadlock detectado ao gerar o relatório (simulado).');"
+        else:
+            entity_id = self._entity_id(numero)
+            script = f"window.open('Relatorio.pdf?id={entity_id}&v={self.versions[numero]}');"
+        return self._ajax("ctl00_baseBody_updPanelMaster", f"<script>{script}</script>")
+
+    async def _pdf(self, request: web.Request) -> web.Response:
+        await self._simulate(request, "pdf")
+        numero = self._numero(request)
+        version = int(request.query.get("v") or self.versions[numero])
+        key = (numero, version)
+        if key not in self._pdf_cache:
+            self._pdf_cache[key] = await asyncio.to_thread(self._render_pdf, numero, version)
+        self.pdfs_served += 1
+        return web.Response(body=self._pdf_cache[key], content_type="application/pdf")
+
+    def _render_pdf(self, numero: str, version: int) -> bytes:
+        import fitz  # PyMuPDF, já é dependência do bot
+
+        lines = [
+            "Relatório do processo",
+            f"Número do processo: {numero}",
+            "Data de criação: 02/01/2024",
+            f"Empreendimento: Empreendimento de teste {numero}",
+            "Interessado: Interessado de teste",
+            "Tipo do processo: Licenciamento ambiental",
+            "Situação do processo: Em análise",
+            "Tramitações",
+        ]
+        for v in range(max(1, version - _PDF_EVENTS + 1), version + 1):
+            sent = self.timestamp(numero, v)
+            lines += [
+                "Envio",
+                f"Data/Hora de envio: {sent}",
+                f"Setor de origem: SETOR {v % 7}",
+                "Recebimento",
+                f"Setor de destino: SETOR {(v + 1) % 7}",
+                f"Data/Hora do recebimento: {sent}",
+                f"Despacho: Encaminhamento número {v} para análise.",
+                "",
+            ]
+        doc = fitz.open()
+        page = doc.new_page()
+        page.insert_text((40, 40), "\n".join(lines), fontsize=8)
+        data = doc.tobytes()
+        doc.close()
+        return data
+
+
+# --- Proxy ---
+
+
+class FakeProxy:
+    """
+    Proxy HTTP de encaminhamento (só http://, sem CONNECT) que identifica seus clientes ao destino
+    como `client_ip` via X-Forwarded-For. Com `blocked`, responde 403 a tudo, como um IP banido.
+    """
+
+    _HOP_BY_HOP = {"connection", "keep-alive", "proxy-connection", "proxy-authorization", "transfer-encoding", "content-length", "host"}
+
+    def __init__(self, client_ip: str):
+        self.client_ip = client_ip
+        self.blocked = False
+        self.requests = 0
+        self._session: Optional[ClientSession] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._forward)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app: web.Application) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def _forward(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.blocked:
+            return web.Response(status=403, text="Acesso bloqueado (simulado).")
+        if self._session is None:
+            self._session = ClientSession(auto_decompress=False)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in self._HOP_BY_HOP}
+        headers["X-Forwarded-For"] = self.client_ip
+        async with self._session.request(
+            request.method, str(request.url), headers=headers, data=await request.read(), allow_redirects=False
+        ) as upstream:
+            body = await upstream.read()
+            response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in self._HOP_BY_HOP}
+            return web.Response(status=upstream.status, body=body, headers=response_headers)
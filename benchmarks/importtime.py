@@ -0,0 +1,83 @@
+"""
+Mede o custo de importação dos módulos do bot com `python -X importtime`.
+
+Uso:
+    python benchmarks/importtime.py [modulo] [--top N] [--runs N]
+
+Roda o import em um subprocesso limpo (várias vezes, fica com a mediana) e imprime
+o tempo total e os pacotes mais caros (tempo próprio somado por pacote raiz, em ms).
+O relatório de referência fica em benchmarks/importtime_report.txt.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Linhas do -X importtime: "import time: self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_importtime(module: str) -> List[Tuple[int, int, int, str]]:
+    """Executa `import module` com -X importtime e retorna (self_us, cumulative_us, nível, nome)."""
+    env = dict(os.environ)
+    # Os módulos do bot não podem depender de serviços externos só para serem importados.
+    env.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cumulative_us), len(indent) // 2, name))
+    return rows
+
+
+def summarize(rows: List[Tuple[int, int, int, str]]) -> Tuple[int, Dict[str, int]]:
+    """Retorna o tempo total (us) e o tempo próprio (self) somado por pacote raiz (ex.: 'fitz', 'rich')."""
+    total_us = sum(self_us for self_us, _, _, _ in rows)
+    per_root: Dict[str, int] = {}
+    for self_us, _, _, name in rows:
+        root = name.split(".")[0]
+        per_root[root] = per_root.get(root, 0) + self_us
+    return total_us, per_root
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Relatório de tempo de importação (-X importtime).")
+    parser.add_argument("module", nargs="?", default="bot", help="Módulo a importar (padrão: bot).")
+    parser.add_argument("--top", type=int, default=15, help="Quantos pacotes listar.")
+    parser.add_argument("--runs", type=int, default=5, help="Quantas execuções (usa a mediana).")
+    args = parser.parse_args()
+
+    totals = []
+    per_package: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        total_us, per_root = summarize(run_importtime(args.module))
+        totals.append(total_us)
+        for name, us in per_root.items():
+            per_package.setdefault(name, []).append(us)
+
+    print(f"import {args.module}: mediana de {args.runs} execuções = {statistics.median(totals) / 1000:.1f} ms")
+    print(f"{'pacote':<30} {'self (ms)':>16}")
+    ranked = sorted(per_package.items(), key=lambda kv: statistics.median(kv[1]), reverse=True)
+    for name, samples in ranked[: args.top]:
+        print(f"{name:<30} {statistics.median(samples) / 1000:>16.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
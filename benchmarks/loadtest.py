@@ -0,0 +1,532 @@
+"""
+Teste de carga de ponta a ponta: o bot de verdade contra uma Bot API e um SIMLAM falsos.
+
+Uso:
+    python benchmarks/loadtest.py [--chats N] [--processes M] [--duration S] [--json relatorio.json]
+
+O bot (bot.py) roda em um subprocesso, com TELEGRAM_API_BASE_URL e SIMLAM_BASE_URL apontando para
+os serviços de benchmarks/fake_services.py e um SQLite temporário (ou --database-url, em um banco
+descartável). Antes de subir, M processos são cadastrados e distribuídos entre N chats, com o estado
+atual já gravado, para que a primeira varredura do agendador notifique só o que mudar durante o teste.
+
+Durante --duration segundos, cada chat manda um comando por vez (/status, consulta direta, /listar,
+/monitorar de um processo novo), espera a resposta final e "pensa" por --think segundos; em paralelo,
+o SIMLAM falso registra tramitações novas em --change-rate processos por segundo. A varredura
+(check_updates) corre ao mesmo tempo e é acompanhada pelo process_schedule.
+
+Relatório: latência da primeira resposta e da resposta final por comando (p50/p95/p99), duração da
+varredura, notificações por segundo e atraso mudança->notificação, 429 injetados e pico de memória
+(VmHWM) do processo do bot.
+
+Com --proxies K, o bot sai para o SIMLAM por K proxies locais (SIMLAM_EGRESS_ROUTES, ver egress.py),
+cada um visto pelo SIMLAM falso como um IP diferente; com --simlam-client-rate, o SIMLAM falso limita
+as requisições por IP, e dá para medir quanto a varredura escala com o número de rotas.
+
+Com --harvest-queries "/2024", o bot também percorre a grade de resultados dessa busca (ver
+grid_harvest.py) e antecipa a verificação dos processos pré-cadastrados que mudaram.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, ClientError
+
+from fake_services import FakeBotApi, FakeProxy, FakeSimlam, start_site
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# Mesmo cálculo de percentil do telegram_diagnose --bench.
+from telegram_diagnose import percentile  # noqa: E402
+
+# Mensagens intermediárias do bot ("aguarde..."): não encerram o comando.
+_PROGRESS_PREFIXES = ("🔎", "Processando ", "Buscando detalhes")
+_NOTIFICATION_PREFIX = "📢"
+_PROCESS_RE = re.compile(r"\d+/\d{4}")
+# Processos pré-cadastrados terminam em /2024; os do /monitorar durante o teste, em /2025.
+_SEEDED_SUFFIX = "/2024"
+_NEW_SUFFIX = "/2025"
+
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        "n": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _read_proc_status(pid: int, field: str) -> Optional[int]:
+    """Campo de /proc/<pid>/status em KiB (VmRSS, VmHWM). None fora do Linux ou se o processo acabou."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class _Command:
+    __slots__ = ("kind", "sent_at", "first_at", "done")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.sent_at = time.monotonic()
+        self.first_at: Optional[float] = None
+        self.done = asyncio.Event()
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.bot_api = FakeBotApi(
+            retry_after_rate=args.retry_after_rate,
+            retry_after_seconds=args.retry_after_seconds,
+            on_send=self._on_send,
+            # /status, /monitorar e a consulta direta editam a própria mensagem de progresso com o resultado.
+            on_edit=self._on_send,
+            seed=args.seed,
+        )
+        self.simlam = FakeSimlam(
+            latency=tuple(args.simlam_latency),
+            error_rate=args.simlam_error_rate,
+            pdf_error_rate=args.pdf_error_rate,
+            client_rate=args.simlam_client_rate,
+            seed=args.seed,
+        )
+        self.proxies = [FakeProxy(f"10.0.0.{i + 1}") for i in range(args.proxies)]
+        self.chat_ids = [10_000 + i for i in range(args.chats)]
+        self.seeded = [f"{i + 1:06d}{_SEEDED_SUFFIX}" for i in range(args.processes)]
+        self.owned: Dict[int, List[str]] = {chat_id: [] for chat_id in self.chat_ids}
+        for i, numero in enumerate(self.seeded):
+            self.owned[self.chat_ids[i % len(self.chat_ids)]].append(numero)
+        self.mix = [(kind, weight) for kind, weight in args.mix.items() if weight > 0]
+        self._new_seq = 0
+
+        self.pending: Dict[int, _Command] = {}
+        self.first_latency: Dict[str, List[float]] = {}
+        self.final_latency: Dict[str, List[float]] = {}
+        self.timeouts: Dict[str, int] = {}
+        self.unsolicited = 0
+        self.notifications: List[float] = []
+        self.changes: Dict[str, List[float]] = {}  # processo -> instantes das mudanças ainda não notificadas
+        self.notify_delay: List[float] = []
+        self.rss_samples: List[int] = []
+        self.sweep: Dict = {"total": len(self.seeded), "checked": 0, "first_at": None, "done_at": None}
+        self.started_at = 0.0
+
+    # --- Respostas do bot (chamado pelo FakeBotApi) ---
+
+    def _on_send(self, chat_id: int, text: str, at: float) -> None:
+        if text.startswith(_NOTIFICATION_PREFIX):
+            self.notifications.append(at)
+            for numero in set(_PROCESS_RE.findall(text)):
+                pending = self.changes.get(numero)
+                if pending:
+                    # Uma notificação cobre todas as mudanças anteriores do processo.
+                    self.notify_delay.extend(at - changed_at for changed_at in pending)
+                    pending.clear()
+            return
+        command = self.pending.get(chat_id)
+        if command is None:
+            self.unsolicited += 1
+            return
+        if command.first_at is None:
+            command.first_at = at
+            self.first_latency.setdefault(command.kind, []).append(at - command.sent_at)
+        if not text.startswith(_PROGRESS_PREFIXES):
+            self.final_latency.setdefault(command.kind, []).append(at - command.sent_at)
+            del self.pending[chat_id]
+            command.done.set()
+
+    # --- Preparação ---
+
+    def seed_database(self, database_url: str) -> None:
+        """Cria as tabelas e cadastra os processos, já com o estado atual do SIMLAM falso."""
+        os.environ["DATABASE_URL"] = database_url
+        sys.path.insert(0, REPO_ROOT)
+        from database import (
+            SessionLocal, init_db, insert_ignore, monitored_processes, group_subscriptions, process_states,
+        )
+
+        init_db()
+        db = SessionLocal()
+        try:
+            insert_ignore(db, monitored_processes, [{"process_number": n} for n in self.seeded])
+            insert_ignore(db, group_subscriptions, [
+                {"chat_id": str(chat_id), "process_number": n} for chat_id, numeros in self.owned.items() for n in numeros
+            ])
+            insert_ignore(db, process_states, [
+                {"process_number": n, "last_timestamp": self.simlam.timestamp(n)} for n in self.seeded
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+    def bot_env(self, database_url: str, api_port: int, simlam_port: int, http_port: int, proxy_ports: List[int]) -> Dict[str, str]:
+        env = dict(os.environ)
+        for name in ("WEBHOOK_URL", "ADMIN_TOKEN"):
+            env.pop(name, None)
+        once_per_run = str(24 * 3600)  # cada processo é verificado uma vez: a varredura tem fim
+        env.update({
+            "BOT_TOKEN": "123456:LOADTEST",
+            "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{api_port}",
+            "SIMLAM_BASE_URL": f"http://127.0.0.1:{simlam_port}/simlam/",
+            "SIMLAM_PAUSE_RANGE": self.args.simlam_pause,
+            "DATABASE_URL": database_url,
+            "PORT": str(http_port),
+            "SCHEDULER_TICK": str(self.args.tick),
+            "SCHEDULER_BATCH_SIZE": str(self.args.batch_size),
+            "CHECK_MIN_INTERVAL": once_per_run,
+            "CHECK_MAX_INTERVAL": once_per_run,
+            "CHECK_DEFAULT_INTERVAL": once_per_run,
+            "CHECK_RETRY_INTERVAL": str(self.args.tick),
+            "SCRAPER_WORKERS": str(self.args.workers),
+            "SCRAPER_PREWARM_DELAY": "0",
+            "PYTHONUNBUFFERED": "1",
+        })
+        if proxy_ports:
+            env["SIMLAM_EGRESS_ROUTES"] = ",".join(f"http://127.0.0.1:{port}" for port in proxy_ports)
+        if self.args.egress_rate:
+            env["SIMLAM_EGRESS_RATE"] = str(self.args.egress_rate)
+        if self.args.harvest_queries:
+            env["SIMLAM_HARVEST_QUERIES"] = self.args.harvest_queries
+            env["SIMLAM_HARVEST_INTERVAL"] = str(self.args.harvest_interval)
+        return env
+
+    # --- Carga ---
+
+    def _next_command(self, chat_id: int) -> tuple:
+        kind = self.rng.choices([k for k, _ in self.mix], weights=[w for _, w in self.mix])[0]
+        if kind == "status":
+            owned = self.owned[chat_id]
+            numeros = self.rng.sample(owned, min(self.args.status_batch, len(owned)))
+            return kind, f"/status {', '.join(numeros)}"
+        if kind == "consulta":
+            return kind, self.rng.choice(self.seeded)
+        if kind == "listar":
+            return kind, "/listar"
+        self._new_seq += 1
+        return kind, f"/monitorar {self._new_seq:06d}{_NEW_SUFFIX}"
+
+    async def chat_client(self, chat_id: int, stop_at: float) -> None:
+        await asyncio.sleep(self.rng.uniform(0, self.args.think))  # não começam todos juntos
+        while time.monotonic() < stop_at:
+            kind, text = self._next_command(chat_id)
+            command = _Command(kind)
+            self.pending[chat_id] = command
+            self.bot_api.push_message(chat_id, text)
+            try:
+                await asyncio.wait_for(command.done.wait(), self.args.command_timeout)
+            except asyncio.TimeoutError:
+                self.pending.pop(chat_id, None)
+                self.timeouts[kind] = self.timeouts.get(kind, 0) + 1
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think) if self.args.think > 0 else 0)
+
+    async def change_generator(self, stop_at: float) -> None:
+        if self.args.change_rate <= 0:
+            return
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(self.rng.expovariate(self.args.change_rate))
+            numero = self.rng.choice(self.seeded)
+            self.simlam.bump(numero)
+            self.changes.setdefault(numero, []).append(time.monotonic())
+
+    async def sweep_monitor(self, since: datetime) -> None:
+        """Acompanha quantos processos pré-cadastrados já tiveram uma verificação bem-sucedida."""
+        from sqlalchemy import func, select
+        from database import SessionLocal, process_schedule
+
+        def _db_count() -> int:
+            db = SessionLocal()
+            try:
+                return db.execute(
+                    select(func.count()).select_from(process_schedule).where(
+                        process_schedule.c.process_number.like(f"%{_SEEDED_SUFFIX}"),
+                        process_schedule.c.last_succeeded_at >= since,
+                    )
+                ).scalar_one()
+            finally:
+                db.close()
+
+        while True:
+            checked = await asyncio.to_thread(_db_count)
+            now = time.monotonic()
+            self.sweep["checked"] = checked
+            if checked and self.sweep["first_at"] is None:
+                self.sweep["first_at"] = now
+            if checked >= self.sweep["total"]:
+                self.sweep["done_at"] = now
+                return
+            await asyncio.sleep(0.5)
+
+    async def memory_sampler(self, pid: int) -> None:
+        while True:
+            rss = _read_proc_status(pid, "VmRSS")
+            if rss is None:
+                return
+            self.rss_samples.append(rss)
+            await asyncio.sleep(0.5)
+
+    async def wait_ready(self, proc: subprocess.Popen, http_port: int, timeout: float = 60) -> None:
+        """Espera o /health do bot e o primeiro getUpdates."""
+        deadline = time.monotonic() + timeout
+        async with ClientSession() as session:
+            while time.monotonic() < deadline:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"O bot terminou durante a inicialização (código {proc.returncode}).")
+                try:
+                    async with session.get(f"http://127.0.0.1:{http_port}/health") as response:
+                        if response.status == 200 and self.bot_api.polling.is_set():
+                            return
+                except ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("O bot não ficou pronto a tempo.")
+
+    async def fetch_metrics(self, http_port: int) -> Optional[Dict]:
+        try:
+            async with ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{http_port}/metrics") as response:
+                    return await response.json()
+        except (ClientError, ValueError):
+            return None
+
+    async def run(self) -> Dict:
+        args = self.args
+        workdir = tempfile.mkdtemp(prefix="simlam-loadtest-")
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+        api_runner, api_port = await start_site(self.bot_api.app())
+        simlam_runner, simlam_port = await start_site(self.simlam.app())
+        proxy_sites = [await start_site(proxy.app()) for proxy in self.proxies]
+        http_port = _free_port()
+        await asyncio.to_thread(self.seed_database, database_url)
+
+        log_path = args.bot_log or os.path.join(workdir, "bot.log")
+        log_file = open(log_path, "w")
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, "bot.py")],
+            cwd=REPO_ROOT,
+            env=self.bot_env(database_url, api_port, simlam_port, http_port, [port for _, port in proxy_sites]),
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+        background: List[asyncio.Task] = []
+        try:
+            await self.wait_ready(proc, http_port)
+            since = datetime.utcnow()
+            self.started_at = time.monotonic()
+            stop_at = self.started_at + args.duration
+            background = [
+                asyncio.create_task(self.memory_sampler(proc.pid)),
+                asyncio.create_task(self.change_generator(stop_at)),
+            ]
+            sweep = asyncio.create_task(self.sweep_monitor(since))
+            await asyncio.gather(*(self.chat_client(chat_id, stop_at) for chat_id in self.chat_ids))
+            load_ended_at = time.monotonic()
+            # A carga acabou; a varredura pode ainda estar em andamento.
+            try:
+                await asyncio.wait_for(asyncio.shield(sweep), args.sweep_timeout)
+            except asyncio.TimeoutError:
+                sweep.cancel()
+            metrics = await self.fetch_metrics(http_port)
+            peak_kib = _read_proc_status(proc.pid, "VmHWM")
+        finally:
+            for task in background:
+                task.cancel()
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+                try:
+                    await asyncio.to_thread(proc.wait, 60)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            log_file.close()
+            await api_runner.cleanup()
+            await simlam_runner.cleanup()
+            for runner, _ in proxy_sites:
+                await runner.cleanup()
+            if not args.keep and not args.bot_log:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        return self.report(load_ended_at, peak_kib, metrics, workdir if args.keep else None)
+
+    # --- Relatório ---
+
+    def report(self, load_ended_at: float, peak_kib: Optional[int], metrics: Optional[Dict], workdir: Optional[str]) -> Dict:
+        elapsed = load_ended_at - self.started_at
+        sweep = self.sweep
+        sweep_seconds = (sweep["done_at"] - self.started_at) if sweep["done_at"] else None
+        notifications = len(self.notifications)
+        span = (self.notifications[-1] - self.notifications[0]) if notifications > 1 else 0
+        kinds = sorted(set(self.final_latency) | set(self.first_latency) | set(self.timeouts))
+        return {
+            "config": {k: v for k, v in vars(self.args).items() if k not in ("json",)},
+            "elapsed_s": round(elapsed, 2),
+            "commands": {
+                kind: {
+                    "completed": len(self.final_latency.get(kind, [])),
+                    "timeouts": self.timeouts.get(kind, 0),
+                    "first_reply_s": summarize(self.first_latency.get(kind, [])),
+                    "final_reply_s": summarize(self.final_latency.get(kind, [])),
+                }
+                for kind in kinds
+            },
+            "throughput_cmds_per_s": round(sum(len(v) for v in self.final_latency.values()) / elapsed, 2) if elapsed else None,
+            "unsolicited_messages": self.unsolicited,
+            "sweep": {
+                "processes": sweep["total"],
+                "checked": sweep["checked"],
+                "completed": sweep["done_at"] is not None,
+                "first_check_after_s": round(sweep["first_at"] - self.started_at, 2) if sweep["first_at"] else None,
+                "duration_s": round(sweep_seconds, 2) if sweep_seconds else None,
+                "checks_per_s": round(sweep["total"] / sweep_seconds, 2) if sweep_seconds else None,
+            },
+            "notifications": {
+                "sent": notifications,
+                "per_s": round((notifications - 1) / span, 2) if span else None,
+                "changes": sum(len(v) for v in self.changes.values()) + len(self.notify_delay),
+                "change_to_notification_s": summarize(self.notify_delay),
+            },
+            "telegram": {
+                "calls": dict(self.bot_api.calls),
+                "retry_after_injected": self.bot_api.retry_after_injected,
+            },
+            "simlam": {
+                "requests": dict(self.simlam.requests),
+                "errors_injected": self.simlam.errors_injected,
+                "rate_limited": self.simlam.rate_limited,
+                "pdfs_served": self.simlam.pdfs_served,
+                "requests_by_client": dict(self.simlam.requests_by_client),
+            },
+            "egress": (metrics or {}).get("egress"),
+            "memory": {
+                "peak_rss_mib": round(peak_kib / 1024, 1) if peak_kib else None,
+                "max_sampled_rss_mib": round(max(self.rss_samples) / 1024, 1) if self.rss_samples else None,
+            },
+            "bot_metrics": metrics,
+            "workdir": workdir,
+        }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def print_report(report: Dict) -> None:
+    cfg = report["config"]
+    print(f"Carga: {cfg['chats']} chats, {cfg['processes']} processos, {report['elapsed_s']} s "
+          f"({report['throughput_cmds_per_s']} comandos/s)")
+    print(f"\n{'comando':<10} {'ok':>5} {'timeout':>7}   {'1ª resposta p50/p95/p99 (s)':<29} {'resposta final p50/p95/p99/max (s)'}")
+    for kind, data in report["commands"].items():
+        first, final = data["first_reply_s"], data["final_reply_s"]
+        print(
+            f"{kind:<10} {data['completed']:>5} {data['timeouts']:>7}   "
+            f"{_fmt(first['p50']):>8} {_fmt(first['p95']):>8} {_fmt(first['p99']):>8}    "
+            f"{_fmt(final['p50']):>8} {_fmt(final['p95']):>8} {_fmt(final['p99']):>8} {_fmt(final['max']):>8}"
+        )
+    sweep = report["sweep"]
+    status = "concluída" if sweep["completed"] else f"incompleta ({sweep['checked']}/{sweep['processes']})"
+    print(f"\nVarredura: {status}; primeira verificação após {sweep['first_check_after_s']} s; "
+          f"duração {sweep['duration_s']} s ({sweep['checks_per_s']} verificações/s)")
+    notes = report["notifications"]
+    delay = notes["change_to_notification_s"]
+    print(f"Notificações: {notes['sent']} ({notes['per_s']}/s) para {notes['changes']} mudança(s); "
+          f"atraso mudança->notificação p50={_fmt(delay['p50'])} p95={_fmt(delay['p95'])} s")
+    print(f"Telegram: {report['telegram']['calls']}; 429 injetados: {report['telegram']['retry_after_injected']}")
+    print(f"SIMLAM: {sum(report['simlam']['requests'].values())} requisições, "
+          f"{report['simlam']['errors_injected']} erros injetados, {report['simlam']['rate_limited']} limitadas (429), "
+          f"{report['simlam']['pdfs_served']} PDFs")
+    if report["egress"]:
+        for route in report["egress"]["routes"]:
+            print(f"  rota {route['name']}: {route['lookups']} consultas, {route['requests']} requisições, "
+                  f"{route['failures']} falhas, nota {route['score']}, {route['ejections']} ejeções")
+    memory = report["memory"]
+    print(f"Memória do bot: pico (VmHWM) {memory['peak_rss_mib']} MiB; maior RSS amostrado {memory['max_sampled_rss_mib']} MiB")
+    if report["unsolicited_messages"]:
+        print(f"Mensagens fora de um comando pendente: {report['unsolicited_messages']}")
+    if report["workdir"]:
+        print(f"Arquivos do teste (banco, log do bot): {report['workdir']}")
+
+
+def _mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("status", "consulta", "listar", "monitorar"):
+            raise argparse.ArgumentTypeError(f"comando desconhecido no --mix: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def _range(value: str) -> List[float]:
+    low, _, high = value.partition(",")
+    return [float(low), float(high or low)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Teste de carga do bot contra Bot API e SIMLAM falsos.")
+    parser.add_argument("--chats", type=int, default=20, help="Chats simultâneos (padrão: 20).")
+    parser.add_argument("--processes", type=int, default=200, help="Processos pré-cadastrados para a varredura (padrão: 200).")
+    parser.add_argument("--duration", type=float, default=60, help="Duração da carga de comandos, em segundos (padrão: 60).")
+    parser.add_argument("--think", type=float, default=2.0, help="Pausa média entre comandos de um chat, em segundos (padrão: 2).")
+    parser.add_argument("--mix", type=_mix, default=_mix("status=4,consulta=3,listar=1,monitorar=1"),
+                        help="Pesos dos comandos (padrão: status=4,consulta=3,listar=1,monitorar=1).")
+    parser.add_argument("--status-batch", type=int, default=1, help="Processos por /status.")
+    parser.add_argument("--command-timeout", type=float, default=120, help="Desiste de um comando após N segundos.")
+    parser.add_argument("--change-rate", type=float, default=0.5, help="Mudanças de processo por segundo no SIMLAM falso.")
+    parser.add_argument("--simlam-latency", type=_range, default=[0.05, 0.3], help="Latência por requisição, 'mín,máx' em segundos.")
+    parser.add_argument("--simlam-error-rate", type=float, default=0.02, help="Fração de respostas 500 do SIMLAM.")
+    parser.add_argument("--pdf-error-rate", type=float, default=0.02, help="Fração de erros do SIMLAM ao gerar o PDF.")
+    parser.add_argument("--simlam-client-rate", type=float, default=0, help="Requisições/s por IP que o SIMLAM aceita (0 = sem limite).")
+    parser.add_argument("--proxies", type=int, default=0, help="Rotas de saída: quantos proxies locais o bot usa (0 = direto).")
+    parser.add_argument("--egress-rate", type=float, default=0, help="SIMLAM_EGRESS_RATE do bot (requisições/s por rota).")
+    parser.add_argument("--harvest-queries", default="",
+                        help="SIMLAM_HARVEST_QUERIES do bot (ex.: '/2024'): varredura da grade, que antecipa as verificações.")
+    parser.add_argument("--harvest-interval", type=int, default=15, help="SIMLAM_HARVEST_INTERVAL do bot, em segundos.")
+    parser.add_argument("--simlam-pause", default="0,0", help="SIMLAM_PAUSE_RANGE do bot (padrão: sem pausa).")
+    parser.add_argument("--retry-after-rate", type=float, default=0.01, help="Fração de sendMessage respondidos com 429.")
+    parser.add_argument("--retry-after-seconds", type=int, default=1, help="retry_after dos 429 injetados.")
+    parser.add_argument("--workers", type=int, default=4, help="SCRAPER_WORKERS do bot.")
+    parser.add_argument("--tick", type=int, default=5, help="SCHEDULER_TICK do bot, em segundos.")
+    parser.add_argument("--batch-size", type=int, default=25, help="SCHEDULER_BATCH_SIZE do bot.")
+    parser.add_argument("--sweep-timeout", type=float, default=300, help="Espera máxima pela varredura depois da carga.")
+    parser.add_argument("--database-url", help="Banco a usar (padrão: SQLite temporário). Use um banco descartável.")
+    parser.add_argument("--seed", type=int, default=None, help="Semente dos geradores aleatórios.")
+    parser.add_argument("--bot-log", help="Grava a saída do bot neste arquivo.")
+    parser.add_argument("--keep", action="store_true", help="Mantém o diretório temporário (banco e log).")
+    parser.add_argument("--json", help="Grava o relatório completo em JSON neste arquivo.")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
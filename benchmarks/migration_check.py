@@ -0,0 +1,185 @@
+"""
+Confere a migração de um banco criado pela versão original do bot (só monitored_processes,
+group_subscriptions e process_states sem colunas extras) para o esquema atual.
+
+Uso:
+    python benchmarks/migration_check.py
+
+Cria o esquema original em um SQLite temporário, com um processo monitorado e seu estado, roda
+database.init_db() e confere que todas as tabelas e colunas do esquema atual existem e que os
+dados antigos continuam lá. Depois, contra o SIMLAM falso de benchmarks/fake_services.py, roda
+check_single_process sobre esse banco migrado: o estado antigo (só timestamp) não pode gerar
+notificação, o fingerprint deve ser completado e uma tramitação nova deve ir para o outbox uma vez;
+um processo sem estado salvo grava o estado atual como base, sem notificar.
+Sai com código 1 se algo falhar.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Esquema da primeira versão do bot (database.py antes das tabelas de agenda, outbox etc.).
+BASELINE_SCHEMA = """
+CREATE TABLE monitored_processes (process_number VARCHAR NOT NULL, PRIMARY KEY (process_number));
+CREATE TABLE group_subscriptions (
+    chat_id VARCHAR NOT NULL, process_number VARCHAR NOT NULL, PRIMARY KEY (chat_id, process_number)
+);
+CREATE TABLE process_states (
+    process_number VARCHAR NOT NULL, last_timestamp VARCHAR NOT NULL, PRIMARY KEY (process_number)
+);
+INSERT INTO monitored_processes VALUES ('000001/2024');
+INSERT INTO group_subscriptions VALUES ('100', '000001/2024');
+INSERT INTO process_states VALUES ('000001/2024', '01/01/2024 08:00:00');
+"""
+
+
+def create_baseline(path: str) -> None:
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+
+
+def missing_schema(database) -> list:
+    """Tabelas/colunas do esquema atual que não existem no banco."""
+    from sqlalchemy import inspect
+
+    inspector = inspect(database.get_engine())
+    missing = []
+    for table in database.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{col.name}" for col in table.columns if col.name not in existing]
+    return missing
+
+
+def _start_fake_simlam():
+    """Sobe o SIMLAM falso numa thread com event loop próprio; retorna (simlam, url base)."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fake_services import FakeSimlam, start_site
+
+    simlam = FakeSimlam(latency=(0, 0))
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    ports = []
+
+    def _run():
+        asyncio.set_event_loop(loop)
+        ports.append(loop.run_until_complete(start_site(simlam.app()))[1])
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=_run, daemon=True).start()
+    started.wait()
+    return simlam, f"http://127.0.0.1:{ports[0]}/simlam/"
+
+
+def check_detection(database, simlam) -> list:
+    """Verificações automáticas sobre o banco migrado. Retorna a lista de falhas."""
+    from sqlalchemy import func, select, update
+
+    import bot
+
+    numero = "000001/2024"
+    context = SimpleNamespace(bot_data={"outbox": SimpleNamespace(wake=lambda: None)})
+
+    def state():
+        db = database.SessionLocal()
+        try:
+            row = db.execute(select(database.process_states).where(database.process_states.c.process_number == numero)).first()
+            queued = db.execute(select(func.count()).select_from(database.notification_outbox)).scalar()
+            return row, queued
+        finally:
+            db.close()
+
+    # Estado antigo igual ao atual do SIMLAM, sem fingerprint (gravado pela versão original).
+    db = database.SessionLocal()
+    try:
+        db.execute(update(database.process_states).values(last_timestamp=simlam.timestamp(numero)))
+        db.commit()
+    finally:
+        db.close()
+
+    failures = []
+    asyncio.run(bot.check_single_process(numero, context))
+    row, queued = state()
+    if queued:
+        failures.append(f"estado antigo sem mudança gerou {queued} notificação(ões)")
+    if not row.last_fingerprint:
+        failures.append("fingerprint não foi completado na primeira verificação")
+
+    simlam.bump(numero)
+    asyncio.run(bot.check_single_process(numero, context))
+    row, queued = state()
+    if queued != 1:
+        failures.append(f"tramitação nova gerou {queued} notificação(ões), esperado 1")
+    fingerprint = row.last_fingerprint
+
+    asyncio.run(bot.check_single_process(numero, context))
+    row, queued_again = state()
+    if queued_again != queued or row.last_fingerprint != fingerprint:
+        failures.append("verificação sem mudança alterou o estado ou notificou de novo")
+
+    # Processo monitorado sem estado salvo (ex.: importação interrompida): vira base, sem notificar.
+    numero = "000002/2024"
+    db = database.SessionLocal()
+    try:
+        db.execute(database.monitored_processes.insert().values(process_number=numero))
+        db.execute(database.group_subscriptions.insert().values(chat_id="100", process_number=numero))
+        db.commit()
+    finally:
+        db.close()
+    asyncio.run(bot.check_single_process(numero, context))
+    row, queued_new = state()
+    if queued_new != queued_again:
+        failures.append("processo sem estado salvo gerou notificação na primeira verificação")
+    if row is None or row.last_timestamp != simlam.timestamp(numero):
+        failures.append("processo sem estado salvo não teve o estado atual gravado como base")
+    return failures
+
+
+def main() -> int:
+    workdir = tempfile.mkdtemp(prefix="simlam-migration-")
+    path = os.path.join(workdir, "baseline.db")
+    create_baseline(path)
+    simlam, simlam_url = _start_fake_simlam()
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{path}",
+        "SIMLAM_BASE_URL": simlam_url,
+        "SIMLAM_PAUSE_RANGE": "0,0",
+    })
+    sys.path.insert(0, REPO_ROOT)
+    import database
+    from sqlalchemy import select
+
+    database.init_db()
+    missing = missing_schema(database)
+    if missing:
+        print(f"FALHA: faltam no banco migrado: {', '.join(missing)}")
+        return 1
+    db = database.SessionLocal()
+    try:
+        state = db.execute(select(database.process_states)).first()
+    finally:
+        db.close()
+
+    ok = True
+    if state is None or state.last_timestamp != "01/01/2024 08:00:00":
+        print(f"FALHA: o estado antigo não sobreviveu à migração: {state}")
+        ok = False
+    for failure in check_detection(database, simlam):
+        print(f"FALHA: {failure}")
+        ok = False
+    if ok:
+        print("OK: banco da versão original migrado para o esquema atual; detecção por fingerprint conferida.")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,45 +1,57 @@
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.error import TelegramError
 from telegram.helpers import escape_markdown
-from simlam_scraper import buscar_processo
+from simlam_scraper import buscar_processo, harvest_grid, LookupBudget, pdf_stats
 import logging
 import os
+import re
 import asyncio
-from flask import Flask
-from datetime import time
-import pytz
+import signal
 import random  # Adicionar import
-from sqlalchemy import select, insert, delete, update, func
+from sqlalchemy import select, insert, update, delete, func
 import threading
-from typing import Optional, List
+from concurrent.futures import Future
+from typing import Dict, Optional, List, Tuple
 import time as _time
+from datetime import datetime, timedelta
 
 # Importa as configurações do banco de dados
-from database import SessionLocal, monitored_processes, process_states, group_subscriptions, init_db
-
-
-# Configuração de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from database import SessionLocal, monitored_processes, process_states, process_index, group_subscriptions, chat_settings, init_db, upsert, insert_ignore
+import scheduler
+import outbox
+import scraper_pool
+import web_server
+import loop_watchdog
+import egress
+import log_setup
+import lookup_cache
+import grid_harvest
+from live_reply import LiveReply
+from notifier import NotificationDispatcher, DIGEST_DEFAULT_WINDOW
+from update_processor import PerChatUpdateProcessor, BOT_API_POOL_SIZE, BOT_API_POOL_TIMEOUT
+
+
+# Configuração de logging: feita em main() por log_setup (fila + thread de escrita, JSON opcional, amostragem).
 logger = logging.getLogger(__name__)
 
 TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL") # Garante que a variável de ambiente do DB seja lida
-
-# --- Flask App ---
-# This is a minimal web server to keep the bot alive on free hosting platforms.
-flask_app = Flask(__name__)
-
-@flask_app.route('/health')
-def health_check():
-    return "OK", 200
-
-def run_flask():
-    # Use a port assigned by the hosting platform, or 8080 as a default.
-    port = int(os.environ.get('PORT', 8080))
-    flask_app.run(host='0.0.0.0', port=port)
+# Servidor da Bot API (padrão: api.telegram.org). Usado com um Bot API local ou com o falso do benchmarks/loadtest.py.
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "").rstrip("/")
+
+def _prewarm_scraper_imports() -> None:
+    """
+    Carrega as dependências pesadas do scraper (PyMuPDF, BeautifulSoup, requests) em segundo plano,
+    depois que o healthcheck e o polling já subiram, para a primeira consulta não pagar esse custo.
+    """
+    _time.sleep(float(os.getenv("SCRAPER_PREWARM_DELAY", "5")))
+    try:
+        import requests  # noqa: F401
+        import bs4  # noqa: F401
+        import fitz  # noqa: F401
+    except Exception as e:
+        logger.warning("Falha ao pré-carregar dependências do scraper: %s", e)
 
 # --- Bot Logic ---
 
@@ -56,22 +68,70 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Verifica o status atual de processos já monitorados\\.\n\n"
         "🔹 `/listar`\n"
         "Mostra todos os seus processos monitorados\\.\n\n"
+        "🔹 `/resumo on [minutos]` ou `/resumo off`\n"
+        "Agrupa as atualizações em uma única mensagem a cada janela de tempo\\.\n\n"
+        "🔹 `/importar` \\(legenda de um arquivo \\.csv ou \\.txt\\)\n"
+        "Monitora de uma vez todos os processos listados no arquivo\\.\n\n"
         "_Dica: Para os comandos `/monitorar`, `/desmonitorar` e `/status`, você pode enviar vários números de uma vez, separados por vírgula\\._"
     )
     await update.effective_message.reply_text(start_message, parse_mode='MarkdownV2')
 
+def _queue_note(future) -> str:
+    """Complemento da mensagem de progresso com a posição na fila do scraper, quando houver espera."""
+    position = getattr(future, "queue_position", 0)
+    return f" Você é o {position}º na fila." if position else ""
+
+def _cached_note(future) -> str:
+    """Rodapé (MarkdownV2) de um resultado servido pelo cache há mais de um minuto."""
+    age = getattr(future, "cached_age", 0)
+    return f"\n\n_Consultado há {int(age // 60)} min\\._" if age >= 60 else ""
+
+def _submit_lookup(numero: str, chat_id: str) -> Future:
+    """
+    Consulta interativa de um processo: o resultado recente do cache (Future já resolvido, com
+    `cached_age` em segundos) ou uma nova consulta na fila do chat, que alimenta o cache ao terminar.
+    Levanta scraper_pool.Rejected se a fila estiver cheia.
+    """
+    hit = lookup_cache.get(numero)
+    if hit is not None:
+        future = Future()
+        future.set_result(hit[0])
+        future.queue_position = 0
+        future.cached_age = hit[1]
+        return future
+
+    def _store(done: Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            lookup_cache.put(numero, done.result())
+
+    future = scraper_pool.submit(buscar_processo, numero, key=chat_id)
+    future.add_done_callback(_store)
+    return future
+
 async def consultar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
     numero = update.effective_message.text.strip().strip('<>')
     if not numero.replace('/', '').isdigit() or not numero:
         await update.effective_message.reply_text("Por favor, envie um número de processo válido.")
         return
 
-    await update.effective_message.reply_text(f"🔎 Buscando informações do processo {numero}, aguarde...")
-    # Roda a função síncrona em uma thread separada para não bloquear o bot
-    resultado_data = await asyncio.to_thread(buscar_processo, numero)
+    # Resultado recente do cache, ou a função síncrona enfileirada no executor de scraping
+    # (fila do chat, à frente das verificações automáticas)
+    try:
+        future = _submit_lookup(numero, chat_id)
+    except scraper_pool.Rejected as e:
+        await update.effective_message.reply_text(f"⏳ {e}")
+        return
+    # Uma única mensagem: o "aguarde" é editado com o resultado (ou já sai com ele, se veio do cache)
+    progress = escape_markdown(f"🔎 Buscando informações do processo {numero}, aguarde...{_queue_note(future)}", version=2)
+    reply = LiveReply(update.effective_message, [progress], parse_mode='MarkdownV2')
+    if not future.done():
+        await reply.start()
+    resultado_data = await asyncio.wrap_future(future)
     # Escapa caracteres de Markdown para evitar erros de formatação
     resultado_escapado = escape_markdown(resultado_data.get('details', 'Não foi possível obter detalhes.'), version=2)
-    await update.effective_message.reply_text(resultado_escapado, parse_mode='MarkdownV2')
+    reply.set(0, resultado_escapado + _cached_note(future))
+    await reply.finish()
 
 async def monitorar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Adiciona um ou mais processos à lista de monitoramento do chat."""
@@ -81,18 +141,13 @@ async def monitorar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     numeros_str = " ".join(context.args)
-    numeros_processo = [num.strip('<>').strip() for num in numeros_str.split(',') if num.strip()]
+    numeros_processo = list(dict.fromkeys(num.strip('<>').strip() for num in numeros_str.split(',') if num.strip()))
 
     if not numeros_processo:
         await update.effective_message.reply_text("Por favor, forneça ao menos um número de processo válido.")
         return
-        
-    await update.effective_message.reply_text("Processando {} número(s)...".format(len(numeros_processo)))
-
-    adicionados = []
-    ja_monitorados = []
-    erros = []
 
+    novos = []
     db = SessionLocal()
     try:
         # Busca processos que este chat já monitora
@@ -100,70 +155,71 @@ async def monitorar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_monitored_set = {row[0] for row in db.execute(query)}
 
         for numero in numeros_processo:
-            if not numero.replace('/', '').isdigit() or not numero:
-                erros.append(f"{numero} (inválido)")
-                continue
-
-            if numero not in user_monitored_set:
+            if numero.replace('/', '').isdigit() and numero not in user_monitored_set:
                 # 1. Adiciona à lista de monitoramento global apenas se não existir
-                query_exists = select(monitored_processes).where(monitored_processes.c.process_number == numero)
-                exists = db.execute(query_exists).first()
-                if not exists:
-                    stmt_global = insert(monitored_processes).values(process_number=numero)
-                    db.execute(stmt_global)
-
+                insert_ignore(db, monitored_processes, {"process_number": numero})
                 # 2. Cria a inscrição para este chat
-                stmt_sub = insert(group_subscriptions).values(chat_id=chat_id, process_number=numero)
-                db.execute(stmt_sub)
-                
-                # Busca o estado atual para responder ao usuário e armazena se for novo
-                try:
-                    resultado_data = await asyncio.to_thread(buscar_processo, numero)
-                    
-                    # Armazena o timestamp inicial, se o processo ainda não estiver no DB de estados
-                    if timestamp := resultado_data.get('timestamp'):
-                        state_query = select(process_states).where(process_states.c.process_number == numero)
-                        if not db.execute(state_query).first():
-                            state_stmt = insert(process_states).values(process_number=numero, last_timestamp=timestamp)
-                            db.execute(state_stmt)
-                    
-                    # Envia a mensagem com o status atual
-                    numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
-                    details = resultado_data.get('details', 'Não foi possível obter os detalhes do processo no momento.')
-                    details_escapado = escape_markdown(details, version=2)
-                    
-                    message = (
-                        f"✅ Processo {numero_escapado} agora está sendo monitorado\\.\n\n"
-                        f"*Situação atual:*\n{details_escapado}"
-                    )
-                    await update.effective_message.reply_text(message, parse_mode='MarkdownV2')
-                    adicionados.append(numero)
+                db.execute(insert(group_subscriptions).values(chat_id=chat_id, process_number=numero))
+                novos.append(numero)
 
-                except Exception as e:
-                    logger.error(f"Falha ao buscar estado inicial para {numero}: {e}")
-                    erros.append(f"{numero} (falha ao buscar)")
-            else:
-                ja_monitorados.append(numero)
-        
+        # Grava as inscrições antes de consultar o SIMLAM: a transação não fica aberta durante o scraping.
         db.commit()
-
     except Exception as e:
-        logger.error(f"Erro de banco de dados em /monitorar: {e}", exc_info=True)
+        logger.error("Erro de banco de dados em /monitorar: %s", e, exc_info=True)
         db.rollback()
         await update.effective_message.reply_text("Ocorreu um erro ao processar sua solicitação. Tente novamente.")
         return
     finally:
         db.close()
 
-    # Monta a mensagem de resumo para o que não foi reportado individualmente
-    reply_parts = []
-    if ja_monitorados:
-        reply_parts.append(f"ℹ️ Já estavam monitorados: {', '.join(ja_monitorados)}")
-    if erros:
-        reply_parts.append(f"⚠️ Erros: {', '.join(erros)}")
-    
-    if reply_parts:
-        await update.effective_message.reply_text("\n".join(reply_parts))
+    # Uma seção por número, atualizada conforme a situação atual de cada processo novo chega.
+    sections = []
+    lookups = {}
+    for numero in numeros_processo:
+        numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
+        if numero not in novos:
+            if not numero.replace('/', '').isdigit():
+                sections.append(f"⚠️ {numero_escapado} \\(inválido\\)")
+            else:
+                sections.append(f"ℹ️ O processo {numero_escapado} já estava monitorado\\.")
+            continue
+        try:
+            lookups[len(sections)] = (numero, _submit_lookup(numero, chat_id))
+            sections.append(f"⏳ {numero_escapado}: buscando a situação atual\\.\\.\\.")
+        except scraper_pool.Rejected:
+            sections.append(
+                f"✅ Processo {numero_escapado} agora está sendo monitorado\\. A fila de consultas está cheia: "
+                "a situação atual virá na próxima verificação automática\\."
+            )
+
+    first = next(iter(lookups.values()), None)
+    note = _queue_note(first[1]) if first else ""
+    header = escape_markdown(f"Processando {len(numeros_processo)} número(s)...{note}", version=2)
+    reply = LiveReply(update.effective_message, sections, header=header, parse_mode='MarkdownV2')
+    if any(not future.done() for _, future in lookups.values()):
+        await reply.start()
+
+    async def resolve(index: int, numero: str, future: Future) -> None:
+        numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
+        try:
+            resultado_data = await asyncio.wrap_future(future)
+            # Armazena o estado inicial, se o processo ainda não estiver no DB de estados, e agenda a
+            # próxima verificação a partir dele.
+            await asyncio.to_thread(_db_store_initial_state, numero, resultado_data.get('timestamp'), resultado_data.get('fingerprint'))
+        except Exception as e:
+            logger.error("Falha ao buscar estado inicial para %s: %s", numero, e)
+            reply.set(index, f"✅ Processo {numero_escapado} agora está sendo monitorado\\. ⚠️ Falha ao buscar a situação atual\\.")
+            return
+        details = resultado_data.get('details', 'Não foi possível obter os detalhes do processo no momento.')
+        details_escapado = escape_markdown(details, version=2)
+        reply.set(
+            index,
+            f"✅ Processo {numero_escapado} agora está sendo monitorado\\.\n\n"
+            f"*Situação atual:*\n{details_escapado}{_cached_note(future)}",
+        )
+
+    await asyncio.gather(*(resolve(index, numero, future) for index, (numero, future) in lookups.items()))
+    await reply.finish()
 
 async def desmonitorar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove um ou mais processos da lista de monitoramento do chat."""
@@ -197,6 +253,7 @@ async def desmonitorar(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Se ninguém mais monitora, remove da lista global
                 stmt_delete_global = delete(monitored_processes).where(monitored_processes.c.process_number == numero)
                 db.execute(stmt_delete_global)
+                scheduler.forget_process(db, numero)
         
         db.commit()
         
@@ -215,17 +272,293 @@ async def desmonitorar(update: Update, context: ContextTypes.DEFAULT_TYPE):
              await update.effective_message.reply_text("Nenhum dos processos informados estava na sua lista.")
 
     except Exception as e:
-        logger.error(f"Erro de banco de dados em /desmonitorar: {e}", exc_info=True)
+        logger.error("Erro de banco de dados em /desmonitorar: %s", e, exc_info=True)
         db.rollback()
         await update.effective_message.reply_text("Ocorreu um erro ao remover os processos. Tente novamente.")
     finally:
         db.close()
 
 
-async def fetch_process_for_list(numero: str) -> str:
-    """Busca um processo e retorna uma string formatada para o comando /listar."""
+async def resumo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Liga/desliga o modo resumo: as atualizações de uma janela de tempo chegam em uma única mensagem."""
+    chat_id = str(update.effective_chat.id)
+    args = [a.lower() for a in (context.args or [])]
+
+    def _db_get_settings():
+        db = SessionLocal()
+        try:
+            query = select(chat_settings.c.digest_enabled, chat_settings.c.digest_window).where(chat_settings.c.chat_id == chat_id)
+            return db.execute(query).first()
+        finally:
+            db.close()
+
+    def _db_set_settings(enabled: bool, window: Optional[int]):
+        db = SessionLocal()
+        try:
+            upsert(db, chat_settings, {"chat_id": chat_id, "digest_enabled": enabled, "digest_window": window}, ["chat_id"])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    try:
+        if not args:
+            row = await asyncio.to_thread(_db_get_settings)
+            if row and row.digest_enabled:
+                minutos = (row.digest_window or DIGEST_DEFAULT_WINDOW) // 60
+                await update.effective_message.reply_text(f"🗞️ Modo resumo ativado: atualizações agrupadas a cada {minutos} min. Use /resumo off para desativar.")
+            else:
+                await update.effective_message.reply_text("Modo resumo desativado: cada atualização chega em uma mensagem. Use /resumo on [minutos] para ativar.")
+            return
+
+        if args[0] in ("on", "ligar", "ativar"):
+            window = None
+            if len(args) > 1:
+                if not args[1].isdigit() or not (1 <= int(args[1]) <= 24 * 60):
+                    await update.effective_message.reply_text("Informe a janela em minutos (1 a 1440). Ex.: /resumo on 30")
+                    return
+                window = int(args[1]) * 60
+            await asyncio.to_thread(_db_set_settings, True, window)
+            minutos = (window or DIGEST_DEFAULT_WINDOW) // 60
+            await update.effective_message.reply_text(f"🗞️ Modo resumo ativado: as atualizações serão agrupadas a cada {minutos} min.")
+        elif args[0] in ("off", "desligar", "desativar"):
+            await asyncio.to_thread(_db_set_settings, False, None)
+            await update.effective_message.reply_text("Modo resumo desativado: cada atualização chegará em uma mensagem.")
+        else:
+            await update.effective_message.reply_text("Uso: /resumo on [minutos] | /resumo off")
+    except Exception as e:
+        logger.error("Erro de banco de dados em /resumo: %s", e, exc_info=True)
+        await update.effective_message.reply_text("Ocorreu um erro ao salvar sua preferência. Tente novamente.")
+
+
+# --- Importação em massa (/importar) ---
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(1024 * 1024)))
+IMPORT_MAX_PROCESSES = int(os.getenv("IMPORT_MAX_PROCESSES", "5000"))
+# Consultas de estado inicial de uma importação em andamento ao mesmo tempo (na fila de fundo do scraper).
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "2"))
+# Intervalo mínimo entre edições da mensagem de progresso (o Telegram limita edições).
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "5"))
+_IMPORT_EXTENSIONS = (".csv", ".txt")
+_import_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _parse_import_file(data: bytes) -> Tuple[List[str], List[str]]:
+    """Extrai os números de processo (sem repetição, na ordem do arquivo) e os itens inválidos."""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = data.decode("latin-1")
+    numeros, invalidos, vistos = [], [], set()
+    for token in re.split(r"[\s,;\"']+", text):
+        token = token.strip("<>")
+        if not any(ch.isdigit() for ch in token):
+            continue  # vazio ou texto (ex.: cabeçalho do CSV)
+        if not token.replace("/", "").isdigit():
+            invalidos.append(token)
+            continue
+        if token not in vistos:
+            vistos.add(token)
+            numeros.append(token)
+    return numeros, invalidos
+
+
+def _db_import_subscriptions(chat_id: str, numeros: List[str]) -> Tuple[List[str], int, List[str]]:
+    """
+    Inscreve o chat em todos os processos em uma única transação.
+    Retorna (novos para o chat, quantos já eram monitorados pelo chat, novos ainda sem estado inicial).
+    """
+    db = SessionLocal()
+    try:
+        query = select(group_subscriptions.c.process_number).where(group_subscriptions.c.chat_id == chat_id)
+        existing = {row[0] for row in db.execute(query)}
+        novos = [numero for numero in numeros if numero not in existing]
+        if not novos:
+            return [], len(numeros), []
+
+        insert_ignore(db, monitored_processes, [{"process_number": numero} for numero in novos])
+        insert_ignore(db, group_subscriptions, [{"chat_id": chat_id, "process_number": numero} for numero in novos])
+
+        with_state = set()
+        for i in range(0, len(novos), 500):
+            chunk = novos[i:i + 500]
+            state_query = select(process_states.c.process_number).where(process_states.c.process_number.in_(chunk))
+            with_state.update(row[0] for row in db.execute(state_query))
+        sem_estado = [numero for numero in novos if numero not in with_state]
+
+        # A importação busca o estado inicial em segundo plano; até lá, o agendador não pega esses processos.
+        # (Se a busca não chegar a um deles, a verificação automática grava o estado como base, sem notificar.)
+        scheduler.schedule_first_check(db, sem_estado, datetime.utcnow() + timedelta(seconds=scheduler.MAX_INTERVAL))
+        db.commit()
+        return novos, len(numeros) - len(novos), sem_estado
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _db_store_initial_state(numero: str, timestamp: Optional[str], fingerprint: Optional[str] = None) -> None:
+    db = SessionLocal()
+    try:
+        if timestamp:
+            insert_ignore(db, process_states, {"process_number": numero, "last_timestamp": timestamp, "last_fingerprint": fingerprint})
+        # Sem timestamp, a verificação automática tenta de novo em CHECK_RETRY_INTERVAL.
+        scheduler.record_check(db, numero, timestamp, changed=False, ok=bool(timestamp))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _db_make_due(numeros: List[str]) -> None:
+    db = SessionLocal()
+    try:
+        scheduler.make_due(db, numeros, datetime.utcnow())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _fetch_initial_states(bot, chat_id: str, message_id: int, header: str, numeros: List[str]) -> None:
+    """Busca o estado inicial dos processos importados, editando a mensagem de progresso."""
+    semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    draining = _get_drain_event()
+    counts = {"done": 0, "ok": 0}
+    stored = set()  # processos cuja consulta terminou e foi gravada (com ou sem timestamp)
+    last_edit = 0.0
+
+    async def edit_progress(final: bool = False) -> None:
+        nonlocal last_edit
+        now = _time.monotonic()
+        if not final and now - last_edit < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_edit = now
+        total, done, ok = len(numeros), counts["done"], counts["ok"]
+        if not final:
+            status_line = f"⏳ Buscando estado inicial: {done}/{total}..."
+        elif done < total:
+            status_line = f"⏸️ Importação interrompida em {done}/{total}. Os demais serão verificados automaticamente."
+        else:
+            status_line = f"✅ Estado inicial obtido para {ok}/{total} processo(s)."
+            if ok < total:
+                status_line += f" Os outros {total - ok} serão verificados automaticamente."
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=f"{header}\n\n{status_line}")
+        except TelegramError as e:
+            # Ex.: "message is not modified" ou RetryAfter; a próxima edição atualiza.
+            logger.debug("Não foi possível atualizar o progresso da importação do chat %s: %s", chat_id, e)
+
+    async def fetch_one(numero: str) -> None:
+        async with semaphore:
+            if draining.is_set():
+                return
+            try:
+                resultado_data = await scraper_pool.run(buscar_processo, numero, priority=scraper_pool.BACKGROUND)
+                timestamp = resultado_data.get('timestamp')
+                await asyncio.to_thread(_db_store_initial_state, numero, timestamp, resultado_data.get('fingerprint'))
+                stored.add(numero)
+                if timestamp:
+                    counts["ok"] += 1
+            except Exception as e:
+                logger.error("Falha ao buscar estado inicial de %s (importação do chat %s): %s", numero, chat_id, e)
+            counts["done"] += 1
+        await edit_progress()
+
+    try:
+        await asyncio.gather(*(fetch_one(numero) for numero in numeros))
+    finally:
+        # Desligamento ou falha: os que ficaram sem estado voltam a ser devidos já, em vez de esperar
+        # a primeira verificação marcada para daqui a CHECK_MAX_INTERVAL.
+        leftovers = [numero for numero in numeros if numero not in stored]
+        if leftovers:
+            try:
+                await asyncio.to_thread(_db_make_due, leftovers)
+            except Exception as e:
+                logger.error("Falha ao reagendar %d processo(s) da importação do chat %s: %s", len(leftovers), chat_id, e)
+        await edit_progress(final=True)
+        logger.info("Importação do chat %s: %s/%s estado(s) inicial(is) obtido(s).", chat_id, counts['ok'], len(numeros))
+
+
+async def importar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Monitora em massa os processos de um arquivo .csv/.txt, enviado com a legenda /importar
+    (ou respondido com /importar). As inscrições entram em uma transação e a resposta é imediata;
+    o estado inicial de cada processo é buscado em segundo plano, com baixa prioridade.
+    """
+    message = update.effective_message
+    chat_id = str(update.effective_chat.id)
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await message.reply_text("Uso: envie um arquivo .csv ou .txt com os números dos processos e a legenda /importar (ou responda ao arquivo com /importar).")
+        return
+    if not (document.file_name or "").lower().endswith(_IMPORT_EXTENSIONS):
+        await message.reply_text("Formato não suportado. Envie um arquivo .csv ou .txt.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply_text(f"Arquivo grande demais (limite de {IMPORT_MAX_BYTES // 1024} KB).")
+        return
+    running = _import_tasks.get(chat_id)
+    if running and not running.done():
+        await message.reply_text("Já existe uma importação em andamento neste chat. Aguarde ela terminar.")
+        return
+
+    try:
+        telegram_file = await document.get_file()
+        data = bytes(await telegram_file.download_as_bytearray())
+    except TelegramError as e:
+        logger.error("Falha ao baixar o arquivo de importação do chat %s: %s", chat_id, e)
+        await message.reply_text("Não consegui baixar o arquivo. Tente novamente.")
+        return
+
+    numeros, invalidos = _parse_import_file(data)
+    if not numeros:
+        await message.reply_text("Nenhum número de processo válido encontrado no arquivo.")
+        return
+    if len(numeros) > IMPORT_MAX_PROCESSES:
+        await message.reply_text(f"O arquivo tem {len(numeros)} processos; o limite por importação é {IMPORT_MAX_PROCESSES}.")
+        return
+
+    try:
+        novos, ja_monitorados, sem_estado = await asyncio.to_thread(_db_import_subscriptions, chat_id, numeros)
+    except Exception as e:
+        logger.error("Erro de banco de dados em /importar: %s", e, exc_info=True)
+        await message.reply_text("Ocorreu um erro ao importar os processos. Nada foi alterado; tente novamente.")
+        return
+
+    header_parts = [f"📥 Importação: {len(novos)} processo(s) adicionado(s) ao monitoramento."]
+    if ja_monitorados:
+        header_parts.append(f"ℹ️ {ja_monitorados} já estavam monitorados.")
+    if invalidos:
+        exemplos = ", ".join(invalidos[:5]) + ("..." if len(invalidos) > 5 else "")
+        header_parts.append(f"⚠️ {len(invalidos)} item(ns) inválido(s) ignorado(s): {exemplos}")
+    header = "\n".join(header_parts)
+
+    if not sem_estado:
+        await message.reply_text(header)
+        return
+    progress = await message.reply_text(f"{header}\n\n⏳ Buscando estado inicial: 0/{len(sem_estado)}...")
+    # Tarefa solta (não application.create_task): o desligamento não deve esperar uma importação longa.
+    task = asyncio.create_task(
+        _fetch_initial_states(context.bot, chat_id, progress.message_id, header, sem_estado),
+        name=f"import:{chat_id}",
+    )
+    _import_tasks[chat_id] = task
+    task.add_done_callback(lambda t: _import_tasks.pop(chat_id, None) if _import_tasks.get(chat_id) is t else None)
+
+
+async def fetch_process_for_list(numero: str, lookup: Optional[Future]) -> str:
+    """Aguarda a busca de um processo (None se a fila recusou) e retorna uma string formatada para o comando /listar."""
+    if lookup is None:
+        return f"- {numero} - (Fila de consultas cheia, tente de novo mais tarde)"
     try:
-        resultado_data = await asyncio.to_thread(buscar_processo, numero)
+        resultado_data = await asyncio.wrap_future(lookup)
         empreendimento = resultado_data.get('details', '').split('\n')[1] # Pega a segunda linha da resposta formatada
         if 'Empreendimento:' in empreendimento:
             empreendimento_nome = empreendimento.replace('Empreendimento:', '').strip()
@@ -243,10 +576,18 @@ async def listar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_processes = [row[0] for row in db.execute(query)]
         
         if user_processes:
-            await update.effective_message.reply_text(f"Buscando detalhes de {len(user_processes)} processo(s), isso pode levar um momento...")
+            # Enfileira todas as buscas na fila do chat (as recentes vêm do cache); o executor as intercala
+            # com as de outros chats e limita quantas rodam ao mesmo tempo.
+            lookups = {}
+            for p in user_processes:
+                try:
+                    lookups[p] = _submit_lookup(p, chat_id)
+                except scraper_pool.Rejected:
+                    break
+            note = _queue_note(lookups[user_processes[0]]) if lookups else ""
+            await update.effective_message.reply_text(f"Buscando detalhes de {len(user_processes)} processo(s), isso pode levar um momento...{note}")
             
-            # Cria e executa as tarefas de busca em paralelo
-            tasks = [fetch_process_for_list(p) for p in user_processes]
+            tasks = [fetch_process_for_list(p, lookups.get(p)) for p in user_processes]
             results = await asyncio.gather(*tasks)
             
             lista = "\n".join(results)
@@ -256,6 +597,29 @@ async def listar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     finally:
         db.close()
 
+def _format_status(numero: str, resultado_data: dict, last_timestamp: Optional[str]) -> str:
+    """Seção (MarkdownV2) do /status de um processo, a partir do resultado da consulta."""
+    numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
+    current_details = resultado_data.get('details')
+    current_timestamp = resultado_data.get('timestamp')
+
+    if not current_details:
+        return f"⚠️ Não foi possível obter detalhes para o processo {numero_escapado}\\. Motivo: Nenhum detalhe retornado\\."
+
+    estado_escapado = escape_markdown(current_details, version=2)
+
+    message_header = f"*Situação atual do processo {numero_escapado}:*\n\n"
+    message_body = f"{estado_escapado}"
+
+    if last_timestamp == current_timestamp and current_timestamp is not None:
+        update_info = "\n\n*Status:* Sem novas atualizações desde a última verificação automática\\."
+    elif current_timestamp is None:
+        update_info = "\n\n*Status:* Não foi possível determinar o status de atualização \\(sem data de tramitação\\)\\."
+    else:
+        update_info = "\n\n*Status:* 📢 *Houve uma atualização desde a última verificação automática\\!*"
+
+    return message_header + message_body + update_info
+
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Verifica o status atual de um ou mais processos monitorados, sob demanda."""
     chat_id = str(update.effective_chat.id)
@@ -270,8 +634,6 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_message.reply_text("Por favor, forneça ao menos um número de processo.")
         return
 
-    await update.effective_message.reply_text(f"🔎 Verificando status de {len(numeros_processo)} processo(s), aguarde...")
-    
     db = SessionLocal()
     try:
         # Busca os processos que o usuário monitora para validação
@@ -283,166 +645,542 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Busca os estados dos processos
         states_query = select(process_states).where(process_states.c.process_number.in_(numeros_processo))
         process_states_map = {row.process_number: row.last_timestamp for row in db.execute(states_query)}
+    finally:
+        db.close()
 
-        for numero in numeros_processo:
+    # Dispara todas as consultas de uma vez (cache ou fila do chat, que limita quantas rodam juntas) e
+    # responde com uma única mensagem, com uma seção por processo, editada conforme os resultados chegam.
+    sections = []
+    lookups = {}
+    futures = {}
+    for numero in numeros_processo:
+        numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
+        if not numero.replace('/', '').isdigit() or not numero:
+            sections.append(f"⚠️ O número de processo '{numero_escapado}' é inválido\\.")
+            continue
+
+        if numero not in user_monitored_set:
+            sections.append(f"❌ Você não está monitorando o processo {numero_escapado}\\. Use /monitorar para adicioná\\-lo\\.")
+            continue
+
+        if numero not in futures:
+            try:
+                futures[numero] = _submit_lookup(numero, chat_id)
+            except scraper_pool.Rejected as e:
+                futures[numero] = e
+        future = futures[numero]
+        if isinstance(future, scraper_pool.Rejected):
+            sections.append(f"⏳ {numero_escapado}: {escape_markdown(str(future), version=2)}")
+            continue
+        lookups[len(sections)] = (numero, future)
+        if future.done():
+            # Resultado do cache ou de uma consulta já concluída, que também pode ter terminado em erro.
+            try:
+                sections.append(_format_status(numero, future.result(), process_states_map.get(numero)) + _cached_note(future))
+            except Exception as e:
+                logger.error("Erro ao verificar o status do processo %s: %s", numero, e, exc_info=True)
+                sections.append(f"⚠️ Ocorreu um erro ao verificar o processo {numero_escapado}\\. Tente novamente mais tarde\\.")
+        else:
+            sections.append(f"⏳ {numero_escapado}: consultando\\.\\.\\.")
+
+    pending = {index: lookup for index, lookup in lookups.items() if not lookup[1].done()}
+    note = _queue_note(next(iter(pending.values()))[1]) if pending else ""
+    header = escape_markdown(f"🔎 Verificando status de {len(numeros_processo)} processo(s), aguarde...{note}", version=2)
+    reply = LiveReply(update.effective_message, sections, header=header, parse_mode='MarkdownV2')
+    if pending:
+        await reply.start()
+
+    async def resolve(index: int, numero: str, future: Future) -> None:
+        try:
+            resultado_data = await asyncio.wrap_future(future)
+            reply.set(index, _format_status(numero, resultado_data, process_states_map.get(numero)))
+        except Exception as e:
+            logger.error("Erro ao verificar o status do processo %s: %s", numero, e, exc_info=True)
             numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
-            if not numero.replace('/', '').isdigit() or not numero:
-                await update.effective_message.reply_text(f"⚠️ O número de processo '{numero_escapado}' é inválido\\.", parse_mode='MarkdownV2')
-                continue
+            reply.set(index, f"⚠️ Ocorreu um erro ao verificar o processo {numero_escapado}\\. Tente novamente mais tarde\\.")
 
-            if numero not in user_monitored_set:
-                await update.effective_message.reply_text(f"❌ Você não está monitorando o processo {numero_escapado}\\. Use /monitorar para adicioná\\-lo\\.", parse_mode='MarkdownV2')
-                continue
+    await asyncio.gather(*(resolve(index, numero, future) for index, (numero, future) in pending.items()))
+    await reply.finish()
 
-            try:
-                resultado_data = await asyncio.to_thread(buscar_processo, numero)
-                current_details = resultado_data.get('details')
-                current_timestamp = resultado_data.get('timestamp')
-                
-                if not current_details:
-                    await update.effective_message.reply_text(f"⚠️ Não foi possível obter detalhes para o processo {numero_escapado}\\. Motivo: Nenhum detalhe retornado\\.", parse_mode='MarkdownV2')
-                    continue
-
-                last_timestamp = process_states_map.get(numero)
-                estado_escapado = escape_markdown(current_details, version=2)
-                
-                message_header = f"*Situação atual do processo {numero_escapado}:*\n\n"
-                message_body = f"{estado_escapado}"
-                
-                if last_timestamp == current_timestamp and current_timestamp is not None:
-                    update_info = "\n\n*Status:* Sem novas atualizações desde a última verificação automática\\."
-                elif current_timestamp is None:
-                    update_info = "\n\n*Status:* Não foi possível determinar o status de atualização \\(sem data de tramitação\\)\\."
-                else:
-                    update_info = "\n\n*Status:* 📢 *Houve uma atualização desde a última verificação automática\\!*"
-
-                full_message = message_header + message_body + update_info
-                await update.effective_message.reply_text(full_message, parse_mode='MarkdownV2')
-            except Exception as e:
-                logger.error(f"Erro ao verificar o status do processo {numero}: {e}", exc_info=True)
-                await update.effective_message.reply_text(f"⚠️ Ocorreu um erro ao verificar o processo {numero_escapado}\\. Tente novamente mais tarde\\.", parse_mode='MarkdownV2')
+# Folga, além do prazo da consulta (SIMLAM_LOOKUP_TIMEOUT), antes de abandonar a thread do scraper.
+LOOKUP_GRACE_SECONDS = float(os.getenv("SIMLAM_LOOKUP_GRACE", "15"))
+
+
+def _db_record_check(process_number: str, timestamp: Optional[str], changed: bool, ok: bool, fingerprint: Optional[str] = None,
+                     entity_id: Optional[str] = None) -> int:
+    db = SessionLocal()
+    try:
+        if entity_id:
+            # Id interno novo ou diferente do índice: a próxima consulta pula a busca.
+            grid_harvest.remember_entity_id(db, process_number, entity_id)
+        if fingerprint:
+            # Estado salvo antes do fingerprint existir: completa sem notificar (nada mudou).
+            db.execute(
+                update(process_states)
+                .where(process_states.c.process_number == process_number)
+                .values(last_fingerprint=fingerprint)
+            )
+        interval = scheduler.record_check(db, process_number, timestamp, changed=changed, ok=ok)
+        db.commit()
+        return interval
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
+
 async def check_single_process(numero: str, context: ContextTypes.DEFAULT_TYPE):
     """Lógica para verificar um único processo e notificar os assinantes."""
+    ok = False
+    changed = False
+    current_timestamp = None
+    backfill_fingerprint = None
+    new_entity_id = None
+    # Caminho quente da varredura: logs com % (formatados só se emitidos, na thread do log_setup) e campos estruturados.
+    log_ctx = {"processo": numero}
     try:
-        logger.info(f"Verificando processo: {numero}")
+        logger.info("Verificando processo: %s", numero, extra=log_ctx)
 
         # IMPORTANTE: DB é síncrono. Se o Postgres estiver instável, db.execute pode travar o event loop
         # e o bot inteiro para de responder. Por isso, todo acesso ao DB aqui roda em thread.
-        def _db_get_last_timestamp(process_number: str) -> Optional[str]:
+        def _db_get_last_state(process_number: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
             db = SessionLocal()
             try:
-                state_query = select(process_states.c.last_timestamp).where(process_states.c.process_number == process_number)
-                return db.execute(state_query).scalar_one_or_none()
+                state_query = select(process_states.c.last_timestamp, process_states.c.last_fingerprint).where(
+                    process_states.c.process_number == process_number
+                )
+                row = db.execute(state_query).first()
+                entity_id = db.execute(
+                    select(process_index.c.entity_id).where(process_index.c.process_number == process_number)
+                ).scalar()
+                return (row.last_timestamp, row.last_fingerprint, entity_id) if row else (None, None, entity_id)
             finally:
                 db.close()
 
-        last_timestamp_result = await asyncio.to_thread(_db_get_last_timestamp, numero)
-
-        resultado_data = None
-        for attempt in range(1, 4):
-            resultado_data = await asyncio.to_thread(buscar_processo, numero)
-            current_timestamp = resultado_data.get('timestamp')
-            if current_timestamp:
-                break
-            if attempt < 3:
-                logger.warning(f"Tentativa {attempt}/3 falhou para {numero} (sem timestamp). Detalhes: {resultado_data.get('details')}. Tentando de novo em 5s...")
-                await asyncio.sleep(5)
-            else:
-                logger.error(f"Falha ao obter timestamp para {numero} após 3 tentativas. Detalhes: {resultado_data.get('details')}")
-                return # Encerra a verificação para este processo
+        last_timestamp_result, last_fingerprint, known_entity_id = await asyncio.to_thread(_db_get_last_state, numero)
+
+        # Um único prazo/orçamento de tentativas para toda a consulta (as novas tentativas acontecem
+        # dentro de buscar_processo). A thread não pode ser cancelada, mas respeita o prazo sozinha;
+        # o wait_for garante que a vaga no semáforo seja liberada mesmo assim.
+        # Verificações automáticas vão para a fila de fundo: comandos de usuários passam na frente.
+        # O prazo conta desde já, incluindo a espera na fila.
+        budget = LookupBudget()
+        try:
+            resultado_data = await asyncio.wait_for(
+                scraper_pool.run(
+                    buscar_processo, numero, budget=budget, known_fingerprint=last_fingerprint,
+                    entity_id=known_entity_id if grid_harvest.USE_ID_INDEX else None, priority=scraper_pool.BACKGROUND,
+                ),
+                timeout=budget.timeout + LOOKUP_GRACE_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            logger.error("Consulta do processo %s excedeu o prazo de %.0fs. Abandonando.", numero, budget.timeout, extra=log_ctx)
+            return
 
         current_timestamp = resultado_data.get('timestamp')
         current_details = resultado_data.get('details')
+        current_fingerprint = resultado_data.get('fingerprint')
 
         if not current_timestamp:
-            return
-
-        if last_timestamp_result != current_timestamp:
-            logger.info(f"Atualização encontrada para o processo {numero}!")
+            logger.error(
+                "Falha ao obter timestamp para %s após %d tentativa(s). Detalhes: %s", numero, budget.attempts_used, current_details, extra=log_ctx
+            )
+            return # Encerra a verificação para este processo
+
+        ok = True
+        if last_timestamp_result is None:
+            # Sem estado salvo (ex.: busca do estado inicial de uma importação interrompida): grava a
+            # linha de base sem notificar; o que o processo tem hoje não é novidade para o chat.
+            def _db_store_baseline(process_number: str, ts: str, fingerprint: Optional[str]) -> None:
+                db = SessionLocal()
+                try:
+                    insert_ignore(db, process_states, {"process_number": process_number, "last_timestamp": ts, "last_fingerprint": fingerprint})
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.close()
 
-            def _db_upsert_timestamp_and_get_subscribers(process_number: str, ts: str) -> List[str]:
+            await asyncio.to_thread(_db_store_baseline, numero, current_timestamp, current_fingerprint)
+            logger.info("Processo %s sem estado salvo: estado atual gravado como base, sem notificar.", numero, extra=log_ctx)
+            last_timestamp_result, last_fingerprint = current_timestamp, current_fingerprint
+        if resultado_data.get('entity_id') != known_entity_id:
+            new_entity_id = resultado_data.get('entity_id')
+        novas = resultado_data.get('novas_tramitacoes')
+        if not (novas and len(novas) > 1):
+            # Resultado fresco para os comandos (/status, consulta...). Com várias tramitações novas,
+            # 'details' lista todas, o que não serve como "situação atual".
+            lookup_cache.put(numero, resultado_data)
+        # Compara a última tramitação inteira (tipo, data e setor) quando há fingerprint salvo; estados
+        # antigos, só com o timestamp, continuam comparados pelo timestamp até a primeira atualização.
+        if last_fingerprint and current_fingerprint:
+            changed = current_fingerprint != last_fingerprint
+        else:
+            changed = last_timestamp_result != current_timestamp
+        if changed:
+            logger.info(
+                "Atualização encontrada para o processo %s! (%s tramitação(ões) nova(s))",
+                numero, len(novas) if novas is not None else "?", extra=log_ctx,
+            )
+
+            def _db_record_update(process_number: str, ts: str, fingerprint: Optional[str], details: str) -> int:
+                """
+                Avança o estado e grava as notificações no outbox na mesma transação: se o bot cair ou o
+                Telegram falhar, a atualização continua pendente em vez de se perder.
+                """
                 db = SessionLocal()
                 try:
-                    if last_timestamp_result is None:
-                        db.execute(insert(process_states).values(process_number=process_number, last_timestamp=ts))
-                    else:
-                        update_stmt = (
-                            update(process_states)
-                            .where(process_states.c.process_number == process_number)
-                            .values(last_timestamp=ts)
-                        )
-                        db.execute(update_stmt)
+                    upsert(
+                        db, process_states,
+                        {"process_number": process_number, "last_timestamp": ts, "last_fingerprint": fingerprint},
+                        ["process_number"],
+                    )
 
+                    # (chat_id, janela do resumo em segundos ou None) de cada assinante.
+                    subscribers_query = (
+                        select(group_subscriptions.c.chat_id, chat_settings.c.digest_enabled, chat_settings.c.digest_window)
+                        .select_from(group_subscriptions.outerjoin(chat_settings, chat_settings.c.chat_id == group_subscriptions.c.chat_id))
+                        .where(group_subscriptions.c.process_number == process_number)
+                    )
+                    subscribers = [
+                        (row.chat_id, (row.digest_window or DIGEST_DEFAULT_WINDOW) if row.digest_enabled else None)
+                        for row in db.execute(subscribers_query)
+                    ]
+                    queued = outbox.enqueue_update(db, process_number, ts, details, subscribers)
                     db.commit()
-
-                    subscribers_query = select(group_subscriptions.c.chat_id).where(group_subscriptions.c.process_number == process_number)
-                    return [row[0] for row in db.execute(subscribers_query)]
+                    return queued
                 except Exception:
                     db.rollback()
                     raise
                 finally:
                     db.close()
 
-            subscribers = await asyncio.to_thread(_db_upsert_timestamp_and_get_subscribers, numero, current_timestamp)
+            queued = await asyncio.to_thread(_db_record_update, numero, current_timestamp, current_fingerprint, current_details)
+            logger.info("%d notificação(ões) do processo %s gravada(s) no outbox.", queued, numero, extra=log_ctx)
 
-            numero_escapado = escape_markdown(numero.replace('-', '\\-'), version=2)
-            estado_escapado = escape_markdown(current_details, version=2)
-            message = f"📢 *Nova atualização no processo {numero_escapado}\\!*\n\n{estado_escapado}"
-            
-            for chat_id in subscribers:
-                try:
-                    await context.bot.send_message(chat_id=chat_id, text=message, parse_mode='MarkdownV2')
-                except Exception as e:
-                    logger.error(f"Falha ao enviar mensagem de atualização para {chat_id} no processo {numero}: {e}")
+            # Não espera o Telegram: o sender do outbox envia em segundo plano, respeitando os limites.
+            context.bot_data["outbox"].wake()
         else:
-            logger.info(f"Processo {numero} sem atualizações.")
+            logger.info("Processo %s sem atualizações.", numero, extra=log_ctx)
+            if current_fingerprint != last_fingerprint:
+                backfill_fingerprint = current_fingerprint
 
     except Exception as e:
-        logger.error(f"Falha CRÍTICA ao verificar o processo {numero}: {e}", exc_info=True)
+        logger.error("Falha CRÍTICA ao verificar o processo %s: %s", numero, e, exc_info=True, extra=log_ctx)
     finally:
-        pass
+        # Agenda a próxima verificação deste processo (mais cedo se ele está ativo, mais tarde se está parado).
+        try:
+            interval = await asyncio.to_thread(
+                _db_record_check, numero, current_timestamp, changed, ok, backfill_fingerprint, new_entity_id
+            )
+            logger.info("Próxima verificação do processo %s em %d min.", numero, interval // 60, extra=log_ctx)
+        except Exception as e:
+            logger.error("Falha ao agendar a próxima verificação do processo %s: %s", numero, e, extra=log_ctx)
 
 async def check_updates(context: ContextTypes.DEFAULT_TYPE):
-    """Verifica periodicamente por atualizações nos processos monitorados."""
-    # Jitter manual para evitar previsibilidade (alternativa ao argumento 'jitter' em versões antigas)
-    manual_jitter = random.uniform(0, 120)  # Atraso aleatório de 0 a 120 segundos
-    await asyncio.sleep(manual_jitter)
-
-    logger.info("Executando verificação de atualizações...")
-    
-    def _db_get_all_monitored_processes() -> List[str]:
+    """
+    Tick do agendador: dispara a verificação dos processos cuja verificação está devida.
+
+    Roda a cada SCHEDULER_TICK segundos e pega no máximo SCHEDULER_BATCH_SIZE processos (e só até
+    as vagas livres de SCHEDULER_MAX_IN_FLIGHT), espalhando as consultas ao SIMLAM ao longo do
+    tempo em vez de varrer tudo em rajada. Não espera as verificações terminarem: um processo lento
+    não segura os ticks seguintes. No desligamento, `_drain_checks` cuida das que estão em andamento.
+    """
+    def _db_claim_due_processes(limit: int) -> List[str]:
         db = SessionLocal()
         try:
-            all_monitored_query = select(monitored_processes.c.process_number)
-            return [row[0] for row in db.execute(all_monitored_query)]
+            claimed = scheduler.claim_due_processes(db, datetime.utcnow(), limit)
+            db.commit()
+            return claimed
+        except Exception:
+            db.rollback()
+            raise
         finally:
             db.close()
 
-    processes_to_check = await asyncio.to_thread(_db_get_all_monitored_processes)
+    draining = _get_drain_event()
+    free = scheduler.MAX_IN_FLIGHT - len(_check_tasks)
+    if draining.is_set() or free <= 0:
+        if free <= 0:
+            logger.warning("%s verificação(ões) ainda em andamento; nenhuma nova neste tick.", len(_check_tasks))
+        return
+
+    # Reserva (lease) o lote desta réplica; outras réplicas pegam outros processos.
+    processes_to_check = await asyncio.to_thread(_db_claim_due_processes, min(scheduler.BATCH_SIZE, free))
 
     if not processes_to_check:
-        logger.info("Nenhum processo sendo monitorado globalmente. Verificação concluída.")
         return
 
-    # Limita a concorrência para evitar sobrecarga no DB e no site alvo
-    semaphore = asyncio.Semaphore(4)
+    logger.info("Verificando %s processo(s) devido(s)...", len(processes_to_check))
 
-    async def check_with_semaphore(numero):
-        async with semaphore:
-            await check_single_process(numero, context)
-            # Adiciona uma pausa aleatória entre as verificações para não sobrecarregar o servidor
-            await asyncio.sleep(random.uniform(5, 15))
+    # Distribui o início das verificações ao longo do tick, em vez de disparar todas juntas.
+    spacing = scheduler.TICK_SECONDS / len(processes_to_check)
+
+    async def check_staggered(index: int, numero: str) -> bool:
+        delay = index * spacing + random.uniform(0, spacing / 2)
+        try:
+            # Espera a sua vez, mas não começa nada novo se o bot estiver desligando.
+            await asyncio.wait_for(draining.wait(), timeout=delay)
+            return False
+        except asyncio.TimeoutError:
+            pass
+        await check_single_process(numero, context)
+        return True
+
+    for index, numero in enumerate(processes_to_check):
+        # O nome identifica a verificação no dump de /debug/tasks.
+        task = asyncio.create_task(check_staggered(index, numero), name=f"check:{numero}")
+        _check_tasks[numero] = task
+        task.add_done_callback(lambda t, numero=numero: _check_tasks.pop(numero, None) if _check_tasks.get(numero) is t else None)
+
+
+async def harvest_grid_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Varredura da grade de resultados (SIMLAM_HARVEST_QUERIES, ver grid_harvest.py): atualiza o índice
+    de ids e antecipa a verificação dos processos monitorados cuja linha na grade mudou.
+    """
+    def _db_apply_harvest(rows: list) -> Tuple[int, List[str]]:
+        db = SessionLocal()
+        try:
+            result = grid_harvest.apply_rows(db, rows, datetime.utcnow())
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    for query in grid_harvest.QUERIES:
+        if _get_drain_event().is_set():
+            return
+        try:
+            # Fila de fundo, como as verificações: comandos de usuários passam na frente.
+            result = await scraper_pool.run(harvest_grid, query, priority=scraper_pool.BACKGROUND)
+            found, changed = await asyncio.to_thread(_db_apply_harvest, result["rows"])
+        except Exception as e:
+            logger.warning("Falha na varredura da grade para '%s': %s", query, e)
+            grid_harvest.record_failure(query, e)
+            continue
+        grid_harvest.record_run(query, result, found, len(changed))
+        logger.info(
+            "Varredura '%s': %d processo(s) monitorado(s) na grade, %d com mudança (verificação antecipada).",
+            query, found, len(changed),
+        )
 
-    tasks = [check_with_semaphore(numero) for numero in processes_to_check]
-    await asyncio.gather(*tasks)
 
-    logger.info(f"Verificação de {len(processes_to_check)} processos concluída.")
+# --- Desligamento gracioso ---
+# O Render manda SIGTERM a cada deploy/restart e mata o processo pouco depois.
+# Ao receber o sinal, o tick para de iniciar novas verificações e _drain_checks espera as em andamento
+# por até SHUTDOWN_DRAIN_TIMEOUT segundos e libera os leases restantes antes do bot parar.
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+_drain_event: Optional[asyncio.Event] = None
+
+
+# Verificações disparadas pelo tick (check_updates) e ainda não concluídas, por processo.
+_check_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _get_drain_event() -> asyncio.Event:
+    global _drain_event
+    if _drain_event is None:
+        _drain_event = asyncio.Event()
+    return _drain_event
+
+
+def _db_release_leases(process_numbers: Optional[List[str]] = None) -> int:
+    db = SessionLocal()
+    try:
+        released = scheduler.release_leases(db, process_numbers=process_numbers)
+        if process_numbers is None:
+            # Restart: notificações que esta réplica tinha reservado no outbox voltam a ficar disponíveis.
+            released += outbox.release_leases(db)
+        db.commit()
+        return released
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _drain_checks() -> None:
+    """
+    Desligando: dá um tempo limitado para as verificações em andamento terminarem e devolve os
+    leases das que ficaram pela metade ou nem começaram (serão as primeiras no próximo ciclo).
+    """
+    _get_drain_event().set()
+    tasks = dict(_check_tasks)
+    if not tasks:
+        return
+    _, pending = await asyncio.wait(tasks.values(), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    unfinished = [
+        numero for numero, task in tasks.items()
+        if task.cancelled() or task.exception() is not None or not task.result()
+    ]
+    if unfinished:
+        try:
+            await asyncio.to_thread(_db_release_leases, unfinished)
+        except Exception as e:
+            logger.error("Falha ao liberar os leases das verificações pendentes: %s", e)
+        logger.warning("Desligando: %s verificação(ões) pendente(s) serão retomadas no próximo ciclo.", len(unfinished))
+
+
+def _begin_shutdown(app) -> None:
+    logger.info("Sinal de desligamento recebido. Drenando verificações em andamento...")
+    # O mesmo evento faz o tick parar de iniciar verificações e o _serve começar a desligar o bot.
+    _get_drain_event().set()
+
+
+# --- Notificações ---
+
+def _db_prune_chat(chat_id: str) -> List[str]:
+    """Remove todas as inscrições de um chat (bot removido/bloqueado) e os processos que ficaram órfãos."""
+    db = SessionLocal()
+    try:
+        query = select(group_subscriptions.c.process_number).where(group_subscriptions.c.chat_id == chat_id)
+        numeros = [row[0] for row in db.execute(query)]
+        db.execute(delete(group_subscriptions).where(group_subscriptions.c.chat_id == chat_id))
+        outbox.drop_chat(db, chat_id)
+        orphans = []
+        for numero in numeros:
+            query_refs = select(func.count()).select_from(group_subscriptions).where(group_subscriptions.c.process_number == numero)
+            if db.execute(query_refs).scalar() == 0:
+                db.execute(delete(monitored_processes).where(monitored_processes.c.process_number == numero))
+                scheduler.forget_process(db, numero)
+                orphans.append(numero)
+        db.commit()
+        return orphans
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _db_migrate_chat(old_chat_id: str, new_chat_id: str) -> None:
+    """Grupo virou supergrupo: move as inscrições para o novo chat_id."""
+    db = SessionLocal()
+    try:
+        query = select(group_subscriptions.c.process_number).where(group_subscriptions.c.chat_id == old_chat_id)
+        numeros = [row[0] for row in db.execute(query)]
+        if numeros:
+            insert_ignore(db, group_subscriptions, [{"chat_id": new_chat_id, "process_number": n} for n in numeros])
+            db.execute(delete(group_subscriptions).where(group_subscriptions.c.chat_id == old_chat_id))
+        outbox.migrate_chat(db, old_chat_id, new_chat_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _on_chat_gone(chat_id: str) -> None:
+    orphans = await asyncio.to_thread(_db_prune_chat, chat_id)
+    logger.info("Inscrições do chat %s removidas (%s processo(s) deixaram de ser monitorados).", chat_id, len(orphans))
+
+
+async def _on_chat_migrated(old_chat_id: str, new_chat_id: str) -> None:
+    await asyncio.to_thread(_db_migrate_chat, old_chat_id, new_chat_id)
+
+
+async def _post_init(app) -> None:
+    loop_watchdog.watchdog.start()
+    notifier = NotificationDispatcher(app.bot, on_chat_gone=_on_chat_gone, on_chat_migrated=_on_chat_migrated)
+    notifier.start()
+    app.bot_data["notifier"] = notifier
+    sender = outbox.OutboxSender(notifier)
+    sender.start()
+    app.bot_data["outbox"] = sender
+    await _install_shutdown_handlers(app)
+
+
+async def _post_stop(app) -> None:
+    # Consultas ainda na fila não serão mais aproveitadas por ninguém.
+    scraper_pool.get_executor().shutdown()
+    # Primeiro o outbox (para de buscar lotes e grava o que foi entregue), depois o despachante.
+    sender = app.bot_data.get("outbox")
+    if sender:
+        await sender.stop(timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    notifier = app.bot_data.get("notifier")
+    if notifier:
+        await notifier.stop(timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    await loop_watchdog.watchdog.stop()
+
+
+async def _install_shutdown_handlers(app) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, _begin_shutdown, app)
+        except (NotImplementedError, RuntimeError):
+            # Ex.: Windows. Sem drenagem: o KeyboardInterrupt padrão continua funcionando.
+            pass
+
+
+def _metrics(app) -> dict:
+    """JSON do /metrics: filas do scraper, memória dos PDFs, rotas de saída, updates em andamento, lag do event loop, despachante e outbox."""
+    metrics = {
+        "scraper": scraper_pool.get_executor().stats(),
+        "updates": app.update_processor.stats(),
+        "event_loop": loop_watchdog.watchdog.snapshot(),
+        "pdf": pdf_stats(),
+        "egress": egress.get_pool().stats(),
+        "logging": log_setup.stats(),
+        "lookup_cache": lookup_cache.stats(),
+        "grid_harvest": grid_harvest.stats(),
+    }
+    for key in ("notifier", "outbox"):
+        component = app.bot_data.get(key)
+        if component:
+            metrics[key] = component.snapshot()
+    return metrics
+
+
+async def _serve(app) -> None:
+    """
+    Ciclo de vida do bot: servidor HTTP, Application e polling ou webhook, até o SIGTERM.
+
+    O servidor HTTP sobe antes de qualquer chamada ao Telegram ou ao DB, para o Render detectar
+    a porta aberta mesmo que algo esteja instável no momento do deploy.
+    """
+    runner = await web_server.start(app, metrics=lambda: _metrics(app))
+    try:
+        await app.initialize()
+        await _post_init(app)
+        if web_server.webhook_enabled():
+            # O Telegram entrega os updates por POST no web_server: sem long polling nem tráfego ocioso.
+            await web_server.set_webhook(app.bot)
+        else:
+            # drop_pending_updates evita backlog gigante depois de downtime/sleep do Render
+            await app.updater.start_polling(drop_pending_updates=True)
+        await app.start()
+        print("Bot rodando...")
+        await _get_drain_event().wait()
+    finally:
+        if app.updater and app.updater.running:
+            await app.updater.stop()
+        # Verificações disparadas pelos ticks: espera as em andamento e devolve os leases das demais.
+        await _drain_checks()
+        if app.running:
+            await app.stop()
+        if "notifier" in app.bot_data:
+            await _post_stop(app)
+        await app.shutdown()
+        await runner.cleanup()
 
 
 def main():
+    log_setup.setup_logging()
+    # O httpx loga cada chamada à Bot API em INFO (inclusive cada getUpdates): só avisos e erros.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
     if not TOKEN:
         print("Erro: BOT_TOKEN não foi configurado como variável de ambiente.")
         return
@@ -450,11 +1188,6 @@ def main():
         print("Erro: DATABASE_URL não foi configurado como variável de ambiente.")
         return
 
-    # Sobe o healthcheck o quanto antes para o Render detectar porta aberta,
-    # mesmo que o DB esteja instável no momento do deploy.
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-
     # Inicializa o banco de dados (cria tabelas se necessário).
     # IMPORTANTE: não podemos derrubar o processo se o Postgres estiver instável,
     # senão o bot nem chega a iniciar o polling e não responde /start.
@@ -465,20 +1198,36 @@ def main():
             try:
                 init_db()
                 logger.info("Banco de dados inicializado com sucesso.")
+                # Com INSTANCE_ID fixo, leases que esta réplica deixou para trás (ex.: SIGKILL) são liberados já.
+                released = _db_release_leases()
+                if released:
+                    logger.info("%s lease(s) de uma execução anterior liberado(s).", released)
                 return
             except Exception as e:
-                logger.error(f"Falha ao inicializar o DB (tentativa {attempt}/{max_attempts}): {e}", exc_info=True)
+                logger.error("Falha ao inicializar o DB (tentativa %s/%s): %s", attempt, max_attempts, e, exc_info=True)
                 if attempt < max_attempts:
                     _time.sleep(base_sleep * attempt)
         logger.error("DB continua indisponível. O bot seguirá ativo, mas comandos que usam DB podem falhar até o DB voltar.")
 
     threading.Thread(target=_init_db_with_retries, daemon=True).start()
+    threading.Thread(target=_prewarm_scraper_imports, daemon=True).start()
 
     # Error handler para capturar exceções não tratadas dos handlers
     async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error("Exceção não tratada durante o processamento de um update", exc_info=context.error)
 
-    app = ApplicationBuilder().token(TOKEN).build()
+    # Updates de chats diferentes são processados em paralelo (ordem preservada dentro de cada chat);
+    # o pool de conexões com a Bot API acompanha essa concorrência.
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(PerChatUpdateProcessor())
+        .connection_pool_size(BOT_API_POOL_SIZE)
+        .pool_timeout(BOT_API_POOL_TIMEOUT)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot").base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+    app = builder.build()
     job_queue = app.job_queue
 
     # Adiciona os handlers
@@ -487,27 +1236,47 @@ def main():
     app.add_handler(CommandHandler("desmonitorar", desmonitorar))
     app.add_handler(CommandHandler("listar", listar))
     app.add_handler(CommandHandler("status", status))
+    app.add_handler(CommandHandler("resumo", resumo))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/importar(@\w+)?(\s|$)"), importar))
+    app.add_handler(CommandHandler("importar", importar))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, consultar))
     app.add_error_handler(on_error)
 
-    # Agenda a verificação para rodar a cada 40 minutos (2400 segundos)
+    # Travamentos do event loop são atribuídos ao handler em execução (ver loop_watchdog.py).
+    for handler in app.handlers.get(0, []):
+        label = f"/{sorted(handler.commands)[0]}" if isinstance(handler, CommandHandler) else handler.callback.__name__
+        loop_watchdog.watchdog.register(handler.callback, label)
+    loop_watchdog.watchdog.register(check_updates, "job:check_updates")
+    loop_watchdog.watchdog.register(check_single_process, "job:check_single_process")
+    loop_watchdog.watchdog.register(harvest_grid_job, "job:harvest_grid")
+
+    # Tick do agendador adaptativo (padrão: a cada 60 s). Cada processo tem seu próprio horário
+    # devido em process_schedule; o tick só verifica os que estão vencidos.
     # A primeira verificação acontece 10 segundos após o bot iniciar.
     #
-    # Importante: se uma verificação demorar mais que o intervalo (ex.: rede travada),
+    # Importante: se um tick demorar mais que o intervalo (ex.: rede travada),
     # o APScheduler pode tentar iniciar uma segunda instância do mesmo job.
     # Aqui garantimos 1 instância por vez e "coalescemos" execuções perdidas.
     job_queue.run_repeating(
         check_updates,
-        interval=2400,
+        interval=scheduler.TICK_SECONDS,
         first=10,
         name="check_updates",
         job_kwargs={"max_instances": 1, "coalesce": True, "misfire_grace_time": 900},
     )
+    if grid_harvest.QUERIES:
+        # Varredura da grade (desligada sem SIMLAM_HARVEST_QUERIES); a primeira sai depois do 1º tick.
+        job_queue.run_repeating(
+            harvest_grid_job,
+            interval=grid_harvest.INTERVAL,
+            first=30,
+            name="harvest_grid",
+            job_kwargs={"max_instances": 1, "coalesce": True},
+        )
 
-
-    print("Bot rodando...")
-    # drop_pending_updates evita backlog gigante depois de downtime/sleep do Render
-    app.run_polling(drop_pending_updates=True)
+    # Polling ou webhook (WEBHOOK_URL), com o /health e o /metrics no mesmo event loop.
+    # Os sinais são tratados por _install_shutdown_handlers (com drenagem).
+    asyncio.run(_serve(app))
 
 if __name__ == "__main__":
     main()
@@ -1,76 +1,165 @@
 import os
-from sqlalchemy import create_engine, Column, String, MetaData, Table, inspect
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+import re
+import threading
+from sqlalchemy import create_engine, event, Column, String, Integer, Boolean, DateTime, Text, Index, MetaData, Table, inspect, text
 from sqlalchemy.engine.url import make_url
 
-# Lê a URL do banco de dados da variável de ambiente
+
+def _normalize_database_url(url: str) -> str:
+    # Garante que a URL use o dialeto 'postgresql' que o SQLAlchemy espera.
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+
+    # Remove parâmetros não suportados pelo psycopg2 (ex.: pgbouncer=true do Supabase pooler)
+    # O psycopg2 não reconhece esses parâmetros e causa erro "invalid connection option"
+    # Usamos regex para remover diretamente, evitando problemas com urlparse e URLs complexas
+    if "?" in url or "&" in url:
+        # Remove parâmetros problemáticos usando regex (mais robusto que urlparse)
+        url = re.sub(r'[?&]pgbouncer=[^&]*', '', url)
+        # Remove ? ou & no final se sobrar após remover parâmetros
+        url = re.sub(r'[?&]$', '', url)
+        # Se o primeiro parâmetro foi removido e sobrou & no início da query string, troca por ?
+        if '&' in url and '?' in url:
+            # Garante que só tem um ? na URL
+            parts = url.split('?', 1)
+            if len(parts) == 2:
+                url = parts[0] + '?' + parts[1].lstrip('&')
+    return url
+
+
+# Lê a URL do banco de dados da variável de ambiente.
+# A validação acontece só quando o engine é criado (get_engine), para que o import deste módulo
+# seja barato e não derrube o processo antes do healthcheck/polling subirem.
 DATABASE_URL = os.getenv("DATABASE_URL")
+if DATABASE_URL:
+    DATABASE_URL = _normalize_database_url(DATABASE_URL)
+
+def _is_sqlite_url(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _build_postgres_engine(url: str):
+    """
+    Engine para Postgres remoto (Supabase/Render/Koyeb).
+    """
+    # Render/Supabase costumam derrubar conexões ociosas, causando "SSL connection has been closed unexpectedly".
+    # - pool_pre_ping: valida a conexão antes de usar
+    # - pool_recycle: recicla conexões para evitar ficar tempo demais ociosa
+    # - pool_timeout: evita travar indefinidamente esperando conexão
+    pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "300"))  # 5 min
+    pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+    max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+    connect_timeout = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+    # SSL / keepalive: alguns provedores (Koyeb/Supabase) podem exigir SSL e derrubar conexões idle.
+    # Se o usuário já colocou sslmode na URL, respeitamos. Caso contrário, tentamos "require" para hosts remotos.
+    connect_args = {"connect_timeout": connect_timeout}
+    try:
+        parsed = make_url(url)
+        host = (parsed.host or "").lower()
+        has_sslmode = "sslmode=" in url
+        if not has_sslmode and host not in ("localhost", "127.0.0.1") and host:
+            connect_args["sslmode"] = os.getenv("DB_SSLMODE", "require")
+    except Exception:
+        # Se parsing falhar, seguimos apenas com connect_timeout
+        pass
+
+    # Keepalive (reduz quedas silenciosas em NAT/LB)
+    connect_args["keepalives"] = int(os.getenv("DB_KEEPALIVES", "1"))
+    connect_args["keepalives_idle"] = int(os.getenv("DB_KEEPALIVES_IDLE", "30"))
+    connect_args["keepalives_interval"] = int(os.getenv("DB_KEEPALIVES_INTERVAL", "10"))
+    connect_args["keepalives_count"] = int(os.getenv("DB_KEEPALIVES_COUNT", "5"))
+
+    return create_engine(
+        url,
+        pool_pre_ping=True,
+        pool_recycle=pool_recycle,
+        pool_timeout=pool_timeout,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args=connect_args,
+    )
+
+
+def _build_sqlite_engine(url: str):
+    """
+    Engine SQLite embutido (uma única instância do bot, sem serviço externo).
+
+    Usa WAL para que leituras (handlers) não bloqueiem a escrita do job de verificação.
+    Ex.: DATABASE_URL=sqlite:///simlam.db ou sqlite:////data/simlam.db
+    """
+    busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+    synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    from sqlalchemy.pool import StaticPool
+
+    in_memory = make_url(url).database in (None, "", ":memory:")
+
+    engine_kwargs = {
+        # O bot acessa o DB a partir de threads (asyncio.to_thread), não só da thread que abriu a conexão.
+        "connect_args": {"check_same_thread": False, "timeout": busy_timeout_ms / 1000},
+    }
+    if in_memory:
+        # Um banco em memória só existe enquanto a conexão existir: compartilhamos uma única conexão.
+        engine_kwargs["poolclass"] = StaticPool
+    else:
+        db_dir = os.path.dirname(os.path.abspath(make_url(url).database))
+        os.makedirs(db_dir, exist_ok=True)
+
+    engine = create_engine(url, **engine_kwargs)
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if not in_memory:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+            cursor.execute("PRAGMA foreign_keys=ON")
+        finally:
+            cursor.close()
+
+    return engine
+
+
+_engine = None
+_sessionmaker = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Cria (na primeira chamada) e retorna o engine do SQLAlchemy.
+
+    O backend é escolhido pela URL (postgresql:// ou sqlite://). O dialeto/driver (psycopg2, sqlite3)
+    só é carregado aqui, fora do caminho de inicialização do bot.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if not DATABASE_URL:
+                    raise ValueError("A variável de ambiente DATABASE_URL não foi configurada.")
+                if _is_sqlite_url(DATABASE_URL):
+                    _engine = _build_sqlite_engine(DATABASE_URL)
+                else:
+                    _engine = _build_postgres_engine(DATABASE_URL)
+    return _engine
+
+
+def SessionLocal():
+    """
+    Abre uma nova sessão (mesma interface do antigo `sessionmaker`), criando o engine sob demanda.
+    """
+    global _sessionmaker
+    if _sessionmaker is None:
+        from sqlalchemy.orm import sessionmaker
+
+        _sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    return _sessionmaker()
+
 
-if not DATABASE_URL:
-    raise ValueError("A variável de ambiente DATABASE_URL não foi configurada.")
-
-# Garante que a URL use o dialeto 'postgresql' que o SQLAlchemy espera.
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-# Remove parâmetros não suportados pelo psycopg2 (ex.: pgbouncer=true do Supabase pooler)
-# O psycopg2 não reconhece esses parâmetros e causa erro "invalid connection option"
-# Usamos regex para remover diretamente, evitando problemas com urlparse e URLs complexas
-if "?" in DATABASE_URL or "&" in DATABASE_URL:
-    import re
-    # Remove parâmetros problemáticos usando regex (mais robusto que urlparse)
-    DATABASE_URL = re.sub(r'[?&]pgbouncer=[^&]*', '', DATABASE_URL)
-    # Remove ? ou & no final se sobrar após remover parâmetros
-    DATABASE_URL = re.sub(r'[?&]$', '', DATABASE_URL)
-    # Se o primeiro parâmetro foi removido e sobrou & no início da query string, troca por ?
-    if '&' in DATABASE_URL and '?' in DATABASE_URL:
-        # Garante que só tem um ? na URL
-        parts = DATABASE_URL.split('?', 1)
-        if len(parts) == 2:
-            DATABASE_URL = parts[0] + '?' + parts[1].lstrip('&')
-
-# Configuração do SQLAlchemy
-# Render/Supabase costumam derrubar conexões ociosas, causando "SSL connection has been closed unexpectedly".
-# - pool_pre_ping: valida a conexão antes de usar
-# - pool_recycle: recicla conexões para evitar ficar tempo demais ociosa
-# - pool_timeout: evita travar indefinidamente esperando conexão
-_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "300"))  # 5 min
-_pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", "30"))
-_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
-_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "5"))
-_connect_timeout = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
-
-# SSL / keepalive: alguns provedores (Koyeb/Supabase) podem exigir SSL e derrubar conexões idle.
-# Se o usuário já colocou sslmode na URL, respeitamos. Caso contrário, tentamos "require" para hosts remotos.
-_connect_args = {"connect_timeout": _connect_timeout}
-try:
-    _url = make_url(DATABASE_URL)
-    _host = (_url.host or "").lower()
-    _has_sslmode = "sslmode=" in DATABASE_URL
-    if not _has_sslmode and _host not in ("localhost", "127.0.0.1") and _host:
-        _connect_args["sslmode"] = os.getenv("DB_SSLMODE", "require")
-except Exception:
-    # Se parsing falhar, seguimos apenas com connect_timeout
-    pass
-
-# Keepalive (reduz quedas silenciosas em NAT/LB)
-_connect_args["keepalives"] = int(os.getenv("DB_KEEPALIVES", "1"))
-_connect_args["keepalives_idle"] = int(os.getenv("DB_KEEPALIVES_IDLE", "30"))
-_connect_args["keepalives_interval"] = int(os.getenv("DB_KEEPALIVES_INTERVAL", "10"))
-_connect_args["keepalives_count"] = int(os.getenv("DB_KEEPALIVES_COUNT", "5"))
-
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=_pool_recycle,
-    pool_timeout=_pool_timeout,
-    pool_size=_pool_size,
-    max_overflow=_max_overflow,
-    connect_args=_connect_args,
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
 metadata = MetaData()
 
 # Define a tabela para processos monitorados (agora uma lista global única)
@@ -91,23 +180,156 @@ group_subscriptions = Table(
 process_states = Table(
     'process_states', metadata,
     Column('process_number', String, primary_key=True),
-    Column('last_timestamp', String, nullable=False)
+    Column('last_timestamp', String, nullable=False),
+    # Identificação da última tramitação conhecida (simlam_scraper.tramitacao_fingerprint): a próxima
+    # verificação lê o PDF só até ela e notifica todas as tramitações posteriores.
+    Column('last_fingerprint', String, nullable=True),
+)
+
+# Agenda adaptativa de verificação: cada processo tem seu próprio "próximo horário devido",
+# calculado a partir do histórico de mudanças (ver scheduler.py).
+process_schedule = Table(
+    'process_schedule', metadata,
+    Column('process_number', String, primary_key=True),
+    Column('next_check_at', DateTime, nullable=True),  # NULL = verificar o quanto antes
+    # Checkpoints por processo: persistidos para que um restart no meio do ciclo retome
+    # pelos processos mais desatualizados, em vez de recomeçar do zero em ordem arbitrária.
+    Column('last_attempted_at', DateTime, nullable=True),
+    Column('last_succeeded_at', DateTime, nullable=True),
+    Column('last_change_at', DateTime, nullable=True),
+    Column('check_interval', Integer, nullable=True),  # segundos
+    # Lease para várias réplicas do bot: quem "pegou" o processo para verificar e até quando.
+    # Se a réplica morrer no meio, o lease expira e outra réplica assume.
+    Column('lease_owner', String, nullable=True),
+    Column('lease_expires_at', DateTime, nullable=True),
+)
+
+
+# Índice da grade de resultados do SIMLAM (ver grid_harvest.py): o id interno de cada processo, para
+# a consulta ir direto aos detalhes sem a busca, e uma assinatura das colunas da grade (situação,
+# setor...), que muda quando a linha do processo muda. Preenchido pelas consultas e pela varredura.
+process_index = Table(
+    'process_index', metadata,
+    Column('process_number', String, primary_key=True),
+    Column('entity_id', String, nullable=True),
+    Column('grid_signature', String, nullable=True),
+    Column('grid_columns', Text, nullable=True),  # JSON {coluna: valor} da última varredura
+    Column('seen_at', DateTime, nullable=True),  # última vez que apareceu numa varredura
+)
+
+
+# Preferências por chat (ex.: modo resumo/digest das notificações).
+chat_settings = Table(
+    'chat_settings', metadata,
+    Column('chat_id', String, primary_key=True),
+    Column('digest_enabled', Boolean, nullable=False, default=False),
+    Column('digest_window', Integer, nullable=True),  # segundos; NULL = padrão (DIGEST_DEFAULT_WINDOW)
+)
+
+
+# Outbox de notificações: cada atualização detectada vira uma linha por chat inscrito, gravada na
+# mesma transação que avança o process_states. Um sender em segundo plano (ver outbox.py) lê em
+# lotes, envia e apaga; se o bot morrer ou o Telegram falhar, a linha continua lá e é reenviada.
+notification_outbox = Table(
+    'notification_outbox', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    # processo:timestamp:chat — a mesma atualização nunca é enfileirada duas vezes para o mesmo chat.
+    Column('idempotency_key', String, nullable=False, unique=True),
+    Column('chat_id', String, nullable=False),
+    Column('process_number', String, nullable=False),
+    Column('details', Text, nullable=False),
+    Column('digest_window', Integer, nullable=True),  # segundos; NULL = envio imediato
+    Column('created_at', DateTime, nullable=False),
+    Column('available_at', DateTime, nullable=False),  # não enviar antes disso (janela do resumo/backoff)
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('lease_owner', String, nullable=True),
+    Column('lease_expires_at', DateTime, nullable=True),
+    # Resumo em várias mensagens: quantas partes já foram entregues (a próxima rodada continua dali).
+    Column('parts_sent', Integer, nullable=True),
+    Index('ix_notification_outbox_available_at', 'available_at'),
+    Index('ix_notification_outbox_chat_id', 'chat_id'),
 )
 
 
 def init_db():
     """
-    Cria as tabelas no banco de dados se elas ainda não existirem.
+    Cria as tabelas que ainda não existem e adiciona as colunas novas às que já existiam.
     """
+    engine = get_engine()
     inspector = inspect(engine)
-    if not inspector.has_table('monitored_processes') or \
-       not inspector.has_table('process_states') or \
-       not inspector.has_table('group_subscriptions'):
+    if not all(inspector.has_table(name) for name in metadata.tables):
         print("Criando ou atualizando tabelas no banco de dados...")
         metadata.create_all(bind=engine)
         print("Tabelas criadas/atualizadas com sucesso.")
     else:
         print("Tabelas já existem no banco de dados.")
+    # Sempre, inclusive depois do create_all: num banco antigo, as tabelas novas são criadas, mas as
+    # existentes (ex.: process_states) continuam sem as colunas novas. Inspector novo: o de cima
+    # guarda em cache o esquema de antes do create_all.
+    _add_missing_columns(engine, inspect(engine))
+
+
+def _add_missing_columns(engine, inspector):
+    """
+    Migração mínima: adiciona colunas novas (sempre anuláveis) a tabelas que já existiam.
+    O create_all só cria tabelas inexistentes, não altera as existentes.
+    """
+    for table in metadata.sorted_tables:
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            print(f"Adicionando coluna {table.name}.{column.name}...")
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+def _dialect_insert(db, table):
+    """
+    Retorna um INSERT específico do dialeto (Postgres ou SQLite), que suporta ON CONFLICT.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"Upsert não suportado para o dialeto '{dialect}'.")
+    return dialect_insert(table)
+
+
+def upsert(db, table, values, index_elements: list, update_columns: list = None):
+    """
+    INSERT ... ON CONFLICT (index_elements) DO UPDATE SET update_columns.
+
+    Aceita um dict (uma linha) ou uma lista de dicts com as mesmas chaves (lote).
+    Se update_columns não for informado, atualiza todas as colunas de `values` fora da chave.
+    """
+    rows = [values] if isinstance(values, dict) else values
+    if not rows:
+        return None
+    if update_columns is None:
+        update_columns = [k for k in rows[0] if k not in index_elements]
+    stmt = _dialect_insert(db, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={col: stmt.excluded[col] for col in update_columns},
+    )
+    if isinstance(values, dict):
+        return db.execute(stmt.values(**values))
+    return db.execute(stmt, rows)
+
+
+def insert_ignore(db, table, values, index_elements: list = None):
+    """
+    INSERT ... ON CONFLICT DO NOTHING. Aceita um dict (uma linha) ou uma lista de dicts (lote).
+    Retorna o resultado do execute (rowcount = linhas efetivamente inseridas).
+    """
+    stmt = _dialect_insert(db, table).on_conflict_do_nothing(index_elements=index_elements)
+    if isinstance(values, dict):
+        return db.execute(stmt.values(**values))
+    return db.execute(stmt, values)
+
 
 # Exemplo de como usar a sessão em outras partes do código:
 # def get_db():
@@ -0,0 +1,118 @@
+"""
+Varredura da grade de resultados do SIMLAM.
+
+Uma consulta completa (busca, detalhes, geração e download do PDF) custa cinco requisições e duas
+pausas por processo. Já a grade de uma busca ampla (ex.: "/2024") lista vários processos por
+página, com o id interno e colunas como situação e setor. Com SIMLAM_HARVEST_QUERIES (lista separada
+por vírgulas), o bot percorre essas buscas a cada SIMLAM_HARVEST_INTERVAL segundos e, para cada
+processo monitorado que aparece na grade:
+
+- guarda o id interno em `process_index`: as consultas seguintes vão direto aos detalhes, sem a busca
+  (as próprias consultas também preenchem o índice; SIMLAM_USE_ID_INDEX=0 desliga esse atalho);
+- compara a assinatura da linha com a da varredura anterior e, se mudou, antecipa a verificação
+  completa do processo para agora.
+
+A grade é um sinal grosseiro: uma tramitação nova pode não mudar nenhuma coluna visível. Por isso a
+varredura só antecipa verificações, nunca adia as da agenda normal.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import select
+
+import scheduler
+from database import monitored_processes, process_index, upsert
+
+QUERIES = [q.strip() for q in os.getenv("SIMLAM_HARVEST_QUERIES", "").split(",") if q.strip()]
+INTERVAL = int(os.getenv("SIMLAM_HARVEST_INTERVAL", "1800"))
+USE_ID_INDEX = os.getenv("SIMLAM_USE_ID_INDEX", "1") != "0"
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {"runs": 0, "failures": 0, "last": {}}
+
+
+def _normalize(numero: str) -> str:
+    # Mesma comparação da validação do PDF em buscar_processo: só os dígitos importam.
+    return numero.replace("/", "")
+
+
+def apply_rows(db, rows: List[Dict[str, Any]], now: datetime) -> Tuple[int, List[str]]:
+    """
+    Grava no índice as linhas (de simlam_scraper.parse_grid) dos processos monitorados e antecipa a
+    verificação dos que mudaram desde a varredura anterior. Retorna (encontrados, antecipados).
+    Não faz commit.
+    """
+    monitored = {_normalize(numero): numero for (numero,) in db.execute(select(monitored_processes.c.process_number))}
+    found = {}
+    for row in rows:
+        numero = monitored.get(_normalize(row["numero"]))
+        if numero:
+            found[numero] = row
+    if not found:
+        return 0, []
+
+    previous = dict(
+        db.execute(
+            select(process_index.c.process_number, process_index.c.grid_signature)
+            .where(process_index.c.process_number.in_(list(found)))
+        ).all()
+    )
+    upsert(
+        db,
+        process_index,
+        [
+            {
+                "process_number": numero,
+                "entity_id": row["entity_id"],
+                "grid_signature": row["assinatura"],
+                "grid_columns": json.dumps(row["colunas"], ensure_ascii=False, sort_keys=True),
+                "seen_at": now,
+            }
+            for numero, row in found.items()
+        ],
+        ["process_number"],
+    )
+    # Primeira vez na grade (sem assinatura anterior): só registra.
+    changed = [numero for numero, row in found.items() if previous.get(numero) not in (None, row["assinatura"])]
+    scheduler.make_due(db, changed, now)
+    return len(found), changed
+
+
+def remember_entity_id(db, process_number: str, entity_id: str) -> None:
+    """Guarda o id interno visto numa consulta, sem mexer na assinatura da grade. Não faz commit."""
+    upsert(db, process_index, {"process_number": process_number, "entity_id": entity_id}, ["process_number"])
+
+
+def record_run(query: str, result: Dict[str, Any], found: int, changed: int) -> None:
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["last"][query] = {
+            "at": time.time(),
+            "pages": result["pages"],
+            "rows": len(result["rows"]),
+            "truncated": result["truncated"],
+            "monitored_found": found,
+            "pulled_forward": changed,
+        }
+
+
+def record_failure(query: str, error: Exception) -> None:
+    with _stats_lock:
+        _stats["failures"] += 1
+        _stats["last"][query] = {"at": time.time(), "error": str(error)}
+
+
+def stats() -> Dict[str, Any]:
+    """Resumo para o /metrics: execuções, falhas e o resultado da última varredura de cada busca."""
+    with _stats_lock:
+        return {
+            "queries": list(QUERIES),
+            "runs": _stats["runs"],
+            "failures": _stats["failures"],
+            "last": {query: dict(last) for query, last in _stats["last"].items()},
+        }
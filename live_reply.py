@@ -0,0 +1,167 @@
+"""
+Resposta "ao vivo": uma única mensagem, editada no lugar conforme os resultados chegam.
+
+Antes, /status mandava um "aguarde..." e depois uma mensagem por processo, na ordem, só quando a
+consulta daquele processo terminava; consulta direta e /monitorar também mandavam uma segunda
+mensagem bem depois. Com LiveReply, a resposta tem uma seção por item (ex.: um processo), que começa
+como "⏳ consultando..." e é trocada pelo resultado assim que ele chega, em qualquer ordem.
+
+As edições são espaçadas por LIVE_REPLY_EDIT_INTERVAL segundos (o Telegram limita edições por chat);
+a última sempre acontece, em `finish`. Se o texto passar do limite de uma mensagem, as seções
+seguintes vão para mensagens de continuação, também editadas no lugar.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import List, Optional
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from notifier import TELEGRAM_MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+EDIT_INTERVAL = float(os.getenv("LIVE_REPLY_EDIT_INTERVAL", "1.5"))
+# Tentativas da edição final, se o Telegram responder RetryAfter.
+_FINISH_ATTEMPTS = 3
+
+
+class LiveReply:
+    """
+    Mensagem de resposta a `message` com um cabeçalho opcional e uma lista de seções.
+
+    Use `start()` para enviar, `set(i, texto)` a cada resultado e `finish()` no fim. O texto das
+    seções e do cabeçalho já deve estar no formato de `parse_mode` (ex.: escapado para MarkdownV2).
+    """
+
+    def __init__(self, message, sections: List[str], header: Optional[str] = None, parse_mode: Optional[str] = None,
+                 interval: float = EDIT_INTERVAL, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH):
+        self._reply_to = message
+        self.sections = list(sections)
+        self.header = header
+        self.parse_mode = parse_mode
+        self.interval = interval
+        self.limit = limit
+        self._messages = []
+        self._texts: List[str] = []
+        self._last_flush = 0.0
+        self._scheduled: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        """Envia a(s) mensagem(ns) com o estado inicial."""
+        await self._flush()
+
+    def set(self, index: int, text: str) -> None:
+        """Troca o texto de uma seção; a edição sai em até `interval` segundos."""
+        self.sections[index] = text
+        if self._scheduled is None or self._scheduled.done():
+            delay = max(0.0, self._last_flush + self.interval - time.monotonic())
+            self._scheduled = asyncio.create_task(self._flush_later(delay))
+
+    async def finish(self, header: Optional[str] = None) -> None:
+        """Aplica o cabeçalho final (None remove o de progresso) e faz a última edição."""
+        self.header = header
+        if self._scheduled is not None and not self._scheduled.done():
+            # Só interrompe a espera; uma edição já em andamento termina antes da final (ver _flush_later).
+            self._scheduled.cancel()
+        for _ in range(_FINISH_ATTEMPTS):
+            retry_after = await self._flush()
+            if retry_after is None:
+                return
+            await asyncio.sleep(retry_after)
+        logger.warning("Não foi possível concluir a edição da resposta ao chat %s.", self._reply_to.chat_id)
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        # Protegido do cancel de `finish`: cancelar no meio de um reply_text já enviado perderia a
+        # mensagem de `_messages` e a edição final mandaria outra continuação igual. A edição final
+        # espera esta terminar no lock de `_flush`.
+        await asyncio.shield(self._flush())
+
+    async def _flush(self) -> Optional[float]:
+        """Sincroniza as mensagens com o texto atual. Retorna o RetryAfter (s) se o Telegram recusou alguma edição."""
+        async with self._lock:
+            self._last_flush = time.monotonic()
+            retry_after = None
+            chunks = self._render()
+            for i, text in enumerate(chunks):
+                is_new = i >= len(self._messages)
+                if not is_new and self._texts[i] == text:
+                    continue
+                try:
+                    await self._deliver(i, text)
+                except RetryAfter as e:
+                    value = e.retry_after
+                    retry_after = value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+                    # Uma continuação que não saiu: as seguintes esperam por ela (a ordem importa).
+                    if is_new:
+                        break
+                    continue
+                except BadRequest as e:
+                    if is_new or "not modified" not in str(e).lower():
+                        logger.warning("Falha ao atualizar a resposta ao chat %s: %s", self._reply_to.chat_id, e)
+                        if is_new:
+                            break
+                        continue
+                except TelegramError as e:
+                    logger.warning("Falha ao atualizar a resposta ao chat %s: %s", self._reply_to.chat_id, e)
+                    if is_new:
+                        break
+                    continue
+                self._texts[i] = text
+            # O texto encolheu (ex.: cabeçalho de progresso removido): apaga as continuações que sobraram.
+            while len(self._messages) > len(chunks):
+                message = self._messages.pop()
+                self._texts.pop()
+                try:
+                    await message.delete()
+                except TelegramError as e:
+                    logger.debug("Falha ao apagar continuação da resposta ao chat %s: %s", self._reply_to.chat_id, e)
+            return retry_after
+
+    async def _deliver(self, index: int, text: str) -> None:
+        """
+        Envia (continuação nova) ou edita a mensagem `index`. Se o Telegram não conseguir interpretar
+        a formatação (ex.: uma entidade cortada no meio por `_render`), manda o trecho sem formatação,
+        em vez de deixar a mensagem parada no estado anterior.
+        """
+        try:
+            await self._send_or_edit(index, text, self.parse_mode)
+        except BadRequest as e:
+            if not self.parse_mode or "can't parse entities" not in str(e).lower():
+                raise
+            logger.warning("Formatação recusada na resposta ao chat %s (%s); enviando sem formatação.", self._reply_to.chat_id, e)
+            plain = re.sub(r"\\(.)", r"\1", text) if self.parse_mode == "MarkdownV2" else text
+            await self._send_or_edit(index, plain, None)
+
+    async def _send_or_edit(self, index: int, text: str, parse_mode: Optional[str]) -> None:
+        if index < len(self._messages):
+            await self._messages[index].edit_text(text, parse_mode=parse_mode)
+            return
+        self._messages.append(await self._reply_to.reply_text(text, parse_mode=parse_mode))
+        self._texts.append(text)
+
+    def _render(self) -> List[str]:
+        """Cabeçalho e seções em mensagens de até `limit` caracteres, quebrando entre seções."""
+        blocks = [self.header] if self.header else []
+        for section in self.sections:
+            if len(section) > self.limit:
+                # Uma seção enorme: corta no limite, sem deixar uma barra de escape pendurada.
+                ellipsis = " \\.\\.\\." if self.parse_mode == "MarkdownV2" else " ..."
+                section = section[: self.limit - 10].rstrip("\\") + ellipsis
+            blocks.append(section)
+        chunks = []
+        current = ""
+        for block in blocks:
+            candidate = f"{current}\n\n{block}" if current else block
+            if current and len(candidate) > self.limit:
+                chunks.append(current)
+                current = block
+            else:
+                current = candidate
+        chunks.append(current)
+        return chunks
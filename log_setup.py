@@ -0,0 +1,161 @@
+"""
+Configuração de logging do bot: fila, JSON opcional e amostragem de falhas repetidas.
+
+Quem loga só enfileira o registro (QueueHandler); formatação e escrita no stderr acontecem em uma
+thread própria (QueueListener). A fila é limitada (LOG_QUEUE_SIZE): se encher, o registro é
+descartado e contado, em vez de travar a thread do scraper ou o event loop esperando o disco.
+
+- LOG_LEVEL: nível mínimo (padrão INFO).
+- LOG_FORMAT: "text" (padrão, o formato de sempre) ou "json" (um objeto por linha). Campos passados
+  em `extra=` (processo, etapa, tentativa, duracao_ms...) viram chaves do JSON ou "chave=valor" no texto.
+- LOG_SAMPLE_BURST / LOG_SAMPLE_WINDOW: avisos e erros com o mesmo template (a mensagem antes da
+  formatação %) passam no máximo BURST vezes por janela de WINDOW segundos; o excedente é contado e
+  informado no primeiro registro da janela seguinte. Por isso o caminho quente loga com
+  `logger.info("... %s", valor)` e não com f-strings: a formatação fica para a thread do listener
+  (e nem acontece se o nível estiver desligado) e o template identifica a mensagem repetida.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "60"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Atributos padrão de um LogRecord: o que não estiver aqui veio de `extra=`.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_stats_lock = threading.Lock()
+_stats = {"dropped": 0, "suppressed": 0}
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS and not k.startswith("_")}
+
+
+class TextFormatter(logging.Formatter):
+    """O formato de texto de sempre, com os campos estruturados no fim ("processo=... etapa=...")."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _extra_fields(record)
+        if not fields:
+            return text
+        suffix = " ".join(f"{k}={v}" for k, v in fields.items())
+        head, sep, tail = text.partition("\n")  # campos na linha da mensagem, antes do traceback
+        return f"{head} [{suffix}]{sep}{tail}"
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha: ts, level, logger, msg, campos de `extra=` e exc (se houver)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update(_extra_fields(record))
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RepeatSampler(logging.Filter):
+    """Deixa passar no máximo `burst` avisos/erros por template a cada `window` segundos."""
+
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, window: float = LOG_SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # (logger, template) -> [início da janela, registros na janela, suprimidos a informar]
+        self._windows: Dict[Tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or not (logging.WARNING <= record.levelno < logging.CRITICAL):
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                state = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suprimidas = suppressed
+            state[1] += 1
+            if state[1] <= self.burst:
+                return True
+            state[2] += 1
+        with _stats_lock:
+            _stats["suppressed"] += 1
+        return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # O QueueHandler padrão formata a mensagem (e o traceback) aqui, na thread de quem loga.
+        # Mantemos o registro como está: o listener formata depois.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _stats_lock:
+                _stats["dropped"] += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Instala o logging em fila no logger raiz. Idempotente; o listener para no atexit."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(RepeatSampler())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Esvazia a fila e para a thread do listener."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def stats() -> Dict:
+    """Registros descartados (fila cheia) e suprimidos pela amostragem, para o /metrics."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,71 @@
+"""
+Cache curto dos resultados de buscar_processo, para os comandos interativos.
+
+Um /status logo depois de uma notificação, de outro /status ou de um /listar não precisa ir ao
+SIMLAM de novo: o resultado da última consulta bem-sucedida (de qualquer chat, ou da verificação
+automática) fica guardado por LOOKUP_CACHE_TTL segundos (0 desliga o cache), em até
+LOOKUP_CACHE_SIZE processos (os menos usados saem primeiro).
+
+Só resultados com timestamp entram: falhas e "processo não encontrado" sempre consultam de novo.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+TTL = float(os.getenv("LOOKUP_CACHE_TTL", "300"))
+SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "2000"))
+
+
+class LookupCache:
+    def __init__(self, ttl: float = TTL, size: int = SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        # processo -> (instante da consulta em time.monotonic, resultado)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, numero: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """(resultado, idade em segundos) se houver um resultado recente; senão None."""
+        with self._lock:
+            entry = self._entries.get(numero)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[numero]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(numero)
+            self.hits += 1
+            return entry[1], time.monotonic() - entry[0]
+
+    def put(self, numero: str, result: Dict[str, Any]) -> None:
+        if self.ttl <= 0 or not result.get("timestamp"):
+            return
+        with self._lock:
+            self._entries[numero] = (time.monotonic(), result)
+            self._entries.move_to_end(numero)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl_s": self.ttl}
+
+
+_cache = LookupCache()
+
+
+def get(numero: str) -> Optional[Tuple[Dict[str, Any], float]]:
+    return _cache.get(numero)
+
+
+def put(numero: str, result: Dict[str, Any]) -> None:
+    _cache.put(numero, result)
+
+
+def stats() -> Dict[str, Any]:
+    return _cache.stats()
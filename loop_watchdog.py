@@ -0,0 +1,184 @@
+"""
+Watchdog do event loop: mede o atraso (lag) continuamente e flagra travamentos.
+
+Uma tarefa no loop "bate o ponto" a cada LOOP_LAG_INTERVAL segundos e registra o atraso em um
+histograma. Uma thread separada vigia esse ponto: se o loop passar de LOOP_STALL_THRESHOLD
+segundos sem bater, ela captura a pilha da thread do loop naquele instante e atribui o
+travamento ao handler em execução (o primeiro frame da pilha cujo código foi registrado com
+`register`, ex.: o callback de /status), além do nome da tarefa asyncio atual.
+
+Serve para achar trabalho síncrono no loop (consultas SQLAlchemy, escape_markdown de textos
+grandes...) assim que ele aparece, em vez de esperar alguém reclamar que o bot não responde.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.5"))
+# Limites superiores (s) dos buckets do histograma de lag, no estilo Prometheus (cumulativos).
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_RECENT_STALLS = 20
+
+
+class LagHistogram:
+    def __init__(self, buckets=LAG_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # o último é o +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self) -> Dict:
+        cumulative, buckets = 0, {}
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 4), "max": round(self.max, 4)}
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = LAG_INTERVAL, threshold: float = STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = LagHistogram()
+        self.stalls_by_handler: Dict[str, int] = {}
+        self.recent_stalls: Deque[Dict] = deque(maxlen=_RECENT_STALLS)
+        self._handlers: Dict[object, str] = {}  # code object -> rótulo (ex.: "/status")
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._current_stall: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def register(self, callback: Callable, label: Optional[str] = None) -> None:
+        """Marca uma função (handler, job) para atribuição de travamentos."""
+        code = getattr(callback, "__code__", None)
+        if code is not None:
+            self._handlers[code] = label or callback.__name__
+
+    def start(self) -> None:
+        """Deve ser chamado de dentro do event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "lag_seconds": self.lag.as_dict(),
+                "stall_threshold": self.threshold,
+                "stalls": sum(self.stalls_by_handler.values()),
+                "stalls_by_handler": dict(self.stalls_by_handler),
+                "recent_stalls": [
+                    {k: v for k, v in stall.items() if k != "stack"} for stall in self.recent_stalls
+                ],
+            }
+
+    def recent_stacks(self) -> List[Dict]:
+        with self._lock:
+            return list(self.recent_stalls)
+
+    # --- Internos ---
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            with self._lock:
+                self._last_beat = now
+                self.lag.observe(lag)
+                stall, self._current_stall = self._current_stall, None
+                if stall is not None:
+                    stall["duration"] = round(lag, 3)
+            if stall is not None:
+                logger.warning(
+                    "Event loop ficou travado por %.2fs em %s (tarefa %s, em %s).",
+                    lag, stall['handler'], stall['task'], stall['where'],
+                )
+
+    def _watch(self) -> None:
+        check_every = max(min(self.threshold / 2, self.interval), 0.01)
+        while not self._stop.wait(check_every):
+            with self._lock:
+                blocked_for = time.monotonic() - self._last_beat - self.interval
+                if blocked_for < self.threshold or self._current_stall is not None:
+                    continue
+                stall = self._capture(blocked_for)
+                self._current_stall = stall
+                self.recent_stalls.append(stall)
+                self.stalls_by_handler[stall["handler"]] = self.stalls_by_handler.get(stall["handler"], 0) + 1
+            logger.warning(
+                "Event loop travado há %.2fs em %s (tarefa %s). Pilha:\n%s", blocked_for, stall['handler'], stall['task'], stall['stack']
+            )
+
+    def _capture(self, blocked_for: float) -> Dict:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        handler = "desconhecido"
+        where = "?"
+        stack = ""
+        if frame is not None:
+            stack = "".join(traceback.format_stack(frame))
+            code = frame.f_code
+            where = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            # Da folha para a raiz: o primeiro frame registrado é o handler responsável.
+            current = frame
+            while current is not None:
+                label = self._handlers.get(current.f_code)
+                if label:
+                    handler = label
+                    break
+                current = current.f_back
+        task_name = None
+        try:
+            task = asyncio.current_task(self._loop)
+            task_name = task.get_name() if task else None
+        except RuntimeError:
+            pass
+        return {
+            "at": time.time(),
+            "blocked_for": round(blocked_for, 3),
+            "duration": None,  # preenchido quando o loop volta
+            "handler": handler,
+            "task": task_name,
+            "where": where,
+            "stack": stack,
+        }
+
+
+watchdog = LoopWatchdog()
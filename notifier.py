@@ -0,0 +1,321 @@
+"""
+Despachante de notificações para o Telegram.
+
+O job de verificação só enfileira as mensagens; quem envia são alguns workers assíncronos que
+respeitam os limites da Bot API (~30 msg/s no total, ~20 msg/min por grupo, ~1 msg/s por chat
+privado), tratam RetryAfter e detectam falhas permanentes (bot removido/bloqueado), avisando o
+bot para remover as inscrições daquele chat.
+
+As mensagens de atualização (isoladas ou em resumo, para chats em modo /resumo) são montadas aqui
+por render_update/render_digest; o agrupamento por janela de tempo é feito pelo outbox (outbox.py).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))  # msg/s (margem sob o limite de ~30/s)
+GROUP_RATE_PER_MIN = float(os.getenv("NOTIFY_GROUP_RATE_PER_MIN", "18"))  # msg/min por grupo (~20)
+PRIVATE_RATE = float(os.getenv("NOTIFY_PRIVATE_RATE", "1"))  # msg/s por chat privado
+WORKERS = int(os.getenv("NOTIFY_WORKERS", "8"))
+MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+
+# Modo resumo: janela padrão em que as atualizações de um chat são acumuladas e enviadas juntas.
+DIGEST_DEFAULT_WINDOW = int(os.getenv("DIGEST_DEFAULT_WINDOW", "900"))  # 15 min
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Trechos de BadRequest que significam que o chat não existe mais para o bot.
+_PERMANENT_BAD_REQUEST = ("chat not found", "group chat was deleted", "peer_id_invalid", "user is deactivated")
+
+
+def _seconds(value) -> float:
+    """RetryAfter.retry_after pode ser int ou timedelta, dependendo da versão do PTB."""
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+def _escape(text: str) -> str:
+    from telegram.helpers import escape_markdown
+
+    return escape_markdown(text, version=2)
+
+
+def render_update(numero: str, details: str) -> str:
+    """Mensagem (MarkdownV2) de uma atualização isolada."""
+    return f"📢 *Nova atualização no processo {_escape(numero)}\\!*\n\n{_escape(details)}"
+
+
+def render_digest(updates, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> list:
+    """
+    Agrupa várias atualizações (lista de (numero, details)) em uma ou mais mensagens MarkdownV2,
+    quebrando entre processos para respeitar o limite de caracteres do Telegram.
+    """
+    header = f"📢 *Resumo: {len(updates)} processo\\(s\\) com novas atualizações*"
+    blocks = []
+    for numero, details in updates:
+        block = f"*Processo {_escape(numero)}*\n{_escape(details)}"
+        if len(block) > limit - len(header) - 2:
+            # Um único processo enorme: corta no limite, sem deixar uma barra de escape pendurada.
+            block = block[: limit - len(header) - 10].rstrip("\\") + " \\.\\.\\."
+        blocks.append(block)
+
+    messages = []
+    current = header
+    for block in blocks:
+        candidate = f"{current}\n\n{block}"
+        if len(candidate) > limit:
+            messages.append(current)
+            current = block
+        else:
+            current = candidate
+    messages.append(current)
+    return messages
+
+
+class TokenBucket:
+    """Token bucket simples: `rate` fichas por segundo, acumulando no máximo `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Quanto esperar (s) até haver uma ficha. Não consome."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def reserve(self) -> float:
+        """
+        Consome uma ficha já (mesmo que o saldo fique negativo) e retorna quanto esperar (s) até ela
+        valer. Verificar e consumir numa única chamada síncrona: workers concorrentes que esperam
+        ao mesmo tempo ficam enfileirados, em vez de passarem todos pela mesma ficha.
+        """
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Zera o bucket por `seconds` (ex.: após RetryAfter)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class _Notification:
+    __slots__ = ("chat_id", "text", "parse_mode", "attempts", "future")
+
+    def __init__(self, chat_id: str, text: str, parse_mode: Optional[str], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.attempts = 0
+        self.future = future
+
+
+class NotificationDispatcher:
+    """
+    Fila de notificações com concorrência limitada e controle de taxa global e por chat.
+
+    Cada chat tem sua própria fila (ordem preservada); uma fila de "chats prontos" distribui o
+    trabalho entre os workers de forma justa. Um chat que precisa esperar (limite do grupo ou
+    RetryAfter) é reagendado com call_later e não segura nenhum worker.
+    """
+
+    def __init__(
+        self,
+        bot,
+        on_chat_gone: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_chat_migrated: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        workers: int = WORKERS,
+    ):
+        self.bot = bot
+        self.on_chat_gone = on_chat_gone
+        self.on_chat_migrated = on_chat_migrated
+        self.workers = workers
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._chat_queues: Dict[str, Deque[_Notification]] = {}
+        self._scheduled: set = set()
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks = []
+        self.stats = {"sent": 0, "failed": 0, "retry_after": 0, "chats_gone": 0}
+
+    # --- API pública ---
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"notifier-worker-{i}"))
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Tenta esvaziar a fila por até `timeout` segundos e então encerra os workers."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        if self.pending():
+            logger.warning("Encerrando o despachante com %s notificação(ões) não enviada(s).", self.pending())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(self, chat_id: str, text: str, parse_mode: Optional[str] = "MarkdownV2") -> asyncio.Future:
+        """
+        Enfileira uma mensagem e retorna imediatamente. O future resolve para True (enviada)
+        ou False (falha definitiva); quem não se importa com o resultado pode ignorá-lo.
+        """
+        chat_id = str(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        self._chat_queues.setdefault(chat_id, deque()).append(_Notification(chat_id, text, parse_mode, future))
+        self._schedule(chat_id)
+        return future
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._chat_queues.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "pending": self.pending(), "chats_waiting": len(self._chat_queues)}
+
+    # --- Internos ---
+
+    def _bucket_for(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id.startswith("-"):  # grupos/supergrupos/canais têm id negativo
+                bucket = TokenBucket(GROUP_RATE_PER_MIN / 60, 3)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id: str, delay: float = 0.0) -> None:
+        if chat_id in self._scheduled:
+            return
+        self._scheduled.add(chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    def _requeue(self, chat_id: str, delay: float = 0.0) -> None:
+        self._scheduled.discard(chat_id)
+        if self._chat_queues.get(chat_id):
+            self._schedule(chat_id, delay)
+        else:
+            self._chat_queues.pop(chat_id, None)
+
+    def _finish(self, item: _Notification, ok: bool) -> None:
+        self.stats["sent" if ok else "failed"] += 1
+        if not item.future.done():
+            item.future.set_result(ok)
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chat_queues.get(chat_id)
+            if not queue:
+                self._requeue(chat_id)
+                continue
+
+            wait = self._bucket_for(chat_id).delay()
+            if wait > 0:
+                self._scheduled.discard(chat_id)
+                self._schedule(chat_id, wait)
+                continue
+
+            self._bucket_for(chat_id).consume()
+            global_wait = self._global.reserve()
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+
+            item = queue.popleft()
+            try:
+                retry_in = await self._send(item)
+            except Exception as e:
+                # Erro fora dos previstos (ex.: bug ao montar a requisição): o worker não pode morrer,
+                # senão o chat fica para sempre em _scheduled e não recebe mais nada.
+                logger.error("Erro inesperado ao enviar notificação para %s: %s", item.chat_id, e, exc_info=True)
+                retry_in = min(2 ** item.attempts, 60) if item.attempts < MAX_ATTEMPTS else self._give_up(item, e)
+            if retry_in is not None:
+                queue.appendleft(item)
+            self._requeue(chat_id, retry_in or 0.0)
+
+    async def _send(self, item: _Notification) -> Optional[float]:
+        """Envia uma mensagem. Retorna o atraso para tentar de novo, ou None se terminou (ok ou falha)."""
+        item.attempts += 1
+        try:
+            await self.bot.send_message(chat_id=item.chat_id, text=item.text, parse_mode=item.parse_mode)
+            self._finish(item, True)
+            return None
+        except RetryAfter as e:
+            delay = _seconds(e.retry_after)
+            self.stats["retry_after"] += 1
+            logger.warning("RetryAfter do Telegram para o chat %s: aguardando %.0fs.", item.chat_id, delay)
+            # Só este chat espera; os demais seguem (o bucket global já fica abaixo do limite da API).
+            self._bucket_for(item.chat_id).pause(delay)
+            return delay if item.attempts < MAX_ATTEMPTS else self._give_up(item, e)
+        except ChatMigrated as e:
+            new_chat_id = str(e.new_chat_id)
+            logger.info("Chat %s migrou para supergrupo %s.", item.chat_id, new_chat_id)
+            if self.on_chat_migrated:
+                await self._safe_callback(self.on_chat_migrated, item.chat_id, new_chat_id)
+            item.chat_id = new_chat_id
+            self._chat_queues.setdefault(new_chat_id, deque()).append(item)
+            self._schedule(new_chat_id)
+            return None
+        except Forbidden as e:
+            return self._chat_gone(item, e)
+        except BadRequest as e:
+            if any(marker in str(e).lower() for marker in _PERMANENT_BAD_REQUEST):
+                return self._chat_gone(item, e)
+            # Erro na própria mensagem (ex.: Markdown inválido): não adianta repetir.
+            logger.error("Mensagem rejeitada pelo Telegram para o chat %s: %s", item.chat_id, e)
+            self._finish(item, False)
+            return None
+        except (NetworkError, TelegramError) as e:
+            if item.attempts < MAX_ATTEMPTS:
+                delay = min(2 ** item.attempts, 60)
+                logger.warning(
+                    "Falha transitória ao enviar para %s (tentativa %s/%s): %s. Nova tentativa em %ss.",
+                    item.chat_id, item.attempts, MAX_ATTEMPTS, e, delay,
+                )
+                return delay
+            return self._give_up(item, e)
+
+    def _give_up(self, item: _Notification, error: Exception) -> None:
+        logger.error("Desistindo de enviar notificação para %s após %s tentativa(s): %s", item.chat_id, item.attempts, error)
+        self._finish(item, False)
+        return None
+
+    def _chat_gone(self, item: _Notification, error: Exception) -> None:
+        logger.warning("Chat %s não aceita mais mensagens do bot (%s). Removendo inscrições.", item.chat_id, error)
+        self.stats["chats_gone"] += 1
+        self._finish(item, False)
+        # Descarta o resto da fila desse chat.
+        for pending_item in self._chat_queues.pop(item.chat_id, deque()):
+            self._finish(pending_item, False)
+        if self.on_chat_gone:
+            asyncio.create_task(self._safe_callback(self.on_chat_gone, item.chat_id))
+        return None
+
+    @staticmethod
+    async def _safe_callback(callback, *args) -> None:
+        try:
+            await callback(*args)
+        except Exception as e:
+            logger.error("Falha no callback do despachante de notificações: %s", e, exc_info=True)
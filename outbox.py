@@ -0,0 +1,482 @@
+"""
+Outbox transacional das notificações.
+
+A atualização detectada é gravada em `notification_outbox` (uma linha por chat inscrito) na mesma
+transação que avança o `process_states`. Assim, ou o estado avança e as notificações ficam
+registradas, ou nada acontece; um restart ou uma falha do Telegram não faz mais a atualização
+"sumir". Um sender em segundo plano lê o outbox em lotes, entrega ao NotificationDispatcher e
+apaga as linhas enviadas; as que falham voltam com backoff.
+
+A entrega é "pelo menos uma vez": se o bot morrer depois de enviar e antes de apagar a linha,
+o lease expira e a mensagem é reenviada. A chave de idempotência (processo:timestamp:chat)
+garante que a mesma atualização não seja enfileirada duas vezes.
+
+Chats em modo resumo (/resumo) têm as linhas liberadas só quando a janela do chat fecha; o sender
+junta todas as atualizações daquele chat em uma única mensagem.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Collection, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+
+from database import SessionLocal, insert_ignore, notification_outbox
+from notifier import GROUP_RATE_PER_MIN, render_digest, render_update
+from scheduler import INSTANCE_ID
+
+logger = logging.getLogger(__name__)
+
+# Intervalo entre leituras do outbox quando não há nada novo (o job acorda o sender ao enfileirar).
+POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+# Quantas linhas cada leitura reserva, e quantas podem estar "em voo" no despachante ao mesmo tempo.
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "200"))
+# Lease das linhas reservadas. O sender renova o das linhas ainda em voo a cada LEASE_SECONDS / 3;
+# sem renovação (ex.: banco fora do ar), o limite por chat abaixo mantém a espera dentro do lease.
+LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "600"))
+# Mensagens de um mesmo chat no despachante. Um grupo recebe só ~18 msg/min: com o padrão, a fila
+# de um grupo esvazia em metade do lease, o que deixa folga para pausas de RetryAfter.
+MAX_IN_FLIGHT_PER_CHAT = int(
+    os.getenv("OUTBOX_MAX_IN_FLIGHT_PER_CHAT", str(max(1, int(GROUP_RATE_PER_MIN * LEASE_SECONDS / 60 / 2))))
+)
+# Depois de tantas rodadas sem sucesso (cada uma já com as tentativas do despachante), desiste.
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+RETRY_BASE_SECONDS = int(os.getenv("OUTBOX_RETRY_BASE", "60"))
+
+
+def idempotency_key(process_number: str, timestamp: str, chat_id: str) -> str:
+    return f"{process_number}:{timestamp}:{chat_id}"
+
+
+def enqueue_update(db, process_number: str, timestamp: str, details: str, subscribers: List[Tuple[str, Optional[int]]], now: Optional[datetime] = None) -> int:
+    """
+    Grava no outbox a atualização para cada assinante (chat_id, janela do resumo ou None).
+
+    Para chats em modo resumo, a linha só fica disponível quando a janela aberta do chat fecha
+    (a janela começa na primeira atualização pendente). Não faz commit: deve ir na mesma
+    transação que atualiza o process_states. Retorna quantas linhas foram inseridas.
+    """
+    if not subscribers:
+        return 0
+    now = now or datetime.utcnow()
+
+    digest_chats = [chat_id for chat_id, window in subscribers if window]
+    open_windows: Dict[str, datetime] = {}
+    if digest_chats:
+        query = (
+            select(notification_outbox.c.chat_id, func.min(notification_outbox.c.available_at))
+            .where(
+                notification_outbox.c.chat_id.in_(digest_chats),
+                notification_outbox.c.digest_window.isnot(None),
+                notification_outbox.c.attempts == 0,
+                # Linhas já reservadas pelo sender estão sendo enviadas: a janela delas já fechou.
+                notification_outbox.c.lease_expires_at.is_(None),
+            )
+            .group_by(notification_outbox.c.chat_id)
+        )
+        open_windows = {row[0]: row[1] for row in db.execute(query)}
+
+    rows = []
+    for chat_id, window in subscribers:
+        available_at = now
+        if window:
+            available_at = open_windows.get(chat_id) or now + timedelta(seconds=window)
+        rows.append({
+            "idempotency_key": idempotency_key(process_number, timestamp, chat_id),
+            "chat_id": chat_id,
+            "process_number": process_number,
+            "details": details,
+            "digest_window": window,
+            "created_at": now,
+            "available_at": available_at,
+            "attempts": 0,
+        })
+    result = insert_ignore(db, notification_outbox, rows, ["idempotency_key"])
+    return max(result.rowcount, 0)
+
+
+def claim_batch(db, now: datetime, limit: int, owner: str = INSTANCE_ID, lease_seconds: int = LEASE_SECONDS,
+                exclude_ids: Collection[int] = (), exclude_chats: Collection[str] = ()) -> list:
+    """
+    Reserva (lease) até `limit` linhas disponíveis, das mais antigas para as mais novas. Se o lote
+    pega alguma linha de um chat em modo resumo, leva junto todas as linhas vencidas desse chat
+    (mesmo passando de `limit`): o resumo é montado por lote, e um chat dividido entre dois lotes
+    receberia dois resumos. `exclude_ids` são linhas que o chamador ainda tem em voo (nunca são
+    reservadas de novo, mesmo com o lease vencido) e `exclude_chats`, chats que já estão no limite.
+    Usa FOR UPDATE SKIP LOCKED no Postgres, como o agendador. Não faz commit.
+    """
+    columns = (
+        notification_outbox.c.id,
+        notification_outbox.c.chat_id,
+        notification_outbox.c.process_number,
+        notification_outbox.c.details,
+        notification_outbox.c.digest_window,
+        notification_outbox.c.parts_sent,
+    )
+    available = (
+        notification_outbox.c.available_at <= now,
+        (notification_outbox.c.lease_expires_at.is_(None)) | (notification_outbox.c.lease_expires_at < now),
+    )
+    if exclude_ids:
+        available += (notification_outbox.c.id.notin_(list(exclude_ids)),)
+    if exclude_chats:
+        available += (notification_outbox.c.chat_id.notin_(list(exclude_chats)),)
+    query = (
+        select(*columns)
+        .where(*available)
+        .order_by(notification_outbox.c.available_at, notification_outbox.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(query).all()
+    digest_chats = {row.chat_id for row in rows if row.digest_window}
+    if digest_chats:
+        rest = (
+            select(*columns)
+            .where(
+                *available,
+                notification_outbox.c.chat_id.in_(digest_chats),
+                notification_outbox.c.digest_window.isnot(None),
+                notification_outbox.c.id.notin_([row.id for row in rows]),
+            )
+            .with_for_update(skip_locked=True)
+        )
+        rows += db.execute(rest).all()
+    if rows:
+        db.execute(
+            update(notification_outbox)
+            .where(notification_outbox.c.id.in_([row.id for row in rows]))
+            .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+        )
+    return rows
+
+
+def complete(db, ids: List[int]) -> None:
+    """Remove as linhas entregues. Não faz commit."""
+    if ids:
+        db.execute(delete(notification_outbox).where(notification_outbox.c.id.in_(ids)))
+
+
+def reschedule(db, ids: List[int], now: datetime) -> int:
+    """
+    Devolve linhas que falharam, com backoff exponencial; descarta as que esgotaram MAX_ATTEMPTS.
+    Retorna quantas foram descartadas. Não faz commit.
+    """
+    if not ids:
+        return 0
+    rows = db.execute(
+        select(notification_outbox.c.id, notification_outbox.c.attempts).where(notification_outbox.c.id.in_(ids))
+    ).all()
+    dropped = [row.id for row in rows if row.attempts + 1 >= MAX_ATTEMPTS]
+    for row in rows:
+        if row.id in dropped:
+            continue
+        delay = min(RETRY_BASE_SECONDS * 2 ** row.attempts, 6 * 3600)
+        db.execute(
+            update(notification_outbox)
+            .where(notification_outbox.c.id == row.id)
+            .values(
+                attempts=row.attempts + 1,
+                available_at=now + timedelta(seconds=delay),
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+        )
+    if dropped:
+        db.execute(delete(notification_outbox).where(notification_outbox.c.id.in_(dropped)))
+    return len(dropped)
+
+
+def record_progress(db, ids: List[int], parts_sent: int) -> None:
+    """Guarda quantas partes de um resumo já foram entregues, para não reenviá-las. Não faz commit."""
+    if ids:
+        db.execute(update(notification_outbox).where(notification_outbox.c.id.in_(ids)).values(parts_sent=parts_sent))
+
+
+def renew_leases(db, ids: List[int], now: datetime, owner: str = INSTANCE_ID, lease_seconds: int = LEASE_SECONDS) -> int:
+    """Estende o lease das linhas desta réplica que ainda estão em voo. Não faz commit."""
+    if not ids:
+        return 0
+    stmt = update(notification_outbox).where(notification_outbox.c.id.in_(ids), notification_outbox.c.lease_owner == owner)
+    return db.execute(stmt.values(lease_expires_at=now + timedelta(seconds=lease_seconds))).rowcount
+
+
+def release_leases(db, owner: str = INSTANCE_ID, ids: Optional[List[int]] = None) -> int:
+    """
+    Libera as linhas reservadas por esta réplica (todas, no desligamento/restart, ou só `ids`, que
+    ficaram para uma próxima leitura). Não faz commit.
+    """
+    stmt = update(notification_outbox).where(notification_outbox.c.lease_owner == owner)
+    if ids is not None:
+        stmt = stmt.where(notification_outbox.c.id.in_(ids))
+    return db.execute(stmt.values(lease_owner=None, lease_expires_at=None)).rowcount
+
+
+def drop_chat(db, chat_id: str) -> None:
+    """Descarta as notificações pendentes de um chat que não aceita mais mensagens. Não faz commit."""
+    db.execute(delete(notification_outbox).where(notification_outbox.c.chat_id == chat_id))
+
+
+def migrate_chat(db, old_chat_id: str, new_chat_id: str) -> None:
+    """Grupo virou supergrupo: as notificações pendentes passam para o novo chat_id. Não faz commit."""
+    db.execute(
+        update(notification_outbox)
+        .where(notification_outbox.c.chat_id == old_chat_id)
+        .values(chat_id=new_chat_id)
+    )
+
+
+def build_messages(rows) -> List[Tuple[List[int], str, List[str], int]]:
+    """
+    Transforma linhas reservadas em mensagens: (ids, chat_id, partes a enviar, partes já enviadas).
+    Atualizações comuns viram uma mensagem de uma parte cada; as de chats em modo resumo são
+    agrupadas por chat (vale o estado mais recente de cada processo) e podem ter mais de uma parte
+    se passarem de 4096 caracteres. Um resumo que falhou no meio recomeça da parte seguinte à
+    última entregue (`parts_sent`), desde que seja o mesmo resumo: todas as linhas com o mesmo valor.
+    """
+    messages = []
+    digests: Dict[str, Dict[str, str]] = {}
+    digest_rows: Dict[str, list] = {}
+    for row in sorted(rows, key=lambda r: r.id):
+        if not row.digest_window:
+            messages.append(([row.id], row.chat_id, [render_update(row.process_number, row.details)], 0))
+            continue
+        digests.setdefault(row.chat_id, {})[row.process_number] = row.details
+        digest_rows.setdefault(row.chat_id, []).append(row)
+
+    for chat_id, updates in digests.items():
+        ids = [row.id for row in digest_rows[chat_id]]
+        if len(updates) == 1:
+            numero, details = next(iter(updates.items()))
+            messages.append((ids, chat_id, [render_update(numero, details)], 0))
+            continue
+        # Todas as partes do resumo respondem pelas mesmas linhas: só saem do outbox se todas forem enviadas.
+        parts = render_digest(sorted(updates.items()))
+        progress = {row.parts_sent or 0 for row in digest_rows[chat_id]}
+        sent = progress.pop() if len(progress) == 1 else 0
+        if sent >= len(parts):
+            sent = 0
+        messages.append((ids, chat_id, parts[sent:], sent))
+    return messages
+
+
+class OutboxSender:
+    """
+    Lê o outbox em lotes e entrega as mensagens ao NotificationDispatcher, sem esperar pelo
+    Telegram para buscar o próximo lote. Os resultados são gravados em lote a cada iteração.
+    """
+
+    def __init__(self, dispatcher, owner: str = INSTANCE_ID, poll_seconds: float = POLL_SECONDS, batch_size: int = BATCH_SIZE,
+                 max_in_flight: int = MAX_IN_FLIGHT, max_per_chat: int = MAX_IN_FLIGHT_PER_CHAT, lease_seconds: int = LEASE_SECONDS):
+        self.dispatcher = dispatcher
+        self.owner = owner
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_per_chat = max_per_chat
+        self.lease_seconds = lease_seconds
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Linhas com mensagem no despachante, e resultados ainda não gravados no banco.
+        self._in_flight: set = set()
+        # Linhas reservadas por este sender até o resultado ser gravado (não são reservadas de novo e
+        # têm o lease renovado), e mensagens no despachante por chat.
+        self._in_flight_ids: set = set()
+        self._chat_in_flight: Dict[str, int] = {}
+        self._last_renew = time.monotonic()
+        self._done_ids: List[int] = []
+        self._failed_ids: List[int] = []
+        self._progress: List[Tuple[List[int], int]] = []
+        self.stats = {"delivered": 0, "retried": 0, "dropped": 0, "batches": 0}
+
+    # --- API pública ---
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="outbox-sender")
+
+    def wake(self) -> None:
+        """Chamado depois de enfileirar no outbox, para não esperar o próximo poll."""
+        self._wake.set()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Para de buscar lotes, espera as mensagens em voo por até `timeout` s e grava os resultados."""
+        self._stopping = True
+        self._wake.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+        try:
+            await self._settle()
+            # O que não foi concluído volta a ficar disponível imediatamente para o próximo processo.
+            await asyncio.to_thread(self._db_release)
+        except Exception as e:
+            logger.error("Falha ao gravar o estado do outbox no desligamento: %s", e)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "in_flight": len(self._in_flight)}
+
+    # --- Internos ---
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            claimed = 0
+            try:
+                await self._settle()
+                await self._renew()
+                room = self.max_in_flight - len(self._in_flight)
+                if room > 0:
+                    claimed = await self._dispatch_batch(min(self.batch_size, room))
+            except Exception as e:
+                logger.error("Falha ao processar o outbox de notificações: %s", e, exc_info=True)
+
+            # Lote cheio: provavelmente há mais linhas esperando, continua sem dormir.
+            if claimed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+        # Desligando: espera o que já está no despachante (o chamador limita o tempo).
+        while self._in_flight:
+            await asyncio.sleep(0.2)
+
+    async def _dispatch_batch(self, limit: int) -> int:
+        full = [chat_id for chat_id, queued in self._chat_in_flight.items() if queued >= self.max_per_chat]
+        rows = await asyncio.to_thread(self._db_claim, limit, list(self._in_flight_ids), full)
+        if not rows:
+            return 0
+        self.stats["batches"] += 1
+        deferred = []
+        for ids, chat_id, parts, sent in build_messages(rows):
+            queued = self._chat_in_flight.get(chat_id, 0)
+            # Chat no limite: devolve as linhas (um resumo grande passa sozinho, se o chat estiver vazio).
+            if queued and queued + len(parts) > self.max_per_chat:
+                deferred += ids
+                continue
+            self._chat_in_flight[chat_id] = queued + len(parts)
+            self._in_flight_ids.update(ids)
+            task = asyncio.create_task(self._await_delivery(ids, chat_id, parts, sent))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+        if deferred:
+            await asyncio.to_thread(self._db_release, deferred)
+        return len(rows) - len(deferred)
+
+    async def _await_delivery(self, ids: List[int], chat_id: str, parts: List[str], sent: int) -> None:
+        # Uma parte por vez: se uma falha, as seguintes não saem fora de ordem e a próxima rodada
+        # recomeça exatamente dela.
+        delivered = 0
+        try:
+            for text in parts:
+                result, = await asyncio.gather(self.dispatcher.submit(chat_id, text), return_exceptions=True)
+                if result is not True:
+                    break
+                delivered += 1
+        finally:
+            remaining = self._chat_in_flight.get(chat_id, 0) - len(parts)
+            if remaining > 0:
+                self._chat_in_flight[chat_id] = remaining
+            else:
+                self._chat_in_flight.pop(chat_id, None)
+        if delivered == len(parts):
+            self._done_ids.extend(ids)
+        else:
+            self._failed_ids.extend(ids)
+            if delivered:
+                self._progress.append((ids, sent + delivered))
+        self._wake.set()
+
+    async def _renew(self) -> None:
+        """Renova, a cada terço do lease, o lease das linhas que ainda estão em voo."""
+        if not self._in_flight_ids or time.monotonic() - self._last_renew < self.lease_seconds / 3:
+            return
+        await asyncio.to_thread(self._db_renew, list(self._in_flight_ids))
+        self._last_renew = time.monotonic()
+
+    def _db_renew(self, ids: List[int]) -> int:
+        db = SessionLocal()
+        try:
+            renewed = renew_leases(db, ids, datetime.utcnow(), owner=self.owner, lease_seconds=self.lease_seconds)
+            db.commit()
+            return renewed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _db_claim(self, limit: int, exclude_ids: List[int], exclude_chats: List[str]) -> list:
+        db = SessionLocal()
+        try:
+            rows = claim_batch(
+                db, datetime.utcnow(), limit, owner=self.owner, lease_seconds=self.lease_seconds,
+                exclude_ids=exclude_ids, exclude_chats=exclude_chats,
+            )
+            db.commit()
+            return rows
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _settle(self) -> None:
+        """Grava em uma transação os resultados acumulados desde a última iteração."""
+        done, self._done_ids = self._done_ids, []
+        failed, self._failed_ids = self._failed_ids, []
+        progress, self._progress = self._progress, []
+        if not done and not failed:
+            return
+        try:
+            dropped = await asyncio.to_thread(self._db_settle, done, failed, progress)
+        except Exception:
+            # Devolve para a próxima iteração; se o bot cair antes, o lease expira e elas são reenviadas.
+            self._done_ids.extend(done)
+            self._failed_ids.extend(failed)
+            self._progress.extend(progress)
+            raise
+        # Gravadas: as concluídas saíram do outbox e as que falharam voltaram para a fila com backoff.
+        self._in_flight_ids.difference_update(done)
+        self._in_flight_ids.difference_update(failed)
+        self.stats["delivered"] += len(done)
+        self.stats["retried"] += len(failed) - dropped
+        self.stats["dropped"] += dropped
+        if dropped:
+            logger.error("%s notificação(ões) descartada(s) do outbox após %s rodadas sem sucesso.", dropped, MAX_ATTEMPTS)
+
+    def _db_settle(self, done: List[int], failed: List[int], progress: List[Tuple[List[int], int]]) -> int:
+        db = SessionLocal()
+        try:
+            complete(db, done)
+            for ids, parts_sent in progress:
+                record_progress(db, ids, parts_sent)
+            dropped = reschedule(db, failed, datetime.utcnow())
+            db.commit()
+            return dropped
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _db_release(self, ids: Optional[List[int]] = None) -> int:
+        db = SessionLocal()
+        try:
+            released = release_leases(db, owner=self.owner, ids=ids)
+            db.commit()
+            return released
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
@@ -0,0 +1,223 @@
+"""
+Ferramentas de diagnóstico para produção, expostas pelo web_server em /debug/* (exigem ADMIN_TOKEN).
+
+- Perfil por amostragem (CPU): uma thread lê as pilhas do event loop e das threads do scraper
+  a cada `interval` segundos, por no máximo PROFILE_MAX_SECONDS, e gera "collapsed stacks"
+  (formato do flamegraph.pl / speedscope). Opcionalmente liga o cProfile no event loop e
+  devolve o resultado em formato pstats (`python -m pstats arquivo.prof`, snakeviz).
+- tracemalloc: snapshots de alocação e diff entre o snapshot atual e o anterior.
+- Dump das tarefas asyncio (com o nome `check:<processo>` das verificações) e das threads do scraper.
+
+Só usa a biblioteca padrão; nada disso fica ativo até ser pedido.
+"""
+
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from typing import Dict, Optional
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_MIN_INTERVAL = 0.001
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    """Pilha da raiz para a folha, separada por ';' (formato collapsed)."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Perfil por amostragem com duração limitada. Um perfil por vez."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._counts: Counter = Counter()
+        self._samples = 0
+        self._started_at = 0.0
+        self._finished_at = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._pstats: Optional[bytes] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.01, all_threads: bool = False, with_pstats: bool = False) -> bool:
+        """
+        Começa um perfil de `seconds` segundos. Deve ser chamado de dentro do event loop (a thread
+        atual é tratada como a do loop). Retorna False se já houver um perfil em andamento.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+            interval = max(interval, PROFILE_MIN_INTERVAL)
+            self._counts = Counter()
+            self._samples = 0
+            self._pstats = None
+            self._stop.clear()
+            self._started_at = time.time()
+            self._finished_at = 0.0
+            self._loop = asyncio.get_running_loop()
+            if with_pstats:
+                # O cProfile mede a thread em que é ligado: aqui, a do event loop.
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+            self._thread = threading.Thread(
+                target=self._sample,
+                args=(threading.get_ident(), seconds, interval, all_threads),
+                name="profiler-sampler",
+                daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _sample(self, loop_thread_id: int, seconds: float, interval: float, all_threads: bool) -> None:
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                name = names.get(thread_id, str(thread_id))
+                if thread_id == loop_thread_id:
+                    name = "event-loop"
+                elif not all_threads and not name.startswith("scraper-"):
+                    continue
+                self._counts[f"{name};{_collapse(frame)}"] += 1
+            self._samples += 1
+            self._stop.wait(interval)
+        self._finished_at = time.time()
+        if self._cprofile is not None and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._finish_cprofile)
+            except RuntimeError:
+                pass  # loop já fechado
+
+    def _finish_cprofile(self) -> None:
+        profile, self._cprofile = self._cprofile, None
+        if profile is None:
+            return
+        profile.disable()
+        profile.create_stats()
+        # Mesmo conteúdo que Profile.dump_stats grava em arquivo.
+        self._pstats = marshal.dumps(profile.stats)
+
+    def status(self) -> Dict:
+        return {
+            "running": self.running,
+            "samples": self._samples,
+            "started_at": self._started_at or None,
+            "finished_at": self._finished_at or None,
+            "pstats_available": self._pstats is not None,
+        }
+
+    def collapsed(self) -> str:
+        """Resultado (parcial, se ainda rodando) em collapsed stacks: 'pilha contagem' por linha."""
+        return "".join(f"{stack} {count}\n" for stack, count in self._counts.most_common())
+
+    def pstats_data(self) -> Optional[bytes]:
+        return self._pstats
+
+
+class AllocationTracker:
+    """tracemalloc sob demanda: cada snapshot é comparado com o anterior."""
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ]
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 10) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(frames, 1))
+        self._previous = None
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self._previous = None
+
+    def snapshot(self, limit: int = 25, key_type: str = "lineno") -> str:
+        """Top `limit` por `key_type` ('lineno', 'filename' ou 'traceback'); a partir do segundo, em diff."""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc não está ativo.")
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        current, peak = tracemalloc.get_traced_memory()
+        out = io.StringIO()
+        out.write(f"# memória rastreada: atual={current / 1024:.1f} KiB pico={peak / 1024:.1f} KiB\n")
+        if self._previous is None:
+            out.write(f"# top {limit} por {key_type} (primeiro snapshot; os próximos mostram a diferença)\n")
+            stats = snapshot.statistics(key_type)
+        else:
+            out.write(f"# top {limit} diferenças por {key_type} em relação ao snapshot anterior\n")
+            stats = snapshot.compare_to(self._previous, key_type)
+        for stat in stats[:limit]:
+            out.write(f"{stat}\n")
+            if key_type == "traceback":
+                for line in stat.traceback.format():
+                    out.write(f"    {line}\n")
+        self._previous = snapshot
+        return out.getvalue()
+
+
+def dump_tasks(max_frames: int = 20) -> str:
+    """Pilha de cada tarefa asyncio. As verificações aparecem como `check:<processo>`."""
+    out = io.StringIO()
+    tasks = sorted(asyncio.all_tasks(), key=lambda t: t.get_name())
+    out.write(f"# {len(tasks)} tarefa(s) asyncio\n")
+    for task in tasks:
+        coro = task.get_coro()
+        out.write(f"\n== {task.get_name()} ({getattr(coro, '__qualname__', coro)})\n")
+        for frame in task.get_stack(limit=max_frames):
+            out.write("".join(traceback.format_stack(frame, limit=1)))
+    return out.getvalue()
+
+
+def dump_threads(current_work: Optional[Dict[str, str]] = None, all_threads: bool = False) -> str:
+    """Pilha das threads do scraper (ou de todas), com o que cada uma está consultando."""
+    out = io.StringIO()
+    frames = sys._current_frames()
+    current_work = current_work or {}
+    for thread in threading.enumerate():
+        if not all_threads and not thread.name.startswith("scraper-"):
+            continue
+        frame = frames.get(thread.ident)
+        work = current_work.get(thread.name)
+        out.write(f"\n== {thread.name}" + (f" -> {work}" if work else " (ociosa)") + "\n")
+        if frame is not None:
+            out.write("".join(traceback.format_stack(frame)))
+    return out.getvalue()
+
+
+profiler = SamplingProfiler()
+allocations = AllocationTracker()
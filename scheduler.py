@@ -0,0 +1,247 @@
+"""
+Agenda adaptativa das verificações automáticas.
+
+Em vez de varrer todos os processos a cada 40 minutos, cada processo tem um "próximo horário
+devido" persistido em `process_schedule`. O intervalo é proporcional ao tempo desde a última
+mudança (processo parado há um ano é verificado raramente; processo que andou ontem, com
+frequência), limitado por um piso e um teto. O job do bot roda em "ticks" curtos e pega só
+um lote pequeno de processos devidos por tick, espalhando as consultas ao SIMLAM no tempo.
+
+Com várias réplicas do bot apontando para o mesmo Postgres, cada réplica reserva (lease) o seu
+lote com SELECT ... FOR UPDATE SKIP LOCKED; assim nenhum processo é verificado (e notificado)
+duas vezes, e a vazão de verificações cresce com o número de réplicas.
+"""
+
+import logging
+import os
+import random
+import re
+import socket
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, exists, select, update
+
+from database import insert_ignore, monitored_processes, process_schedule, upsert
+
+logger = logging.getLogger(__name__)
+
+# Piso e teto do intervalo entre verificações de um mesmo processo (segundos).
+MIN_INTERVAL = int(os.getenv("CHECK_MIN_INTERVAL", "1200"))  # 20 min
+MAX_INTERVAL = int(os.getenv("CHECK_MAX_INTERVAL", "43200"))  # 12 h
+# Intervalo usado quando não há histórico (processo recém-adicionado, sem data de tramitação).
+DEFAULT_INTERVAL = int(os.getenv("CHECK_DEFAULT_INTERVAL", "2400"))  # 40 min (intervalo antigo)
+# Fração do "tempo parado" usada como intervalo: parado há 10 dias -> verifica a cada 1 dia (com fator 0.1).
+ACTIVITY_FACTOR = float(os.getenv("CHECK_ACTIVITY_FACTOR", "0.1"))
+# Após uma falha (SIMLAM fora do ar, sem timestamp), tenta de novo depois deste intervalo.
+RETRY_INTERVAL = int(os.getenv("CHECK_RETRY_INTERVAL", str(MIN_INTERVAL)))
+# Variação aleatória aplicada ao intervalo, para que processos não "sincronizem" entre si.
+JITTER_FRACTION = float(os.getenv("CHECK_JITTER_FRACTION", "0.1"))
+
+# Frequência do tick e quantos processos devidos cada tick pode verificar.
+# Com os padrões (60 s, 4 por tick), o orçamento é de até 240 consultas/hora ao SIMLAM.
+TICK_SECONDS = int(os.getenv("SCHEDULER_TICK", "60"))
+BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "4"))
+# Verificações em andamento por réplica. O tick não espera as suas terminarem: uma consulta lenta
+# (até o prazo do SIMLAM) só ocupa uma vaga, e os ticks seguintes reservam até as vagas livres.
+MAX_IN_FLIGHT = int(os.getenv("SCHEDULER_MAX_IN_FLIGHT", str(BATCH_SIZE * 4)))
+
+# Identidade desta réplica e duração do lease sobre os processos que ela pegou para verificar.
+# O lease deve cobrir com folga uma verificação completa (scraping + notificações).
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "900"))
+
+# Horário das tramitações no PDF é o de Belém (UTC-3); guardamos tudo em UTC.
+_SIMLAM_UTC_OFFSET = timedelta(hours=int(os.getenv("SIMLAM_UTC_OFFSET_HOURS", "-3")))
+_TIMESTAMP_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y")
+
+
+def parse_tramitacao_timestamp(timestamp: Optional[str]) -> Optional[datetime]:
+    """
+    Converte o timestamp de uma tramitação (ex.: '12/03/2024 10:22:31') em datetime UTC (naive).
+    Retorna None se o formato não for reconhecido.
+    """
+    if not timestamp:
+        return None
+    match = re.search(r"\d{2}/\d{2}/\d{4}(?:\s+\d{1,2}:\d{2}(?::\d{2})?)?", timestamp)
+    if not match:
+        return None
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(match.group(0), fmt) - _SIMLAM_UTC_OFFSET
+        except ValueError:
+            continue
+    return None
+
+
+def compute_interval(last_change_at: Optional[datetime], now: datetime) -> int:
+    """
+    Intervalo (segundos) até a próxima verificação, a partir da data da última mudança conhecida.
+    """
+    if last_change_at is None:
+        base = DEFAULT_INTERVAL
+    else:
+        idle_seconds = max((now - last_change_at).total_seconds(), 0)
+        base = idle_seconds * ACTIVITY_FACTOR
+    interval = min(max(base, MIN_INTERVAL), MAX_INTERVAL)
+    interval *= random.uniform(1 - JITTER_FRACTION, 1 + JITTER_FRACTION)
+    return int(interval)
+
+
+def _ensure_schedule_rows(db) -> None:
+    """Cria linhas de agenda (devidas imediatamente) para processos monitorados que ainda não têm uma."""
+    missing_query = select(monitored_processes.c.process_number).where(
+        ~exists().where(process_schedule.c.process_number == monitored_processes.c.process_number)
+    )
+    missing = [{"process_number": row[0]} for row in db.execute(missing_query)]
+    if missing:
+        insert_ignore(db, process_schedule, missing, ["process_number"])
+
+
+def schedule_first_check(db, process_numbers: List[str], next_check_at: datetime) -> None:
+    """
+    Cria a agenda de processos recém-adicionados com a primeira verificação em `next_check_at`
+    (ex.: importação em massa, que busca o estado inicial por conta própria antes disso).
+    Processos que já têm agenda não são alterados. Não faz commit.
+    """
+    if process_numbers:
+        rows = [{"process_number": numero, "next_check_at": next_check_at} for numero in process_numbers]
+        insert_ignore(db, process_schedule, rows, ["process_number"])
+
+
+def make_due(db, process_numbers: List[str], now: datetime) -> int:
+    """
+    Antecipa para `now` a próxima verificação dos processos (ex.: a varredura da grade viu a linha
+    deles mudar). Só antecipa: quem já está devido não muda. Retorna quantos foram antecipados.
+    Não faz commit.
+    """
+    if not process_numbers:
+        return 0
+    return db.execute(
+        update(process_schedule)
+        .where(
+            process_schedule.c.process_number.in_(process_numbers),
+            process_schedule.c.next_check_at > now,
+        )
+        .values(next_check_at=now)
+    ).rowcount
+
+
+def claim_due_processes(db, now: datetime, limit: int, owner: str = INSTANCE_ID, lease_seconds: int = LEASE_SECONDS) -> List[str]:
+    """
+    Reserva (lease) até `limit` processos devidos para esta réplica, do mais atrasado para o menos atrasado.
+
+    No Postgres, usa SELECT ... FOR UPDATE SKIP LOCKED: réplicas concorrentes pegam lotes disjuntos
+    sem esperar umas pelas outras. Um processo com lease válido de outra réplica é ignorado; se essa
+    réplica cair, o lease expira e o processo volta a ficar disponível.
+    No SQLite (instância única) o FOR UPDATE é omitido e a escrita já é serializada pelo próprio banco.
+
+    Não faz commit: o chamador deve commitar para efetivar o lease.
+    """
+    _ensure_schedule_rows(db)
+
+    query = (
+        select(process_schedule.c.process_number)
+        .join(
+            monitored_processes,
+            monitored_processes.c.process_number == process_schedule.c.process_number,
+        )
+        .where(
+            (process_schedule.c.next_check_at.is_(None)) | (process_schedule.c.next_check_at <= now),
+            (process_schedule.c.lease_expires_at.is_(None)) | (process_schedule.c.lease_expires_at < now),
+        )
+        # Entre os devidos, primeiro os mais desatualizados (nunca verificados com sucesso vêm antes).
+        .order_by(
+            process_schedule.c.last_succeeded_at.asc().nulls_first(),
+            process_schedule.c.next_check_at.asc().nulls_first(),
+        )
+        .limit(limit)
+        .with_for_update(skip_locked=True, of=process_schedule)
+    )
+    claimed = [row[0] for row in db.execute(query)]
+    if claimed:
+        db.execute(
+            update(process_schedule)
+            .where(process_schedule.c.process_number.in_(claimed))
+            .values(
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                last_attempted_at=now,
+            )
+        )
+    return claimed
+
+
+def release_leases(db, owner: str = INSTANCE_ID, process_numbers: Optional[List[str]] = None) -> int:
+    """
+    Libera leases desta réplica sem reagendar (os processos continuam devidos e são retomados logo).
+    Usado ao drenar no desligamento e ao subir com um INSTANCE_ID fixo. Não faz commit.
+    """
+    stmt = update(process_schedule).where(process_schedule.c.lease_owner == owner)
+    if process_numbers is not None:
+        stmt = stmt.where(process_schedule.c.process_number.in_(process_numbers))
+    return db.execute(stmt.values(lease_owner=None, lease_expires_at=None)).rowcount
+
+
+def record_check(db, process_number: str, timestamp: Optional[str], changed: bool, ok: bool, now: Optional[datetime] = None,
+                 owner: str = INSTANCE_ID) -> int:
+    """
+    Registra o resultado de uma verificação e agenda a próxima. Retorna o intervalo escolhido (segundos).
+
+    Se o lease desta réplica venceu durante a verificação e outra réplica já reservou o processo, a
+    agenda fica como está: a verificação da outra réplica registra o resultado e libera o lease dela.
+    Não faz commit: o chamador decide a transação.
+    """
+    now = now or datetime.utcnow()
+    row = db.execute(
+        select(
+            process_schedule.c.last_change_at,
+            process_schedule.c.last_succeeded_at,
+            process_schedule.c.check_interval,
+            process_schedule.c.lease_owner,
+            process_schedule.c.lease_expires_at,
+        )
+        .where(process_schedule.c.process_number == process_number)
+        # Trava a linha até o commit: um claim_due_processes concorrente (SKIP LOCKED) não a pega no meio.
+        .with_for_update()
+    ).first()
+    if row and row.lease_owner not in (None, owner) and row.lease_expires_at and row.lease_expires_at > now:
+        logger.warning(
+            "Processo %s reservado por outra réplica (%s) durante a verificação; agenda mantida.",
+            process_number, row.lease_owner,
+        )
+        return row.check_interval or DEFAULT_INTERVAL
+    last_change_at = row.last_change_at if row else None
+    last_succeeded_at = row.last_succeeded_at if row else None
+
+    if ok:
+        # A data da última tramitação é o melhor histórico que temos; se não der para interpretá-la,
+        # usamos o momento em que a mudança foi detectada.
+        last_change_at = parse_tramitacao_timestamp(timestamp) or (now if changed else last_change_at)
+        interval = compute_interval(last_change_at, now)
+        last_succeeded_at = now
+    else:
+        interval = RETRY_INTERVAL
+
+    upsert(
+        db,
+        process_schedule,
+        {
+            "process_number": process_number,
+            "next_check_at": now + timedelta(seconds=interval),
+            "last_attempted_at": now,
+            "last_succeeded_at": last_succeeded_at,
+            "last_change_at": last_change_at,
+            "check_interval": interval,
+            # Verificação concluída: libera o lease.
+            "lease_owner": None,
+            "lease_expires_at": None,
+        },
+        ["process_number"],
+    )
+    return interval
+
+
+def forget_process(db, process_number: str) -> None:
+    """Remove a agenda de um processo que deixou de ser monitorado. Não faz commit."""
+    db.execute(delete(process_schedule).where(process_schedule.c.process_number == process_number))
@@ -0,0 +1,356 @@
+"""
+Executor dedicado às consultas ao SIMLAM, com prioridade para comandos interativos.
+
+Antes, todo scraping ia para o executor padrão do asyncio (`asyncio.to_thread`): um /status
+enviado no meio de uma rodada de verificações automáticas, ou de um /listar com dezenas de
+processos, esperava atrás de todo o trabalho de fundo. Aqui há duas filas ("lanes"):
+
+- INTERACTIVE: comandos de usuários (/status, /listar, /monitorar, consulta direta);
+- BACKGROUND: verificações agendadas.
+
+Um worker livre sempre atende primeiro a fila interativa, e as verificações de fundo nunca
+ocupam todos os workers (BACKGROUND_MAX), de modo que sempre sobra vaga para um usuário.
+
+Controle de admissão da lane interativa: cada chat (`key=chat_id`) tem sua própria fila, e os
+workers atendem os chats em rodízio (um item de cada chat por vez), para que um /listar com 80
+processos não passe na frente do /status de outra pessoa. Por chat há limite de consultas
+simultâneas (SCRAPER_CHAT_CONCURRENCY) e de taxa (SCRAPER_CHAT_RATE por minuto, com rajada de
+SCRAPER_CHAT_BURST): o que passa disso fica adiado na fila do chat. Acima de SCRAPER_CHAT_MAX_QUEUED
+itens no chat, ou SCRAPER_QUEUE_MAX na fila interativa inteira, `submit` levanta Rejected. Enquanto
+houver verificações de fundo na fila, os comandos ocupam no máximo SCRAPER_INTERACTIVE_MAX workers,
+para que nenhum usuário atrase a varredura.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+_LANE_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Threads de scraping (cada consulta segura uma thread por até SIMLAM_LOOKUP_TIMEOUT segundos).
+WORKERS = int(os.getenv("SCRAPER_WORKERS", "4"))
+# Quantas dessas threads as verificações de fundo podem ocupar ao mesmo tempo (padrão: todas menos uma).
+BACKGROUND_MAX = int(os.getenv("SCRAPER_BACKGROUND_MAX", str(max(WORKERS - 1, 1))))
+# Quantas threads os comandos podem ocupar enquanto há verificações de fundo esperando (padrão: todas menos uma).
+INTERACTIVE_MAX = int(os.getenv("SCRAPER_INTERACTIVE_MAX", str(max(WORKERS - 1, 1))))
+
+# Cotas por chat na lane interativa.
+CHAT_CONCURRENCY = int(os.getenv("SCRAPER_CHAT_CONCURRENCY", "3"))  # consultas simultâneas (0 = sem limite)
+CHAT_RATE = float(os.getenv("SCRAPER_CHAT_RATE", "20"))  # consultas/minuto (0 = sem limite)
+CHAT_BURST = int(os.getenv("SCRAPER_CHAT_BURST", "20"))
+CHAT_MAX_QUEUED = int(os.getenv("SCRAPER_CHAT_MAX_QUEUED", "100"))
+QUEUE_MAX = int(os.getenv("SCRAPER_QUEUE_MAX", "300"))  # itens interativos na fila, somando todos os chats
+# Com mais chats que isso em memória, os ociosos (cota já recomposta) são descartados.
+_PRUNE_THRESHOLD = 512
+
+
+class Rejected(Exception):
+    """A consulta não foi aceita (fila do chat ou fila global cheia). A mensagem é para o usuário."""
+
+
+class _ChatQueue:
+    """Fila e cotas de um chat na lane interativa."""
+
+    __slots__ = ("items", "running", "tokens", "refilled_at", "deferred")
+
+    def __init__(self, burst: int, now: float):
+        self.items: Deque[tuple] = deque()
+        self.running = 0
+        self.tokens = float(burst)
+        self.refilled_at = now
+        self.deferred = 0
+
+    def refill(self, rate: float, burst: int, now: float) -> None:
+        self.tokens = min(float(burst), self.tokens + (now - self.refilled_at) * rate / 60.0)
+        self.refilled_at = now
+
+
+class _LaneStats:
+    __slots__ = ("queued", "running", "completed", "wait_total", "wait_max", "wait_last")
+
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_last = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "wait_avg_s": round(self.wait_total / self.completed, 3) if self.completed else 0.0,
+            "wait_max_s": round(self.wait_max, 3),
+            "wait_last_s": round(self.wait_last, 3),
+        }
+
+
+class ScraperExecutor:
+    """
+    Pool de threads com duas lanes: a interativa, com uma fila por chat atendida em rodízio, e a
+    de fundo, FIFO.
+
+    Dentro da fila de um chat a ordem é de chegada. Itens cancelados enquanto ainda na fila
+    (ex.: o handler desistiu por timeout) são descartados sem rodar.
+    """
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        background_max: int = BACKGROUND_MAX,
+        interactive_max: int = INTERACTIVE_MAX,
+        chat_concurrency: int = CHAT_CONCURRENCY,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: int = CHAT_BURST,
+        chat_max_queued: int = CHAT_MAX_QUEUED,
+        queue_max: int = QUEUE_MAX,
+    ):
+        self.workers = max(workers, 1)
+        self.background_max = min(max(background_max, 1), self.workers)
+        self.interactive_max = min(max(interactive_max, 1), self.workers)
+        self.chat_concurrency = chat_concurrency
+        self.chat_rate = chat_rate
+        self.chat_burst = max(chat_burst, 1)
+        self.chat_max_queued = chat_max_queued
+        self.queue_max = queue_max
+        self._background: Deque[tuple] = deque()
+        # Filas interativas por chat; `_active` é o rodízio dos chats com itens na fila.
+        self._chats: Dict[Hashable, _ChatQueue] = {}
+        self._active: Deque[Hashable] = deque()
+        self._rejected = 0
+        self._deferred_pruned = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._shutdown = False
+        self._stats = {lane: _LaneStats() for lane in _LANE_NAMES}
+        # Nome da thread -> o que ela está rodando agora (ex.: "buscar_processo('123/2024')").
+        self._current: Dict[str, str] = {}
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"scraper-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn: Callable, *args, priority: int = INTERACTIVE, key: Hashable = None, **kwargs) -> Future:
+        """
+        Enfileira `fn(*args, **kwargs)`. Na lane interativa, `key` identifica o chat para as cotas e o
+        rodízio (None = sem cotas). O Future devolvido tem `queue_position`: quantos itens, contando
+        este, ainda precisam começar antes dele (0 = começa já). Levanta Rejected se a fila estiver cheia.
+        """
+        future: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Executor de scraping já foi encerrado.")
+            self._ensure_started()
+            now = time.monotonic()
+            item = (priority, key, now, future, fn, args, kwargs)
+            if priority == BACKGROUND:
+                self._background.append(item)
+                future.queue_position = 0
+            else:
+                chat = self._admit(key, now)
+                chat.items.append(item)
+                if len(chat.items) == 1:
+                    self._active.append(key)
+                future.queue_position = self._position(key, chat)
+            self._stats[priority].queued += 1
+            self._cond.notify()
+        return future
+
+    async def run(self, fn: Callable, *args, priority: int = INTERACTIVE, key: Hashable = None, **kwargs) -> Any:
+        """Versão assíncrona de submit: equivalente a `asyncio.to_thread`, mas com prioridade."""
+        return await asyncio.wrap_future(self.submit(fn, *args, priority=priority, key=key, **kwargs))
+
+    def shutdown(self) -> None:
+        """Cancela o que ainda está na fila. Consultas em andamento terminam sozinhas (threads daemon)."""
+        with self._cond:
+            self._shutdown = True
+            queued = list(self._background)
+            self._background.clear()
+            for chat in self._chats.values():
+                queued.extend(chat.items)
+                chat.items.clear()
+            self._active.clear()
+            for item in queued:
+                self._stats[item[0]].queued -= 1
+                item[3].cancel()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidade das filas, threads ocupadas, tempo de espera por lane e o controle de admissão."""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "background_max": self.background_max,
+                "interactive_max": self.interactive_max,
+                **{name: self._stats[lane].as_dict() for lane, name in _LANE_NAMES.items()},
+                "admission": {
+                    "chats_waiting": len(self._active),
+                    "largest_chat_queue": max((len(chat.items) for chat in self._chats.values()), default=0),
+                    "deferred": sum(chat.deferred for chat in self._chats.values()) + self._deferred_pruned,
+                    "rejected": self._rejected,
+                },
+            }
+
+    def current_work(self) -> Dict[str, str]:
+        """O que cada thread ocupada está consultando (usado pelo dump de threads em /debug)."""
+        with self._cond:
+            return dict(self._current)
+
+    def _admit(self, key: Hashable, now: float) -> _ChatQueue:
+        """Aplica os limites de fila a um novo item interativo (chamado com o lock) e devolve a fila do chat."""
+        chat = self._chats.get(key)
+        if key is not None:
+            if self.chat_max_queued > 0 and chat is not None and len(chat.items) >= self.chat_max_queued:
+                self._rejected += 1
+                raise Rejected("Você já tem muitas consultas na fila. Aguarde as atuais terminarem e tente de novo.")
+            if self.queue_max > 0 and self._stats[INTERACTIVE].queued >= self.queue_max:
+                self._rejected += 1
+                raise Rejected("O bot está com muitas consultas na fila agora. Tente de novo em alguns minutos.")
+        if chat is None:
+            if len(self._chats) >= _PRUNE_THRESHOLD:
+                self._prune(now)
+            chat = self._chats[key] = _ChatQueue(self.chat_burst, now)
+        if key is not None and self.chat_rate > 0:
+            chat.refill(self.chat_rate, self.chat_burst, now)
+            if chat.tokens < len(chat.items) + 1:
+                chat.deferred += 1
+        return chat
+
+    def _position(self, key: Hashable, chat: _ChatQueue) -> int:
+        """
+        Posição aproximada do último item do chat na fila interativa (chamado com o lock).
+        No rodízio, cada outro chat passa na frente com no máximo tantos itens quanto este chat tem na fila.
+        """
+        own = len(chat.items)
+        ahead = own - 1 + sum(min(len(other.items), own) for k, other in self._chats.items() if k != key)
+        running = self._stats[INTERACTIVE].running
+        free = max((self.interactive_max if self._background else self.workers) - running, 0)
+        blocked = key is not None and (
+            (self.chat_concurrency > 0 and chat.running + own > self.chat_concurrency)
+            or (self.chat_rate > 0 and chat.tokens < own)
+        )
+        if ahead < free and not blocked:
+            return 0
+        return max(ahead - free, 0) + 1
+
+    def _prune(self, now: float) -> None:
+        """Esquece chats ociosos cuja cota de taxa já se recompôs (chamado com o lock)."""
+        for key, chat in list(self._chats.items()):
+            if chat.items or chat.running:
+                continue
+            chat.refill(self.chat_rate, self.chat_burst, now)
+            if self.chat_rate <= 0 or chat.tokens >= self.chat_burst:
+                self._deferred_pruned += chat.deferred
+                del self._chats[key]
+
+    def _next_item(self, now: float) -> Tuple[Optional[tuple], Optional[float]]:
+        """
+        Retira o próximo item executável (chamado com o lock): primeiro os chats, em rodízio, depois
+        o fundo. Sem item, devolve também quantos segundos faltam para a cota de taxa de algum chat
+        liberar (None = só uma notificação muda o quadro).
+        """
+        retry: Optional[float] = None
+        interactive_cap = self.interactive_max if self._background else self.workers
+        if self._active and self._stats[INTERACTIVE].running < interactive_cap:
+            for key in list(self._active):
+                chat = self._chats[key]
+                if key is not None:
+                    if self.chat_concurrency > 0 and chat.running >= self.chat_concurrency:
+                        continue
+                    if self.chat_rate > 0:
+                        chat.refill(self.chat_rate, self.chat_burst, now)
+                        if chat.tokens < 1:
+                            wait = (1 - chat.tokens) * 60.0 / self.chat_rate
+                            retry = wait if retry is None else min(retry, wait)
+                            continue
+                        chat.tokens -= 1
+                # O chat atendido vai para o fim do rodízio.
+                self._active.remove(key)
+                item = chat.items.popleft()
+                if chat.items:
+                    self._active.append(key)
+                return item, None
+        if self._background and self._stats[BACKGROUND].running < self.background_max:
+            return self._background.popleft(), None
+        return None, retry
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                item, retry = self._next_item(time.monotonic())
+                while item is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait(retry)
+                    item, retry = self._next_item(time.monotonic())
+                priority, key, enqueued_at, future, fn, args, kwargs = item
+                stats = self._stats[priority]
+                stats.queued -= 1
+                chat = self._chats.get(key) if priority == INTERACTIVE else None
+                if not future.set_running_or_notify_cancel():
+                    if chat is not None and key is not None and self.chat_rate > 0:
+                        chat.tokens += 1  # devolve a cota de quem desistiu antes de rodar
+                    continue
+                wait = time.monotonic() - enqueued_at
+                stats.running += 1
+                stats.wait_last = wait
+                stats.wait_max = max(stats.wait_max, wait)
+                if chat is not None:
+                    chat.running += 1
+                name = threading.current_thread().name
+                label = getattr(fn, "__name__", repr(fn))
+                self._current[name] = f"{label}({args[0]!r})" if args else label
+
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._cond:
+                    self._current.pop(name, None)
+                    stats.running -= 1
+                    stats.completed += 1
+                    stats.wait_total += wait
+                    if chat is not None:
+                        chat.running -= 1
+                    # Uma vaga de fundo, ou a vaga de concorrência de um chat, pode ter sido liberada.
+                    self._cond.notify_all()
+
+
+_executor: Optional[ScraperExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ScraperExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ScraperExecutor()
+        return _executor
+
+
+def submit(fn: Callable, *args, priority: int = INTERACTIVE, key: Hashable = None, **kwargs) -> Future:
+    """Enfileira `fn` no executor compartilhado; o Future traz `queue_position` (ver ScraperExecutor.submit)."""
+    return get_executor().submit(fn, *args, priority=priority, key=key, **kwargs)
+
+
+async def run(fn: Callable, *args, priority: int = INTERACTIVE, key: Hashable = None, **kwargs) -> Any:
+    """Roda `fn` no executor de scraping compartilhado."""
+    return await get_executor().run(fn, *args, priority=priority, key=key, **kwargs)
@@ -1,33 +1,43 @@
 # simlam_doc_scraper.py
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
-import fitz  # PyMuPDF
 import os
 import re
-import json
+import io
 import sys
+import tempfile
+import threading
 from urllib.parse import urljoin
 import time
 import logging
 import random
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
-from rich.json import JSON
 import unicodedata
 from datetime import datetime
 import html
+import hashlib
+from typing import TYPE_CHECKING
 
-console = Console()
+import egress
 
-# Configura o logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+if TYPE_CHECKING:
+    import requests
+
+# Dependências pesadas (requests/urllib3, BeautifulSoup, PyMuPDF, Rich) são importadas sob demanda,
+# dentro das funções que as usam. Assim o import deste módulo pelo bot fica barato e o cold start
+# (healthcheck + polling do Telegram) não espera por elas.
+
+_console = None
+
+
+def _get_console():
+    """Console do Rich, criado só quando a saída de terminal (CLI) é usada."""
+    global _console
+    if _console is None:
+        from rich.console import Console
+
+        _console = Console()
+    return _console
+
+# O logging é configurado por quem usa o módulo (bot.py, ou main() na linha de comando): ver log_setup.py.
 logger = logging.getLogger(__name__)
 
 def _dump_debug(filename_prefix: str, content: str) -> None:
@@ -46,14 +56,229 @@ def _dump_debug(filename_prefix: str, content: str) -> None:
     try:
         with open(path, "w", encoding="utf-8", errors="replace") as f:
             f.write(content or "")
-        logger.warning(f"Dump de depuração salvo em: {path}")
+        logger.warning("Dump de depuração salvo em: %s", path)
     except Exception as e:
-        logger.warning(f"Falha ao salvar dump de depuração em {path}: {e}")
+        logger.warning("Falha ao salvar dump de depuração em %s: %s", path, e)
+
+# Orçamento único de uma consulta: prazo total e número de tentativas, compartilhados por todas as
+# camadas (sessão HTTP, loop de buscar_processo e chamadores do bot). Antes eram três níveis de retry
+# empilhados (urllib3 x buscar_processo x check_single_process), e uma consulta ruim podia prender
+# um worker por mais de meia hora.
+LOOKUP_TIMEOUT = float(os.getenv("SIMLAM_LOOKUP_TIMEOUT", "300"))
+RETRY_BUDGET = int(os.getenv("SIMLAM_RETRY_BUDGET", "3"))
+
+# Endereço do SIMLAM. Só muda em testes de carga (benchmarks/loadtest.py aponta para um SIMLAM falso).
+BASE_URL = os.getenv("SIMLAM_BASE_URL", "https://monitoramento.semas.pa.gov.br/simlam/").rstrip("/") + "/"
+# Pausa "humana" entre as etapas da consulta, em segundos ("mínimo,máximo").
+PAUSE_MIN, PAUSE_MAX = (float(v) for v in os.getenv("SIMLAM_PAUSE_RANGE", "2,5").split(","))
+# Varredura da grade de resultados (harvest_grid): máximo de páginas lidas por busca.
+HARVEST_MAX_PAGES = int(os.getenv("SIMLAM_HARVEST_MAX_PAGES", "50"))
+
 
-def _build_session() -> requests.Session:
+class LookupDeadlineExceeded(Exception):
+    """O prazo total da consulta se esgotou antes de uma etapa começar."""
+
+
+class LookupBudget:
     """
-    Cria uma sessão Requests com headers "de navegador" e política de retry/backoff.
+    Prazo (deadline) e orçamento de tentativas de uma consulta ao SIMLAM.
+
+    Cada requisição usa como timeout o menor entre o timeout configurado e o tempo restante,
+    e toda pausa entre etapas/tentativas é limitada pelo prazo. Assim, a consulta inteira
+    termina (com sucesso ou erro) em no máximo `timeout` segundos.
+    """
+
+    def __init__(self, timeout: float = None, attempts: int = None):
+        self.timeout = LOOKUP_TIMEOUT if timeout is None else timeout
+        self.max_attempts = RETRY_BUDGET if attempts is None else attempts
+        self.attempts_used = 0
+        self.deadline = time.monotonic() + self.timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def take_attempt(self) -> bool:
+        """Consome uma tentativa do orçamento. Retorna False se não há tentativas ou tempo restantes."""
+        if self.attempts_used >= self.max_attempts or self.expired():
+            return False
+        self.attempts_used += 1
+        return True
+
+    def request_timeout(self, connect_timeout: float, read_timeout: float) -> tuple:
+        """Timeout (conexão, leitura) para a próxima requisição, limitado pelo tempo restante."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise LookupDeadlineExceeded()
+        return (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(min(seconds, self.remaining()))
+
+    def exhausted(self) -> bool:
+        """Sem tentativas ou tempo restantes: a falha atual é a definitiva."""
+        return self.attempts_used >= self.max_attempts or self.expired()
+
+    def backoff(self, seconds: float) -> None:
+        """Pausa antes de uma nova tentativa; não espera à toa se o orçamento já acabou."""
+        if self.attempts_used < self.max_attempts:
+            self.sleep(seconds)
+
+
+# Download do PDF: fica em memória até SIMLAM_PDF_SPOOL_BYTES e, acima disso, vai para um arquivo
+# temporário (o PyMuPDF lê direto do disco). Respostas maiores que SIMLAM_PDF_MAX_BYTES são abortadas.
+PDF_SPOOL_BYTES = int(os.getenv("SIMLAM_PDF_SPOOL_BYTES", str(4 * 1024 * 1024)))
+PDF_MAX_BYTES = int(os.getenv("SIMLAM_PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+_PDF_CHUNK_BYTES = 64 * 1024
+
+_pdf_stats_lock = threading.Lock()
+_pdf_stats = {
+    "downloads": 0,
+    "spilled_to_disk": 0,
+    "aborted_too_large": 0,
+    "largest_bytes": 0,
+    "in_memory_bytes": 0,  # soma dos PDFs em memória agora (consultas em andamento)
+    "in_memory_peak_bytes": 0,
+    "on_disk_bytes": 0,
+}
+
+
+def pdf_stats() -> dict:
+    """Métricas do download de PDFs (memória em uso pelas consultas em andamento, spill, abortos)."""
+    with _pdf_stats_lock:
+        return {**_pdf_stats, "spool_bytes": PDF_SPOOL_BYTES, "max_bytes": PDF_MAX_BYTES}
+
+
+def _pdf_stats_add(**deltas) -> None:
+    with _pdf_stats_lock:
+        for key, delta in deltas.items():
+            _pdf_stats[key] += delta
+        _pdf_stats["in_memory_peak_bytes"] = max(_pdf_stats["in_memory_peak_bytes"], _pdf_stats["in_memory_bytes"])
+
+
+class PdfTooLargeError(Exception):
+    """O PDF passou de SIMLAM_PDF_MAX_BYTES (resposta anômala): o download é abortado."""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"PDF com {size} bytes excede o limite de {limit} bytes.")
+        self.size = size
+
+
+class _PdfBuffer:
+    """Acumula o PDF em memória até `spool_bytes`; acima disso, passa para um arquivo temporário."""
+
+    def __init__(self, spool_bytes: int = None):
+        self.spool_bytes = PDF_SPOOL_BYTES if spool_bytes is None else spool_bytes
+        self.size = 0
+        self._memory = io.BytesIO()
+        self._file = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes) -> None:
+        if self._file is None and self.size + len(chunk) > self.spool_bytes:
+            self._file = tempfile.NamedTemporaryFile(prefix="simlam-", suffix=".pdf")
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+            _pdf_stats_add(in_memory_bytes=-self.size, on_disk_bytes=self.size, spilled_to_disk=1)
+        if self._file is not None:
+            self._file.write(chunk)
+            _pdf_stats_add(on_disk_bytes=len(chunk))
+        else:
+            self._memory.write(chunk)
+            _pdf_stats_add(in_memory_bytes=len(chunk))
+        self.size += len(chunk)
+
+    def open_document(self, fitz):
+        """Abre no PyMuPDF sem copiar: pelo caminho do arquivo, ou por uma view do buffer em memória."""
+        if self._file is not None:
+            self._file.flush()
+            return fitz.open(self._file.name, filetype="pdf")
+        return fitz.open(stream=self._memory.getbuffer(), filetype="pdf")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()  # apaga o arquivo temporário
+            self._file = None
+            _pdf_stats_add(on_disk_bytes=-self.size)
+        elif self._memory is not None:
+            self._memory = None
+            _pdf_stats_add(in_memory_bytes=-self.size)
+
+
+def _download_pdf(session, url: str, timeout: tuple, budget: "LookupBudget", max_bytes: int = None) -> _PdfBuffer:
     """
+    Baixa o PDF em streaming, em blocos, para um _PdfBuffer. Aborta se o tamanho (declarado ou
+    recebido) passar de `max_bytes` ou se o prazo da consulta acabar no meio do download.
+    """
+    max_bytes = PDF_MAX_BYTES if max_bytes is None else max_bytes
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        declared = response.headers.get("Content-Length", "")
+        if declared.isdigit() and int(declared) > max_bytes:
+            raise PdfTooLargeError(int(declared), max_bytes)
+        buffer = _PdfBuffer()
+        try:
+            for chunk in response.iter_content(chunk_size=_PDF_CHUNK_BYTES):
+                if buffer.size + len(chunk) > max_bytes:
+                    raise PdfTooLargeError(buffer.size + len(chunk), max_bytes)
+                if budget.expired():
+                    raise LookupDeadlineExceeded()
+                buffer.write(chunk)
+        except BaseException:
+            buffer.close()
+            raise
+    with _pdf_stats_lock:
+        _pdf_stats["downloads"] += 1
+        _pdf_stats["largest_bytes"] = max(_pdf_stats["largest_bytes"], buffer.size)
+    return buffer
+
+
+def _read_pdf_data(buffer: _PdfBuffer, fitz, known_fingerprint: str = None) -> dict:
+    """
+    Extrai o texto e os dados do PDF e libera o documento e o buffer (memória ou arquivo) logo em seguida.
+
+    Com `known_fingerprint` (a última tramitação já conhecida, ver tramitacao_fingerprint), lê a
+    primeira página (cabeçalho) e depois as páginas do fim para o começo, só até a data da tramitação
+    conhecida aparecer: o histórico antigo de processos longos não é extraído nem analisado. Se ela
+    não for encontrada, o resultado é o do PDF inteiro.
+    """
+    try:
+        doc = buffer.open_document(fitz)
+        try:
+            parts = known_fingerprint.split("|") if known_fingerprint else []
+            marker = parts[1] if len(parts) == 3 else None
+            if not marker or doc.page_count <= 2:
+                return extract_pdf_data("".join(page.get_text() for page in doc), known_fingerprint)
+            head = doc[0].get_text()
+            tail = ""
+            for number in range(doc.page_count - 1, 0, -1):
+                tail = doc[number].get_text() + tail
+                if marker in tail:
+                    data = extract_pdf_data(head + tail, known_fingerprint)
+                    if data.get("tramitacao_conhecida"):
+                        return data
+            return extract_pdf_data(head + tail, known_fingerprint)
+        finally:
+            doc.close()
+    finally:
+        buffer.close()
+
+
+def _build_session(route: "egress.RouteLease" = None) -> "requests.Session":
+    """
+    Cria uma sessão Requests com headers "de navegador", presa à rota de saída `route` (se houver).
+
+    Não há retry no nível do urllib3: as novas tentativas são feitas só pelo loop de
+    buscar_processo, dentro do LookupBudget (prazo + número de tentativas).
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
     session = requests.Session()
 
     # Define um conjunto de cabeçalhos para simular um navegador real
@@ -70,22 +295,31 @@ def _build_session() -> requests.Session:
         }
     )
 
-    retry = Retry(
-        total=3,
-        connect=3,
-        read=2,
-        status=3,
-        backoff_factor=0.8,
-        status_forcelist=(429, 500, 502, 503, 504),
-        allowed_methods=frozenset({"GET", "POST"}),
-        raise_on_status=False,
-        respect_retry_after_header=True,
-    )
-    adapter = HTTPAdapter(max_retries=retry, pool_connections=10, pool_maxsize=10)
+    adapter = HTTPAdapter(max_retries=0, pool_connections=10, pool_maxsize=10)
     session.mount("https://", adapter)
     session.mount("http://", adapter)
+    if route is not None:
+        route.configure(session)
     return session
 
+
+def _retry_after_seconds(response) -> float:
+    """Lê o cabeçalho Retry-After (em segundos) de uma resposta 429/503, se houver."""
+    if response is None or response.status_code not in (429, 503):
+        return 0.0
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _RetryableLookupError(Exception):
+    """Falha transitória do SIMLAM (ex.: erro interno ao gerar o PDF) que vale uma nova tentativa."""
+
+    def __init__(self, details: str):
+        super().__init__(details)
+        self.details = details
+
 def normalize_text(text):
     """Remove acentos e caracteres especiais de um texto."""
     if not text:
@@ -119,6 +353,39 @@ def parse_ajax_response(text):
             continue
     return panels
 
+def parse_ajax_delta(text):
+    """
+    Lê a resposta AJAX do ASP.NET campo a campo ("tamanho|tipo|id|conteúdo|"), usando o tamanho
+    declarado: um '|' dentro do HTML (comum em grades com muitas linhas) não desalinha a leitura,
+    como acontece em parse_ajax_response. Retorna a lista de (tipo, id, conteúdo), incluindo os
+    'hiddenField' (__VIEWSTATE etc.) necessários para o próximo postback.
+    """
+    entries = []
+    pos = 0
+    while pos < len(text):
+        try:
+            sep = text.index('|', pos)
+            length = int(text[pos:sep])
+            type_end = text.index('|', sep + 1)
+            id_end = text.index('|', type_end + 1)
+        except ValueError:
+            break  # Fim da resposta ou resposta truncada/malformada
+        start = id_end + 1
+        content = text[start:start + length]
+        if len(content) < length:
+            break
+        entries.append((text[sep + 1:type_end], text[type_end + 1:id_end], content))
+        pos = start + length + 1  # Pula o '|' que fecha o conteúdo
+    return entries
+
+def _hidden_fields(soup):
+    """Todos os campos ocultos de um formulário ASP.NET (__VIEWSTATE, __EVENTVALIDATION...)."""
+    return {
+        tag['name']: tag.get('value', '')
+        for tag in soup.find_all('input', type='hidden')
+        if tag.get('name')
+    }
+
 def clean_despacho(text):
     """Remove o rodapé padrão do texto do despacho."""
     if text:
@@ -129,21 +396,103 @@ def clean_despacho(text):
             return text[:marker_pos].strip()
     return text
 
-def extract_pdf_data(full_text):
+# Tipos de evento que abrem um bloco de tramitação no texto do PDF.
+TIPOS_EVENTO = ["Envio", "Envio cancelado", "Mover", "Arquivamento"]
+_TRAMITACAO_HEADER_RE = re.compile(r'\n(' + '|'.join(TIPOS_EVENTO) + r')\n', re.IGNORECASE)
+
+
+def _find_value(pattern, text):
+    match = re.search(pattern, text, re.IGNORECASE)
+    if match:
+        return next((g for g in match.groups() if g is not None), None)
+    return None
+
+
+def _event_timestamp(evento):
+    """Data/hora que identifica a tramitação (a de envio, se houver)."""
+    return evento.get('data_hora_envio') or \
+           evento.get('data_hora_recebimento') or \
+           evento.get('data_hora_cancelamento') or \
+           evento.get('data_hora_arquivamento')
+
+
+def tramitacao_fingerprint(evento):
+    """
+    Identifica uma tramitação entre verificações: "tipo|data/hora|setor". Usa só campos que não mudam
+    depois que o evento é criado (um envio ganha recebimento e despacho mais tarde). None sem data.
+    """
+    timestamp = _event_timestamp(evento)
+    if not timestamp:
+        return None
+    setor = evento.get('setor_origem') or evento.get('setor') or ''
+    return f"{evento['tipo']}|{timestamp}|{setor}"
+
+
+def _parse_tramitacao(tipo_evento_original, bloco):
+    """Extrai os campos de um bloco de tramitação. None se o tipo não for conhecido ou não houver campos."""
+    tipo_evento = next((t for t in TIPOS_EVENTO if t.lower() == tipo_evento_original.lower()), None)
+    if not tipo_evento:
+        return None
+
+    evento = {"tipo": tipo_evento}
+
+    if tipo_evento == "Envio":
+        evento['data_hora_envio'] = _find_value(r'Data/Hora de envio:\s*(.+)', bloco)
+        evento['setor_origem'] = _find_value(r'Setor de origem:\s*(.+)', bloco)
+
+        recebimento_match = re.search(r'Recebimento([\s\S]+)', bloco, re.IGNORECASE)
+        if recebimento_match:
+            recebimento_text = recebimento_match.group(1)
+            evento['setor_destino'] = _find_value(r'Setor de destino:\s*(.+)', recebimento_text)
+            evento['data_hora_recebimento'] = _find_value(r'Data/Hora do recebimento:\s*(.+)', recebimento_text)
+            despacho_match = re.search(r'Despacho:\s*([\s\S]+?)(?=$|\n\s*\n)', recebimento_text, re.IGNORECASE)
+            raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
+            evento['despacho'] = clean_despacho(raw_despacho)
+        else:
+            despacho_match = re.search(r'Despacho:\s*([\s\S]+?)(?=\nDocumento\(s\) Juntado\(s\))', bloco, re.IGNORECASE)
+            raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
+            evento['despacho'] = clean_despacho(raw_despacho)
+            evento['setor_destino'] = _find_value(r'Setor de destino:\s*(.+)', bloco)
+
+    elif tipo_evento == "Envio cancelado":
+        evento['data_hora_cancelamento'] = _find_value(r'Data/Hora de cancelamento:\s*(.+)', bloco)
+        evento['motivo'] = _find_value(r'Cancelado por:\s*(.+)', bloco)
+        despacho_match = re.search(r'Despacho:\s*([\s\S]+)', bloco, re.IGNORECASE)
+        raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
+        evento['despacho'] = clean_despacho(raw_despacho)
+
+    elif tipo_evento == "Mover":
+        evento['setor_origem'] = _find_value(r'Setor de origem:\s*(.+)', bloco)
+        evento['setor_destino'] = _find_value(r'Setor de destino:\s*(.+)', bloco)
+        evento['data_hora_recebimento'] = _find_value(r'Data/Hora do recebimento:\s*(.+)', bloco)
+        despacho_match = re.search(r'Despacho:\s*([\s\S]+)', bloco, re.IGNORECASE)
+        raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
+        evento['despacho'] = clean_despacho(raw_despacho)
+
+    elif tipo_evento == "Arquivamento":
+        evento['data_hora_arquivamento'] = _find_value(r'Data/Hora do arquivamento:\s*(.+)', bloco)
+        evento['setor'] = _find_value(r'Setor:\s*(.+)', bloco)
+        despacho_match = re.search(r'Observa(?:ç|c)ão:\s*([\s\S]+)', bloco, re.IGNORECASE)
+        evento['observacao'] = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
+
+    evento_final = {k: v for k, v in evento.items() if v is not None}
+    return evento_final if len(evento_final) > 1 else None
+
+
+def extract_pdf_data(full_text, known_fingerprint=None):
     """
     Extrai as informações de um texto de PDF e retorna um dicionário.
     Lida com múltiplos tipos de tramitação e ausência de campos.
+
+    As tramitações são analisadas do fim para o começo. Com `known_fingerprint`, a análise para na
+    tramitação já conhecida: 'tramitacoes' começa nela (as seguintes são as novas) e
+    'tramitacao_conhecida' fica True. Sem ela, 'tramitacoes' traz o histórico inteiro.
     """
     data = {}
     
     # Limpa o texto antes de processar
     clean_text = normalize_text(full_text)
-
-    def find_value(pattern, text):
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return next((g for g in match.groups() if g is not None), None)
-        return None
+    find_value = _find_value
 
     # Campos principais (busca no texto limpo)
     data['numero_documento'] = find_value(r'Numero do processo:\s*([\d/]+)', clean_text)
@@ -155,66 +504,22 @@ def extract_pdf_data(full_text):
 
     # Limpa e mantém apenas chaves com valor
     data = {k: v.strip() for k, v in data.items() if v is not None}
-    data['tramitacoes'] = []
 
-    tipos_evento_conhecidos = ["Envio", "Envio cancelado", "Mover", "Arquivamento"]
-    tramitacao_headers_regex = r'\n(' + '|'.join(tipos_evento_conhecidos) + r')\n'
-    
-    # Usa o texto original para extrair os detalhes que podem ter caracteres especiais
-    blocks = re.split(tramitacao_headers_regex, full_text, flags=re.IGNORECASE)
-    content_blocks = blocks[1:]  # pula cabeçalho
-
-    for i in range(0, len(content_blocks), 2):
-        tipo_evento_original = content_blocks[i].strip()
-        tipo_evento = next((t for t in tipos_evento_conhecidos if t.lower() == tipo_evento_original.lower()), None)
-        if not tipo_evento:
+    # Usa o texto original para extrair os detalhes que podem ter caracteres especiais.
+    # Cada bloco vai do cabeçalho do evento até o cabeçalho seguinte (o que vem antes do primeiro é o cabeçalho do PDF).
+    headers = list(_TRAMITACAO_HEADER_RE.finditer(full_text))
+    tramitacoes = []
+    for i in range(len(headers) - 1, -1, -1):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(full_text)
+        evento = _parse_tramitacao(headers[i].group(1).strip(), full_text[headers[i].end():end])
+        if evento is None:
             continue
-
-        bloco = content_blocks[i+1]
-        evento = {"tipo": tipo_evento}
-
-        if tipo_evento == "Envio":
-            evento['data_hora_envio'] = find_value(r'Data/Hora de envio:\s*(.+)', bloco)
-            evento['setor_origem'] = find_value(r'Setor de origem:\s*(.+)', bloco)
-
-            recebimento_match = re.search(r'Recebimento([\s\S]+)', bloco, re.IGNORECASE)
-            if recebimento_match:
-                recebimento_text = recebimento_match.group(1)
-                evento['setor_destino'] = find_value(r'Setor de destino:\s*(.+)', recebimento_text)
-                evento['data_hora_recebimento'] = find_value(r'Data/Hora do recebimento:\s*(.+)', recebimento_text)
-                despacho_match = re.search(r'Despacho:\s*([\s\S]+?)(?=$|\n\s*\n)', recebimento_text, re.IGNORECASE)
-                raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
-                evento['despacho'] = clean_despacho(raw_despacho)
-            else:
-                despacho_match = re.search(r'Despacho:\s*([\s\S]+?)(?=\nDocumento\(s\) Juntado\(s\))', bloco, re.IGNORECASE)
-                raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
-                evento['despacho'] = clean_despacho(raw_despacho)
-                evento['setor_destino'] = find_value(r'Setor de destino:\s*(.+)', bloco)
-
-        elif tipo_evento == "Envio cancelado":
-            evento['data_hora_cancelamento'] = find_value(r'Data/Hora de cancelamento:\s*(.+)', bloco)
-            evento['motivo'] = find_value(r'Cancelado por:\s*(.+)', bloco)
-            despacho_match = re.search(r'Despacho:\s*([\s\S]+)', bloco, re.IGNORECASE)
-            raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
-            evento['despacho'] = clean_despacho(raw_despacho)
-
-        elif tipo_evento == "Mover":
-            evento['setor_origem'] = find_value(r'Setor de origem:\s*(.+)', bloco)
-            evento['setor_destino'] = find_value(r'Setor de destino:\s*(.+)', bloco)
-            evento['data_hora_recebimento'] = find_value(r'Data/Hora do recebimento:\s*(.+)', bloco)
-            despacho_match = re.search(r'Despacho:\s*([\s\S]+)', bloco, re.IGNORECASE)
-            raw_despacho = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
-            evento['despacho'] = clean_despacho(raw_despacho)
-
-        elif tipo_evento == "Arquivamento":
-            evento['data_hora_arquivamento'] = find_value(r'Data/Hora do arquivamento:\s*(.+)', bloco)
-            evento['setor'] = find_value(r'Setor:\s*(.+)', bloco)
-            despacho_match = re.search(r'Observa(?:ç|c)ão:\s*([\s\S]+)', bloco, re.IGNORECASE)
-            evento['observacao'] = despacho_match.group(1).replace('\n', ' ').strip() if despacho_match else None
-
-        evento_final = {k: v for k, v in evento.items() if v is not None}
-        if len(evento_final) > 1:
-            data['tramitacoes'].append(evento_final)
+        tramitacoes.append(evento)
+        if known_fingerprint and tramitacao_fingerprint(evento) == known_fingerprint:
+            data['tramitacao_conhecida'] = True
+            break
+    tramitacoes.reverse()
+    data['tramitacoes'] = tramitacoes
 
     return data
 
@@ -223,6 +528,8 @@ def print_summary_table(data):
     """
     Imprime um resumo curto em tabela (se houver dados relevantes).
     """
+    from rich.table import Table
+
     table = Table(title="Resumo do Documento / Processo", show_lines=False)
     table.add_column("Campo", style="cyan", no_wrap=True)
     table.add_column("Valor", style="white")
@@ -234,14 +541,36 @@ def print_summary_table(data):
             any_value = True
             table.add_row(k, str(data.get(k, "-")))
     if any_value:
-        console.print(table)
+        _get_console().print(table)
 
 
-def buscar_processo(search_term, search_type="processo"):
-    max_retries = 3
-    for attempt in range(1, max_retries + 1):
-        logger.info(f"Iniciando busca por {search_type}: '{search_term}' (Tentativa {attempt}/{max_retries})")
-        base_url = "https://monitoramento.semas.pa.gov.br/simlam/"
+def buscar_processo(search_term, search_type="processo", budget: LookupBudget = None, known_fingerprint: str = None,
+                    entity_id: str = None):
+    """
+    Consulta um processo/documento no SIMLAM e retorna {'timestamp', 'details'} (e, com sucesso,
+    'fingerprint', 'novas_tramitacoes' e 'entity_id').
+
+    `budget` define o prazo total e o número de tentativas; se omitido, usa SIMLAM_LOOKUP_TIMEOUT
+    e SIMLAM_RETRY_BUDGET. O chamador pode compartilhar o mesmo budget entre chamadas.
+    `known_fingerprint` é a última tramitação já conhecida: o PDF é lido só até ela, e 'details'
+    lista todas as tramitações posteriores. `entity_id` é o id interno já conhecido do processo: a
+    primeira tentativa pula a busca e vai direto aos detalhes.
+    """
+    import requests
+    from bs4 import BeautifulSoup
+    import fitz  # PyMuPDF
+
+    budget = budget or LookupBudget()
+    max_retries = budget.max_attempts
+    last_failure = None
+    started = time.monotonic()
+    while budget.take_attempt():
+        attempt = budget.attempts_used
+        # Campos estruturados dos logs desta tentativa (viram chaves no LOG_FORMAT=json).
+        # Formatação com % e argumentos: só acontece se o registro for emitido, fora desta thread.
+        log_ctx = {"processo": search_term, "tentativa": attempt, "etapa": "busca"}
+        logger.info("Iniciando busca por %s: '%s' (Tentativa %d/%d)", search_type, search_term, attempt, max_retries, extra=log_ctx)
+        base_url = BASE_URL
         if search_type == "documento":
             search_page = "ListarDocumentos.aspx"
             view_js_function = "abrirDocumento"
@@ -253,7 +582,7 @@ def buscar_processo(search_term, search_type="processo"):
 
         search_page_url = urljoin(base_url, search_page)
 
-        session = _build_session()
+        route = None
 
         # Timeout separado (conexão, leitura). Um ConnectTimeout de 10 minutos só “prende” o job.
         # Pode ser ajustado via variáveis de ambiente no deploy (Koyeb):
@@ -264,64 +593,77 @@ def buscar_processo(search_term, search_type="processo"):
         # Ajuste via SIMLAM_PDF_READ_TIMEOUT (ex.: 180 ou 240).
         pdf_read_timeout = float(os.getenv("SIMLAM_PDF_READ_TIMEOUT", str(max(read_timeout, 180))))
 
-        timeout_search = (connect_timeout, read_timeout)
-        timeout_pdf = (connect_timeout, pdf_read_timeout)
-
-        try:
-            response = session.get(search_page_url, timeout=timeout_search)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
+        def timeout_search():
+            return budget.request_timeout(connect_timeout, read_timeout)
 
-            try:
-                viewstate = soup.find('input', {'name': '__VIEWSTATE'}).get('value')
-                viewstategenerator = soup.find('input', {'name': '__VIEWSTATEGENERATOR'}).get('value')
-                eventvalidation = soup.find('input', {'name': '__EVENTVALIDATION'}).get('value')
-            except AttributeError:
-                logger.error("Falha ao extrair VIEWSTATE da página de busca.")
-                _dump_debug(f"search_page_no_viewstate_{search_type}_{search_term}", response.text)
-                return {'timestamp': None, 'details': "Erro: Não foi possível extrair os dados de estado da página de busca."}
+        def timeout_pdf():
+            return budget.request_timeout(connect_timeout, pdf_read_timeout)
 
-            form_data = {
-                'ctl00$scriptManagerMstPage': 'ctl00$baseBody$upBuscaSimples|ctl00$baseBody$btnPesquisa',
-                '__EVENTTARGET': 'ctl00$baseBody$btnPesquisa',
-                '__EVENTARGUMENT': '',
-                '__VIEWSTATE': viewstate,
-                '__VIEWSTATEGENERATOR': viewstategenerator,
-                '__EVENTVALIDATION': eventvalidation,
-                'ctl00$baseBody$txtBusca': search_term,
-                '__ASYNCPOST': 'true',
-            }
-            response = session.post(search_page_url, data=form_data, timeout=timeout_search)
-            response.raise_for_status()
-
-            ajax_panels = parse_ajax_response(response.text)
-            results_html = ajax_panels.get('ctl00_baseBody_upGrid')
-            if not results_html:
-                logger.warning(f"Painel de resultados 'ctl00_baseBody_upGrid' não encontrado na resposta AJAX para '{search_term}'.")
-                logger.debug(f"Resposta AJAX completa: {response.text}")
-                _dump_debug(f"search_ajax_no_grid_{search_type}_{search_term}", response.text)
-                return {'timestamp': None, 'details': f"Nenhum resultado encontrado para {search_type} '{search_term}'. A estrutura da página pode ter mudado."}
-
-            soup = BeautifulSoup(results_html, 'html.parser')
-            visualizar_tag = soup.find('a', title='Visualizar')
-            if not (visualizar_tag and visualizar_tag.has_attr('onclick')):
-                logger.warning(f"Link 'Visualizar' não encontrado no HTML de resultados para '{search_term}'.")
-                _dump_debug(f"search_results_no_visualizar_{search_type}_{search_term}", results_html)
-                return {'timestamp': None, 'details': f"Nenhum resultado acionável encontrado para {search_type} '{search_term}'."}
-
-            match = re.search(fr'{view_js_function}\((\d+)\)', visualizar_tag['onclick'])
-            if not match:
-                logger.error(f"Não foi possível extrair o ID do processo do atributo onclick: {visualizar_tag['onclick']}")
-                return {'timestamp': None, 'details': "Erro: Não foi possível extrair o ID do resultado."}
-
-            entity_id = match.group(1)
+        try:
+            # Uma rota por tentativa: a sessão (cookies, VIEWSTATE) não troca de IP no meio do fluxo.
+            route = egress.get_pool().acquire(budget.remaining())
+            session = _build_session(route)
+            # Id já conhecido (índice da grade ou consulta anterior): na primeira tentativa vai direto
+            # aos detalhes, sem a busca. Se algo não bater, as tentativas seguintes fazem a busca completa.
+            direct = bool(entity_id) and attempt == 1
+            if not direct:
+                response = session.get(search_page_url, timeout=timeout_search())
+                response.raise_for_status()
+
+                soup = BeautifulSoup(response.text, 'html.parser')
+
+                try:
+                    viewstate = soup.find('input', {'name': '__VIEWSTATE'}).get('value')
+                    viewstategenerator = soup.find('input', {'name': '__VIEWSTATEGENERATOR'}).get('value')
+                    eventvalidation = soup.find('input', {'name': '__EVENTVALIDATION'}).get('value')
+                except AttributeError:
+                    logger.error("Falha ao extrair VIEWSTATE da página de busca.", extra=log_ctx)
+                    _dump_debug(f"search_page_no_viewstate_{search_type}_{search_term}", response.text)
+                    return {'timestamp': None, 'details': "Erro: Não foi possível extrair os dados de estado da página de busca."}
+
+                form_data = {
+                    'ctl00$scriptManagerMstPage': 'ctl00$baseBody$upBuscaSimples|ctl00$baseBody$btnPesquisa',
+                    '__EVENTTARGET': 'ctl00$baseBody$btnPesquisa',
+                    '__EVENTARGUMENT': '',
+                    '__VIEWSTATE': viewstate,
+                    '__VIEWSTATEGENERATOR': viewstategenerator,
+                    '__EVENTVALIDATION': eventvalidation,
+                    'ctl00$baseBody$txtBusca': search_term,
+                    '__ASYNCPOST': 'true',
+                }
+                response = session.post(search_page_url, data=form_data, timeout=timeout_search())
+                response.raise_for_status()
+
+                ajax_panels = parse_ajax_response(response.text)
+                results_html = ajax_panels.get('ctl00_baseBody_upGrid')
+                if not results_html:
+                    logger.warning("Painel de resultados 'ctl00_baseBody_upGrid' não encontrado na resposta AJAX para '%s'.", search_term, extra=log_ctx)
+                    # A resposta pode ter centenas de KB: só os primeiros 2000 caracteres (o dump completo fica em SIMLAM_DUMP_DIR).
+                    logger.debug("Resposta AJAX (%d caracteres): %.2000s", len(response.text), response.text, extra=log_ctx)
+                    _dump_debug(f"search_ajax_no_grid_{search_type}_{search_term}", response.text)
+                    raise _RetryableLookupError(f"Nenhum resultado encontrado para {search_type} '{search_term}'. A estrutura da página pode ter mudado.")
+
+                soup = BeautifulSoup(results_html, 'html.parser')
+                visualizar_tag = soup.find('a', title='Visualizar')
+                if not (visualizar_tag and visualizar_tag.has_attr('onclick')):
+                    logger.warning("Link 'Visualizar' não encontrado no HTML de resultados para '%s'.", search_term, extra=log_ctx)
+                    _dump_debug(f"search_results_no_visualizar_{search_type}_{search_term}", results_html)
+                    return {'timestamp': None, 'details': f"Nenhum resultado acionável encontrado para {search_type} '{search_term}'."}
+
+                match = re.search(fr'{view_js_function}\((\d+)\)', visualizar_tag['onclick'])
+                if not match:
+                    logger.error("Não foi possível extrair o ID do processo do atributo onclick: %s", visualizar_tag['onclick'], extra=log_ctx)
+                    return {'timestamp': None, 'details': "Erro: Não foi possível extrair o ID do resultado."}
+
+                entity_id = match.group(1)
             details_url = urljoin(search_page_url, f"{view_page}?id={entity_id}")
 
             # Adiciona uma pausa e o cabeçalho Referer para simular navegação humana
-            time.sleep(random.uniform(2, 5))  # Pausa aleatória entre 2 e 5 segundos
+            log_ctx["etapa"] = "detalhes"
+            if not direct:
+                budget.sleep(random.uniform(PAUSE_MIN, PAUSE_MAX))  # Pausa aleatória (2 a 5 segundos por padrão)
             session.headers.update({'Referer': search_page_url})
-            response = session.get(details_url, timeout=timeout_pdf)
+            response = session.get(details_url, timeout=timeout_pdf())
             response.raise_for_status()
 
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -330,7 +672,7 @@ def buscar_processo(search_term, search_type="processo"):
                 viewstategenerator = soup.find('input', {'name': '__VIEWSTATEGENERATOR'}).get('value')
                 eventvalidation = soup.find('input', {'name': '__EVENTVALIDATION'}).get('value')
             except AttributeError:
-                logger.warning("Não foi possível extrair VIEWSTATE da página de detalhes. A geração de PDF pode falhar.")
+                logger.warning("Não foi possível extrair VIEWSTATE da página de detalhes. A geração de PDF pode falhar.", extra=log_ctx)
                 _dump_debug(f"details_page_no_viewstate_{search_type}_{search_term}", response.text)
                 viewstate, viewstategenerator, eventvalidation = '', '', ''
             
@@ -344,9 +686,10 @@ def buscar_processo(search_term, search_type="processo"):
                 '__ASYNCPOST': 'true',
             }
             # Adiciona uma pausa e atualiza o Referer para o pedido de geração de PDF
-            time.sleep(random.uniform(2, 5))  # Pausa aleatória entre 2 e 5 segundos
+            log_ctx["etapa"] = "gerar_pdf"
+            budget.sleep(random.uniform(PAUSE_MIN, PAUSE_MAX))  # Pausa aleatória (2 a 5 segundos por padrão)
             session.headers.update({'Referer': details_url})
-            pdf_page_response = session.post(details_url, data=pdf_form_data, timeout=timeout_pdf)
+            pdf_page_response = session.post(details_url, data=pdf_form_data, timeout=timeout_pdf())
             pdf_page_response.raise_for_status()
 
             pdf_url = None
@@ -367,13 +710,10 @@ def buscar_processo(search_term, search_type="processo"):
                 # Mantém só a primeira linha útil antes de stacktrace/HTML.
                 short_msg = re.split(r"<br\s*/?>|\n", raw_msg, maxsplit=1)[0].strip()
                 _dump_debug(f"simlam_server_error_{search_type}_{search_term}", search_space)
-                return {
-                    "timestamp": None,
-                    "details": (
-                        "O SIMLAM retornou um erro ao gerar o PDF (erro interno do servidor). "
-                        f"Detalhe: {short_msg or 'erro não especificado'}."
-                    ),
-                }
+                raise _RetryableLookupError(
+                    "O SIMLAM retornou um erro ao gerar o PDF (erro interno do servidor). "
+                    f"Detalhe: {short_msg or 'erro não especificado'}."
+                )
 
             # 1) Caso clássico: window.open('...') ou window.open("...")
             match_pdf = re.search(r"window\.open\(\s*['\"]([^'\"]+)['\"]", search_space)
@@ -386,7 +726,7 @@ def buscar_processo(search_term, search_type="processo"):
                 if match_any_pdf:
                     pdf_url = urljoin(details_url, match_any_pdf.group(1))
                 else:
-                    logger.warning("Não foi possível encontrar link de PDF na resposta (window.open/regex). Tentando encontrar um link <a>.")
+                    logger.warning("Não foi possível encontrar link de PDF na resposta (window.open/regex). Tentando encontrar um link <a>.", extra=log_ctx)
                     process_soup = BeautifulSoup(search_space, 'html.parser')
                     pdf_link_tag = process_soup.find('a', href=re.compile(r'\.pdf(\?|$)', re.IGNORECASE))
                     if not pdf_link_tag:
@@ -395,31 +735,39 @@ def buscar_processo(search_term, search_type="processo"):
                         pdf_url = urljoin(details_url, pdf_link_tag['href'])
 
             if not pdf_url:
-                logger.error("Não foi possível localizar o link do PDF na resposta do servidor.")
+                logger.error("Não foi possível localizar o link do PDF na resposta do servidor.", extra=log_ctx)
                 _dump_debug(
                     f"pdf_link_not_found_{search_type}_{search_term}",
                     search_space,
                 )
+                if direct:
+                    # O id do índice pode estar velho: a próxima tentativa refaz a busca.
+                    raise _RetryableLookupError("Erro: Não foi possível localizar o link do PDF.")
                 return {'timestamp': None, 'details': "Erro: Não foi possível localizar o link do PDF."}
 
-            pdf_response = session.get(pdf_url, timeout=timeout_pdf)
-            pdf_response.raise_for_status()
-            pdf_content = pdf_response.content
-
-            doc = fitz.open(stream=pdf_content, filetype="pdf")
-            full_text = "".join(page.get_text() for page in doc)
-            doc.close()
-
-            final_data = extract_pdf_data(full_text)
+            # Streaming com limite de tamanho; o PDF (em memória ou no disco) é liberado logo após a extração do texto.
+            log_ctx["etapa"] = "download_pdf"
+            pdf_buffer = _download_pdf(session, pdf_url, timeout_pdf(), budget)
+            if pdf_buffer.spilled:
+                logger.info("PDF de '%s' tem %d bytes: processado a partir do disco.", search_term, pdf_buffer.size, extra=log_ctx)
+            log_ctx["etapa"] = "texto_pdf"
+            final_data = _read_pdf_data(pdf_buffer, fitz, known_fingerprint)
+            del pdf_buffer
             
             # Validação do número do processo
             pdf_process_number = final_data.get('numero_documento')
             if pdf_process_number and (search_term.replace('/', '') == pdf_process_number.replace('/', '')):
-                logger.info(f"Validação bem-sucedida: o número do PDF ({pdf_process_number}) corresponde ao termo de busca.")
+                logger.info(
+                    "Validação bem-sucedida: o número do PDF (%s) corresponde ao termo de busca.",
+                    pdf_process_number,
+                    extra={**log_ctx, "duracao_ms": round((time.monotonic() - started) * 1000)},
+                )
                 
                 # Validação Mínima de conteúdo
                 if not final_data.get('empreendimento') and not final_data.get('tramitacoes'):
-                    logger.warning(f"PDF para '{search_term}' não continha 'empreendimento' ou 'tramitacoes'. Pode ser um PDF inválido ou de erro.")
+                    logger.warning("PDF para '%s' não continha 'empreendimento' ou 'tramitacoes'. Pode ser um PDF inválido ou de erro.", search_term, extra=log_ctx)
+                    if direct:
+                        raise _RetryableLookupError(f"Não foram encontrados detalhes suficientes para o processo '{search_term}'.")
                     return {
                         'timestamp': None,
                         'details': f"Não foram encontrados detalhes suficientes para o processo '{search_term}'. O processo pode não existir ou os dados estão indisponíveis no momento."
@@ -431,84 +779,279 @@ def buscar_processo(search_term, search_type="processo"):
                 output_lines.append(f"Empreendimento: {final_data.get('empreendimento', 'N/A')}")
                 
                 timestamp = None
-                if final_data.get("tramitacoes"):
-                    output_lines.append("\n*Última Tramitação:*")
-                    ultima_tramitacao = final_data["tramitacoes"][-1]
+                fingerprint = None
+                novas = None
+                tramitacoes = final_data.get("tramitacoes")
+                if tramitacoes:
+                    ultima_tramitacao = tramitacoes[-1]
                     
-                    # Extrai o timestamp da última tramitação
-                    timestamp = ultima_tramitacao.get('data_hora_envio') or \
-                                ultima_tramitacao.get('data_hora_recebimento') or \
-                                ultima_tramitacao.get('data_hora_cancelamento') or \
-                                ultima_tramitacao.get('data_hora_arquivamento')
-
-                    for key, value in ultima_tramitacao.items():
-                        output_lines.append(f"- {key.replace('_', ' ').title()}: {value}")
+                    # Extrai o timestamp e a identificação da última tramitação
+                    timestamp = _event_timestamp(ultima_tramitacao)
+                    fingerprint = tramitacao_fingerprint(ultima_tramitacao)
+                    if final_data.get("tramitacao_conhecida"):
+                        novas = tramitacoes[1:]
+
+                    # Várias tramitações desde a última verificação: lista todas, não só a última.
+                    eventos = novas if novas and len(novas) > 1 else [ultima_tramitacao]
+                    if len(eventos) > 1:
+                        output_lines.append(f"\n*Novas Tramitações ({len(eventos)}):*")
+                    else:
+                        output_lines.append("\n*Última Tramitação:*")
+                    for n, evento in enumerate(eventos):
+                        if n:
+                            output_lines.append("")
+                        for key, value in evento.items():
+                            output_lines.append(f"- {key.replace('_', ' ').title()}: {value}")
                 
                 return {
                     'timestamp': timestamp,
-                    'details': "\n".join(output_lines)
+                    'details': "\n".join(output_lines),
+                    'fingerprint': fingerprint,
+                    # Tramitações posteriores a `known_fingerprint`; None se ela não foi informada ou não está no PDF.
+                    'novas_tramitacoes': novas,
+                    # Id interno do SIMLAM: permite pular a busca na próxima consulta (tabela process_index).
+                    'entity_id': entity_id,
                 }
             else:
-                logger.warning(f"Divergência de processo! Buscado: '{search_term}', Encontrado no PDF: '{pdf_process_number or 'N/A'}'. Tentando novamente...")
-                time.sleep(3)  # Espera 3 segundos antes da próxima tentativa
+                logger.warning("Divergência de processo! Buscado: '%s', Encontrado no PDF: '%s'. Tentando novamente...", search_term, pdf_process_number or 'N/A', extra=log_ctx)
+                last_failure = {
+                    'timestamp': None,
+                    'details': f"Não foi possível confirmar o número do processo para '{search_term}' após {attempt} tentativas. O site pode estar retornando resultados incorretos."
+                }
+                budget.backoff(3)  # Espera 3 segundos antes da próxima tentativa
                 continue # Próxima iteração do loop
 
+        except LookupDeadlineExceeded:
+            break
+        except egress.NoRouteAvailable as e:
+            logger.error("Sem rota de saída para consultar '%s': %s", search_term, e, extra=log_ctx)
+            last_failure = {
+                "timestamp": None,
+                "details": "Todas as rotas de acesso ao SIMLAM estão ocupadas ou bloqueadas no momento. Tente novamente mais tarde.",
+            }
+            break
+        except PdfTooLargeError as e:
+            # Resposta anômala e determinística: repetir só baixaria o mesmo arquivo gigante de novo.
+            logger.error("Download do PDF de '%s' abortado: %s", search_term, e, extra=log_ctx)
+            with _pdf_stats_lock:
+                _pdf_stats["aborted_too_large"] += 1
+            return {'timestamp': None, 'details': f"Erro: o PDF do {search_type} '{search_term}' é grande demais para ser processado."}
+        except _RetryableLookupError as e:
+            logger.warning("Falha transitória do SIMLAM para '%s' (tentativa %d/%d): %s", search_term, attempt, max_retries, e.details, extra=log_ctx)
+            last_failure = {"timestamp": None, "details": e.details}
+            budget.backoff(5)
+            continue
+
+        # Nas falhas abaixo, o traceback só vai para o log na última tentativa: durante uma queda do
+        # SIMLAM, um traceback por tentativa só multiplica o volume de log sem dizer nada novo.
         except requests.exceptions.ConnectTimeout as e:
             logger.error(
-                f"Timeout de conexão ao acessar o SIMLAM durante a busca por '{search_term}': {e}",
-                exc_info=True,
+                "Timeout de conexão ao acessar o SIMLAM durante a busca por '%s': %s", search_term, e,
+                exc_info=budget.exhausted(), extra=log_ctx,
             )
-            if attempt < max_retries:
-                time.sleep(5) # Espera 5s se for erro de conexão
-                continue
-            return {
+            last_failure = {
                 "timestamp": None,
                 "details": (
                     "Não consegui abrir conexão com o SIMLAM a partir do servidor (timeout de conexão). "
                     "Isso costuma acontecer quando o provedor/rota do deploy está bloqueado ou sem rota até o site, "
-                    "mesmo que o site esteja acessível no seu navegador. Tente novamente mais tarde ou troque a região/host do deploy."
+                    "mesmo que o site esteja acessível no seu navegador. Tente novamente mais tarde, troque a região/host do deploy "
+                    "ou configure rotas de saída alternativas (SIMLAM_EGRESS_ROUTES)."
                 ),
             }
+            budget.backoff(5) # Espera 5s se for erro de conexão
+            continue
         except requests.exceptions.ReadTimeout as e:
             logger.error(
-                f"Timeout de leitura ao acessar o SIMLAM durante a busca por '{search_term}': {e}",
-                exc_info=True,
+                "Timeout de leitura ao acessar o SIMLAM durante a busca por '%s': %s", search_term, e,
+                exc_info=budget.exhausted(), extra=log_ctx,
             )
-            if attempt < max_retries:
-                time.sleep(5)
-                continue
-            return {
+            last_failure = {
                 "timestamp": None,
                 "details": (
                     "Consegui conectar no SIMLAM, mas a resposta demorou demais (timeout de leitura). "
                     "O site pode estar lento/limitando acessos. Tente novamente mais tarde."
                 ),
             }
+            budget.backoff(5)
+            continue
         except requests.exceptions.RequestException as e:
-            logger.error(f"Erro HTTP ao buscar '{search_term}': {e}", exc_info=True)
-            if attempt < max_retries:
-                time.sleep(5)
-                continue
-            return {"timestamp": None, "details": f"Erro de conexão/HTTP após {max_retries} tentativas: {e}"}
+            logger.error("Erro HTTP ao buscar '%s': %s", search_term, e, exc_info=budget.exhausted(), extra=log_ctx)
+            last_failure = {"timestamp": None, "details": f"Erro de conexão/HTTP após {attempt} tentativas: {e}"}
+            # 429/503 com Retry-After: respeita o pedido do servidor (sempre dentro do prazo da consulta).
+            budget.backoff(max(5, _retry_after_seconds(getattr(e, "response", None))))
+            continue
         except Exception as e:
-            logger.error(f"Erro inesperado ao processar '{search_term}': {e}", exc_info=True)
-            if attempt < max_retries:
-                time.sleep(3)
-                continue
-            return {'timestamp': None, 'details': f"Ocorreu um erro inesperado após {max_retries} tentativas ao processar '{search_term}': {e}"}
-
-    # Se o loop terminar sem sucesso
-    logger.error(f"Falha ao validar o processo '{search_term}' após {max_retries} tentativas.")
-    return {
+            # Erro de programação (parser etc.): o traceback é sempre útil.
+            logger.error("Erro inesperado ao processar '%s': %s", search_term, e, exc_info=True, extra=log_ctx)
+            last_failure = {'timestamp': None, 'details': f"Ocorreu um erro inesperado após {attempt} tentativas ao processar '{search_term}': {e}"}
+            budget.backoff(3)
+            continue
+        finally:
+            if route is not None:
+                route.release()
+
+    # Se o loop terminar sem sucesso (tentativas ou prazo esgotados)
+    if budget.expired():
+        logger.error(
+            "Prazo de %.0fs esgotado ao consultar '%s' (%d tentativa(s)).", budget.timeout, search_term, budget.attempts_used,
+            extra={"processo": search_term, "duracao_ms": round((time.monotonic() - started) * 1000)},
+        )
+        return {
+            'timestamp': None,
+            'details': (
+                f"A consulta ao SIMLAM excedeu o tempo limite ({budget.timeout:.0f}s). "
+                "O site pode estar lento/limitando acessos. Tente novamente mais tarde."
+            ),
+        }
+    logger.error(
+        "Falha ao consultar '%s' após %d tentativa(s).", search_term, budget.attempts_used,
+        extra={"processo": search_term, "duracao_ms": round((time.monotonic() - started) * 1000)},
+    )
+    return last_failure or {
         'timestamp': None,
-        'details': f"Não foi possível confirmar o número do processo para '{search_term}' após {max_retries} tentativas. O site pode estar retornando resultados incorretos."
+        'details': f"Não foi possível consultar '{search_term}' no SIMLAM no momento. Tente novamente mais tarde."
     }
 
 
+_GRID_NUMBER_RE = re.compile(r'^\d+(?:/\d+)+$')
+_PAGER_RE = re.compile(r"__doPostBack\(\s*['\"]([^'\"]+)['\"]\s*,\s*['\"](Page\$[^'\"]+)['\"]")
+
+
+def parse_grid(results_html, view_js_function="abrirProcesso"):
+    """
+    Lê a grade de resultados de uma busca: uma linha por processo, com o número, o id interno
+    (do link "Visualizar"), as colunas presentes (pelo texto do cabeçalho) e uma assinatura das
+    células, que muda quando qualquer coluna muda. Retorna (linhas, paginador), onde o paginador
+    mapeia o argumento do postback (ex.: 'Page$2', 'Page$Next') para o controle que o recebe.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(results_html, 'html.parser')
+    headers = [normalize_text(th.get_text(" ", strip=True)) for th in soup.find_all('th')]
+    rows = []
+    for link in soup.find_all('a', title='Visualizar'):
+        match = re.search(fr'{view_js_function}\((\d+)\)', link.get('onclick', ''))
+        tr = link.find_parent('tr')
+        if not match or tr is None:
+            continue
+        cells = [td.get_text(" ", strip=True) for td in tr.find_all('td', recursive=False)]
+        numero = next((cell for cell in cells if _GRID_NUMBER_RE.match(cell)), None)
+        if not numero:
+            continue
+        rows.append({
+            'numero': numero,
+            'entity_id': match.group(1),
+            'colunas': {header: cell for header, cell in zip(headers, cells) if header and cell},
+            'assinatura': hashlib.sha1("\x1f".join(cells).encode('utf-8')).hexdigest()[:16],
+        })
+    pager = {}
+    for link in soup.find_all('a', href=True):
+        match = _PAGER_RE.search(link['href'])
+        if match:
+            pager.setdefault(match.group(2), match.group(1))
+    return rows, pager
+
+
+def harvest_grid(search_term, max_pages: int = None, budget: LookupBudget = None):
+    """
+    Faz uma busca ampla (ex.: "/2024" ou um prefixo do número) e percorre as páginas da grade de
+    resultados por postback, sem abrir os detalhes nem baixar PDFs. Retorna
+    {'rows': [linhas de parse_grid], 'pages': páginas lidas, 'truncated': se parou antes do fim}.
+
+    Usa uma única rota de saída (o VIEWSTATE da paginação é preso à sessão) e a mesma pausa entre
+    páginas que buscar_processo usa entre etapas. Se uma página falhar depois da primeira, devolve o
+    que já leu, marcado como truncado; falhas na primeira página são propagadas.
+    """
+    import requests
+    from bs4 import BeautifulSoup
+
+    budget = budget or LookupBudget()
+    max_pages = max_pages or HARVEST_MAX_PAGES
+    connect_timeout = float(os.getenv("SIMLAM_CONNECT_TIMEOUT", "10"))
+    read_timeout = float(os.getenv("SIMLAM_READ_TIMEOUT", "90"))
+    search_page_url = urljoin(BASE_URL, "ListarProcessos.aspx")
+    log_ctx = {"processo": search_term, "etapa": "varredura"}
+    started = time.monotonic()
+
+    rows = {}
+    pages = 0
+    truncated = False
+    route = egress.get_pool().acquire(budget.remaining())
+    try:
+        session = _build_session(route)
+        response = session.get(search_page_url, timeout=budget.request_timeout(connect_timeout, read_timeout))
+        response.raise_for_status()
+        fields = _hidden_fields(BeautifulSoup(response.text, 'html.parser'))
+        target, argument = 'ctl00$baseBody$btnPesquisa', ''
+        panel = 'ctl00$baseBody$upBuscaSimples'
+        session.headers.update({'Referer': search_page_url})
+        while True:
+            form_data = {
+                **fields,
+                'ctl00$scriptManagerMstPage': f'{panel}|{target}',
+                '__EVENTTARGET': target,
+                '__EVENTARGUMENT': argument,
+                'ctl00$baseBody$txtBusca': search_term,
+                '__ASYNCPOST': 'true',
+            }
+            try:
+                response = session.post(
+                    search_page_url, data=form_data, timeout=budget.request_timeout(connect_timeout, read_timeout)
+                )
+                response.raise_for_status()
+            except (requests.exceptions.RequestException, LookupDeadlineExceeded) as e:
+                if not pages:
+                    raise
+                logger.warning("Varredura de '%s' interrompida na página %d: %s", search_term, pages + 1, e, extra=log_ctx)
+                truncated = True
+                break
+
+            grid_html = None
+            for part_type, part_id, content in parse_ajax_delta(response.text):
+                if part_type == 'hiddenField':
+                    fields[part_id] = content
+                elif part_type == 'updatePanel' and part_id == 'ctl00_baseBody_upGrid':
+                    grid_html = content
+            if grid_html is None:
+                _dump_debug(f"harvest_no_grid_{search_term}_p{pages + 1}", response.text)
+                if not pages:
+                    raise _RetryableLookupError(f"Painel de resultados não encontrado na busca por '{search_term}'.")
+                truncated = True
+                break
+
+            pages += 1
+            page_rows, pager = parse_grid(grid_html)
+            for row in page_rows:
+                rows.setdefault(row['numero'], row)
+
+            argument = f"Page${pages + 1}" if f"Page${pages + 1}" in pager else "Page$Next"
+            target = pager.get(argument)
+            if not target:
+                break
+            if pages >= max_pages or budget.expired():
+                truncated = True
+                break
+            panel = 'ctl00$baseBody$upGrid'
+            budget.sleep(random.uniform(PAUSE_MIN, PAUSE_MAX))
+    finally:
+        route.release()
+
+    logger.info(
+        "Varredura de '%s': %d processo(s) em %d página(s)%s.", search_term, len(rows), pages,
+        " (truncada)" if truncated else "",
+        extra={**log_ctx, "duracao_ms": round((time.monotonic() - started) * 1000)},
+    )
+    return {'rows': list(rows.values()), 'pages': pages, 'truncated': truncated}
+
 def main():
     """
     Usa: python simlam_doc_scraper.py [documento|processo] [numero]
     """
+    from rich.panel import Panel
+    import log_setup
+
+    log_setup.setup_logging()
+    console = _get_console()
     if len(sys.argv) != 3:
         console.print("[bold red]❌ Uso incorreto.[/bold red] Exemplo:", style="yellow")
         console.print("python simlam_doc_scraper.py [documento|processo] [numero]")
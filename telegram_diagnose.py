@@ -1,16 +1,37 @@
 import argparse
+import asyncio
 import json
+import math
 import os
+import socket
 import sys
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
 
 import requests
 
+# Mesmas variáveis do bot: Bot API (padrão: api.telegram.org) e SIMLAM.
+API_BASE = os.getenv("TELEGRAM_API_BASE_URL", "").rstrip("/") or "https://api.telegram.org"
+SIMLAM_BASE_URL = os.getenv("SIMLAM_BASE_URL", "https://monitoramento.semas.pa.gov.br/simlam/").rstrip("/") + "/"
 
-def tg_call(token: str, method: str, params: Optional[Dict[str, Any]] = None, timeout: int = 20) -> Dict[str, Any]:
-    url = f"https://api.telegram.org/bot{token}/{method}"
+# --bench: acima destes valores (ms), a etapa é apontada como lenta no resumo.
+SLOW_DNS_MS = 200
+SLOW_CONNECT_MS = 300
+SLOW_TELEGRAM_MS = 800
+SLOW_LONG_POLL_MS = 500
+SLOW_SIMLAM_MS = 3000
+# --bench --stub: chat de teste e fração de sendMessage que a Bot API falsa responde com 429.
+STUB_CHAT_ID = 1
+STUB_RETRY_AFTER_RATE = 0.05
+
+
+def tg_call(token: str, method: str, params: Optional[Dict[str, Any]] = None, timeout: int = 20,
+            session: Optional[requests.Session] = None, api_base: Optional[str] = None) -> Dict[str, Any]:
+    url = f"{api_base or API_BASE}/bot{token}/{method}"
     try:
-        resp = requests.get(url, params=params or {}, timeout=timeout)
+        resp = (session or requests).get(url, params=params or {}, timeout=timeout)
         data = resp.json()
     except requests.RequestException as e:
         return {"ok": False, "error": f"Falha de rede ao chamar {method}: {e}"}
@@ -19,29 +40,320 @@ def tg_call(token: str, method: str, params: Optional[Dict[str, Any]] = None, ti
     return data
 
 
+# --- --bench ---
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Percentil por posição mais próxima (nearest-rank): o menor valor com pelo menos q% das amostras
+    até ele. None se não houver amostras. Também usado por benchmarks/loadtest.py.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def _summary(values_ms: List[float]) -> Dict[str, Any]:
+    def r(v):
+        return None if v is None else round(v, 1)
+    return {
+        "n": len(values_ms),
+        "min": r(min(values_ms)) if values_ms else None,
+        "p50": r(percentile(values_ms, 50)),
+        "p95": r(percentile(values_ms, 95)),
+        "p99": r(percentile(values_ms, 99)),
+        "max": r(max(values_ms)) if values_ms else None,
+    }
+
+
+def _timed(fn: Callable, *args, **kwargs):
+    """(duração em ms, resultado) de fn(*args, **kwargs)."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def _connect_probe(url: str) -> Dict[str, Any]:
+    """DNS e conexão TCP até o host de `url`, fora de qualquer sessão: separa o host/rede do tempo do serviço."""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    try:
+        dns_ms, infos = _timed(socket.getaddrinfo, parts.hostname, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        connect_ms, sock = _timed(socket.create_connection, (address, port), 10)
+        sock.close()
+    except OSError as e:
+        return {"host": parts.hostname, "error": str(e)}
+    return {"host": parts.hostname, "address": address, "dns_ms": round(dns_ms, 1), "tcp_connect_ms": round(connect_ms, 1)}
+
+
+def _bench_get_me(session: requests.Session, token: str, api_base: str, samples: int) -> Dict[str, Any]:
+    """Ida e volta do getMe: a primeira chamada abre a conexão (TLS), as demais reaproveitam (keep-alive)."""
+    first_ms, me = _timed(tg_call, token, "getMe", session=session, api_base=api_base)
+    if not me.get("ok"):
+        return {"error": me.get("description") or me.get("error")}
+    rtts = []
+    for _ in range(samples):
+        ms, data = _timed(tg_call, token, "getMe", session=session, api_base=api_base)
+        if not data.get("ok"):
+            return {"first_ms": round(first_ms, 1), "rtt_ms": _summary(rtts), "error": data.get("description") or data.get("error")}
+        rtts.append(ms)
+    return {"first_ms": round(first_ms, 1), "rtt_ms": _summary(rtts)}
+
+
+def _bench_long_poll(session: requests.Session, token: str, api_base: str, samples: int, poll_timeout: int,
+                     inject: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    """
+    Latência de "acordar" do getUpdates em long polling.
+
+    Sem `inject` (Telegram real), mede quanto cada espera passa do seu timeout: ida e volta mais o
+    atraso do servidor ao encerrar a espera. Não confirma (offset) nenhum update; se houver updates
+    pendentes, o getUpdates volta na hora e a medida é abandonada. Com `inject(atraso)` (--stub),
+    uma mensagem chega no meio da espera e mede-se quanto a resposta demora depois dela.
+    """
+    latencies = []
+    offset = None
+    for _ in range(samples):
+        delay = poll_timeout / 2 if inject else float(poll_timeout)
+        if inject:
+            inject(delay)
+        params = {"timeout": poll_timeout, "limit": 1}
+        if offset is not None:
+            params["offset"] = offset
+        elapsed_ms, data = _timed(tg_call, token, "getUpdates", params, timeout=poll_timeout + 10, session=session, api_base=api_base)
+        if not data.get("ok"):
+            # 409: o bot está rodando (polling) ou há webhook configurado.
+            return {"poll_timeout_s": poll_timeout, "latency_ms": _summary(latencies), "error": data.get("description") or data.get("error")}
+        results = data.get("result") or []
+        if inject:
+            if results:
+                offset = results[-1]["update_id"] + 1
+        elif results:
+            return {
+                "poll_timeout_s": poll_timeout,
+                "latency_ms": _summary(latencies),
+                "error": "Há updates pendentes: o getUpdates voltou na hora. Pare o bot (ou use --delete-webhook) e tente de novo.",
+            }
+        latencies.append(max(0.0, elapsed_ms - delay * 1000))
+    return {"mode": "wake" if inject else "overshoot", "poll_timeout_s": poll_timeout, "latency_ms": _summary(latencies)}
+
+
+def _bench_send(session: requests.Session, token: str, api_base: str, chat_id: str, max_messages: int,
+                max_seconds: float) -> Dict[str, Any]:
+    """Vazão de sendMessage para o chat de teste, uma mensagem após a outra, até o primeiro RetryAfter (429)."""
+    rtts = []
+    stopped_by = "max_messages"
+    retry_after = None
+    error = None
+    started = time.perf_counter()
+    for i in range(max_messages):
+        if time.perf_counter() - started > max_seconds:
+            stopped_by = "max_seconds"
+            break
+        params = {"chat_id": chat_id, "text": f"telegram_diagnose --bench: mensagem de teste {i + 1}", "disable_notification": "true"}
+        ms, data = _timed(tg_call, token, "sendMessage", params, session=session, api_base=api_base)
+        if data.get("ok"):
+            rtts.append(ms)
+            continue
+        if data.get("error_code") == 429:
+            stopped_by = "retry_after"
+            retry_after = (data.get("parameters") or {}).get("retry_after")
+        else:
+            stopped_by = "error"
+            error = data.get("description") or data.get("error")
+        break
+    elapsed = time.perf_counter() - started
+    result = {
+        "sent": len(rtts),
+        "elapsed_s": round(elapsed, 2),
+        "messages_per_s": round(len(rtts) / elapsed, 2) if elapsed > 0 else None,
+        "stopped_by": stopped_by,
+        "retry_after_s": retry_after,
+        "rtt_ms": _summary(rtts),
+    }
+    if error:
+        result["error"] = error
+    return result
+
+
+def _bench_simlam(session: requests.Session, url: str, samples: int) -> Dict[str, Any]:
+    """GET da página de busca do SIMLAM: a primeira requisição abre a conexão, as demais reaproveitam."""
+    rtts = []
+    first_ms = None
+    size = None
+    for i in range(samples + 1):
+        try:
+            ms, resp = _timed(session.get, url, timeout=60)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            return {"url": url, "first_ms": first_ms, "rtt_ms": _summary(rtts), "error": str(e)}
+        if i == 0:
+            first_ms, size = round(ms, 1), len(resp.content)
+        else:
+            rtts.append(ms)
+    return {"url": url, "first_ms": first_ms, "bytes": size, "rtt_ms": _summary(rtts)}
+
+
+def _verdict(report: Dict[str, Any]) -> List[str]:
+    """Resumo em linguagem natural: onde está a lentidão (host/rede, Telegram ou SIMLAM)."""
+    lines = []
+    for name, probe in report["connect"].items():
+        if "error" in probe:
+            lines.append(f"{name}: sem conexão com {probe['host']} ({probe['error']}): rede/firewall do host.")
+            continue
+        if probe["dns_ms"] > SLOW_DNS_MS:
+            lines.append(f"{name}: DNS lento ({probe['dns_ms']:.0f} ms): resolvedor do host.")
+        if probe["tcp_connect_ms"] > SLOW_CONNECT_MS:
+            lines.append(f"{name}: conexão TCP lenta ({probe['tcp_connect_ms']:.0f} ms): distância/rota entre a região do deploy e {probe['host']}.")
+    p50 = (report.get("get_me", {}).get("rtt_ms") or {}).get("p50")
+    if p50 is not None and p50 > SLOW_TELEGRAM_MS:
+        lines.append(f"Telegram: getMe p50 = {p50:.0f} ms com conexão reaproveitada: Bot API lenta a partir deste host.")
+    p50 = (report.get("long_poll", {}).get("latency_ms") or {}).get("p50")
+    if p50 is not None and p50 > SLOW_LONG_POLL_MS:
+        lines.append(f"Telegram: getUpdates demora {p50:.0f} ms (p50) para voltar: updates chegam atrasados ao bot.")
+    p50 = (report.get("simlam", {}).get("rtt_ms") or {}).get("p50")
+    if p50 is not None and p50 > SLOW_SIMLAM_MS:
+        lines.append(f"SIMLAM: página de busca p50 = {p50:.0f} ms: o gargalo das consultas é o próprio SIMLAM.")
+    send = report.get("send")
+    if send and send.get("stopped_by") == "retry_after":
+        lines.append(f"Telegram: RetryAfter ({send['retry_after_s']} s) depois de {send['sent']} mensagens ({send['messages_per_s']}/s).")
+    for section in ("get_me", "long_poll", "send", "simlam"):
+        error = (report.get(section) or {}).get("error")
+        if error:
+            lines.append(f"{section}: {error}")
+    return lines or ["Nenhum gargalo evidente: Telegram, SIMLAM e a rede deste host responderam dentro do esperado."]
+
+
+def _start_stub() -> Dict[str, Any]:
+    """
+    Sobe a Bot API e o SIMLAM falsos de benchmarks/fake_services.py numa thread própria, para testar o
+    --bench sem rede. Retorna {'api_base', 'simlam_url', 'inject'}.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    from fake_services import FakeBotApi, FakeSimlam, start_site
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    stub: Dict[str, Any] = {}
+
+    async def _up():
+        api = FakeBotApi(retry_after_rate=STUB_RETRY_AFTER_RATE)
+        _, api_port = await start_site(api.app())
+        _, simlam_port = await start_site(FakeSimlam().app())
+        stub.update(api=api, api_base=f"http://127.0.0.1:{api_port}", simlam_url=f"http://127.0.0.1:{simlam_port}/simlam/")
+
+    def _run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(_up())
+        finally:
+            ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=_run, name="bench-stub", daemon=True).start()
+    ready.wait()
+    if "api" not in stub:
+        raise RuntimeError("Falha ao subir os serviços falsos.")
+
+    def inject(delay: float) -> None:
+        loop.call_soon_threadsafe(loop.call_later, delay, stub["api"].push_message, STUB_CHAT_ID, "ping")
+
+    stub["inject"] = inject
+    return stub
+
+
+def bench(args, token: str) -> int:
+    """--bench: latências e vazão de Telegram e SIMLAM a partir deste host, com relatório JSON."""
+    api_base = (args.api_base or API_BASE).rstrip("/")
+    simlam_url = args.simlam_url or SIMLAM_BASE_URL
+    chat_id = args.chat_id
+    inject = None
+    if args.stub:
+        stub = _start_stub()
+        api_base, simlam_url, inject = stub["api_base"], stub["simlam_url"], stub["inject"]
+        token = token or "123456:STUB"
+        chat_id = chat_id or str(STUB_CHAT_ID)
+    elif not token:
+        print("ERRO: variável de ambiente BOT_TOKEN não está definida (ou use --stub).")
+        return 2
+    search_url = urljoin(simlam_url, "ListarProcessos.aspx")
+
+    report: Dict[str, Any] = {
+        "host": socket.gethostname(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "api_base": api_base,
+        "stub": bool(args.stub),
+        "connect": {"telegram": _connect_probe(api_base), "simlam": _connect_probe(search_url)},
+    }
+
+    # Uma sessão keep-alive por serviço, como o bot (pool do PTB e sessão do scraper).
+    with requests.Session() as tg_session, requests.Session() as simlam_session:
+        print(f"== getMe ({args.samples} amostras) ==")
+        report["get_me"] = _bench_get_me(tg_session, token, api_base, args.samples)
+        print(f"== getUpdates: long polling ({args.poll_samples} x {args.poll_timeout}s) ==")
+        report["long_poll"] = _bench_long_poll(tg_session, token, api_base, args.poll_samples, args.poll_timeout, inject)
+        if chat_id:
+            print(f"== sendMessage para {chat_id} (até {args.send_max} mensagens / {args.send_seconds:.0f}s) ==")
+            report["send"] = _bench_send(tg_session, token, api_base, chat_id, args.send_max, args.send_seconds)
+        else:
+            print("== sendMessage: pulado (informe --chat-id de um chat de teste) ==")
+        print(f"== SIMLAM: {search_url} ({args.samples} amostras) ==")
+        simlam_session.headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        report["simlam"] = _bench_simlam(simlam_session, search_url, args.simlam_samples)
+
+    report["verdict"] = _verdict(report)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nRelatório gravado em {args.json}")
+    print("\n== Resumo ==")
+    for line in report["verdict"]:
+        print(f"- {line}")
+    return 0
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(
-        description="Diagnóstico rápido da comunicação com o Telegram (token, webhook, updates).",
+        description="Diagnóstico rápido da comunicação com o Telegram (token, webhook, updates); com --bench, latência e vazão de Telegram e SIMLAM.",
     )
     parser.add_argument("--delete-webhook", action="store_true", help="Remove o webhook (útil se o bot usa polling).")
     parser.add_argument("--get-updates", action="store_true", help="Tenta buscar updates pendentes (pare o bot antes).")
+    parser.add_argument("--api-base", help="Servidor da Bot API (padrão: TELEGRAM_API_BASE_URL ou api.telegram.org).")
+    bench_args = parser.add_argument_group(
+        "--bench", "Mede latência e vazão de Telegram e SIMLAM a partir deste host (pare o bot antes: usa getUpdates)."
+    )
+    bench_args.add_argument("--bench", action="store_true", help="Roda as medições e imprime o relatório.")
+    bench_args.add_argument("--chat-id", help="Chat de teste para medir a vazão de sendMessage (recebe as mensagens!).")
+    bench_args.add_argument("--samples", type=int, default=20, help="Amostras de getMe (padrão: 20).")
+    bench_args.add_argument("--poll-samples", type=int, default=5, help="Esperas de getUpdates (padrão: 5).")
+    bench_args.add_argument("--poll-timeout", type=int, default=1, help="Timeout de cada espera do getUpdates, em segundos (padrão: 1).")
+    bench_args.add_argument("--send-max", type=int, default=60, help="Máximo de mensagens no teste de vazão (padrão: 60).")
+    bench_args.add_argument("--send-seconds", type=float, default=20, help="Duração máxima do teste de vazão, em segundos (padrão: 20).")
+    bench_args.add_argument("--simlam-url", help="Endereço do SIMLAM (padrão: SIMLAM_BASE_URL).")
+    bench_args.add_argument("--simlam-samples", type=int, default=10, help="Amostras da página de busca do SIMLAM (padrão: 10).")
+    bench_args.add_argument("--json", help="Grava o relatório em JSON neste arquivo.")
+    bench_args.add_argument("--stub", action="store_true", help="Usa a Bot API e o SIMLAM falsos de benchmarks/fake_services.py.")
     args = parser.parse_args()
 
     token = os.getenv("BOT_TOKEN", "").strip()
+    if args.bench:
+        return bench(args, token)
     if not token:
         print("ERRO: variável de ambiente BOT_TOKEN não está definida.")
         print('Exemplo (PowerShell): $env:BOT_TOKEN="123:ABC"')
         return 2
 
     print("== Telegram API: getMe ==")
-    me = tg_call(token, "getMe")
+    me = tg_call(token, "getMe", api_base=args.api_base)
     print(json.dumps(me, ensure_ascii=False, indent=2))
     if not me.get("ok"):
         print("\nFalha em getMe. Isso geralmente significa TOKEN inválido ou bloqueio de rede/SSL.")
         return 1
 
     print("\n== Telegram API: getWebhookInfo ==")
-    wh = tg_call(token, "getWebhookInfo")
+    wh = tg_call(token, "getWebhookInfo", api_base=args.api_base)
     print(json.dumps(wh, ensure_ascii=False, indent=2))
     if wh.get("ok"):
         url = (wh.get("result") or {}).get("url") or ""
@@ -53,12 +365,12 @@ def main() -> int:
 
     if args.delete_webhook:
         print("\n== Telegram API: deleteWebhook ==")
-        res = tg_call(token, "deleteWebhook", params={"drop_pending_updates": "true"})
+        res = tg_call(token, "deleteWebhook", params={"drop_pending_updates": "true"}, api_base=args.api_base)
         print(json.dumps(res, ensure_ascii=False, indent=2))
 
     if args.get_updates:
         print("\n== Telegram API: getUpdates (pare o bot antes) ==")
-        updates = tg_call(token, "getUpdates", params={"limit": 5, "timeout": 0})
+        updates = tg_call(token, "getUpdates", params={"limit": 5, "timeout": 0}, api_base=args.api_base)
         print(json.dumps(updates, ensure_ascii=False, indent=2))
         if updates.get("ok"):
             results = updates.get("result") or []
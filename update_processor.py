@@ -0,0 +1,80 @@
+"""
+Processamento concorrente de updates do Telegram, preservando a ordem dentro de cada chat.
+
+Sem isso, o python-telegram-bot processa um update por vez e um /monitorar de dez processos
+(dezenas de segundos de scraping) trava o /start de todos os outros chats.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Quantos updates podem ser processados ao mesmo tempo (somando todos os chats).
+MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
+# Conexões HTTP com a Bot API: uma por update em andamento + folga para notificações do job.
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", str(MAX_CONCURRENT_UPDATES + 8)))
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "5"))
+
+# Limite "técnico" repassado ao BaseUpdateProcessor. O limite real (MAX_CONCURRENT_UPDATES) é
+# aplicado só depois que o update consegue a vez do seu chat: assim, mensagens enfileiradas atrás
+# de um comando lento de um chat não ocupam vagas globais que outros chats poderiam usar.
+_PENDING_UPDATES_LIMIT = int(os.getenv("BOT_PENDING_UPDATES_LIMIT", "1024"))
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processa updates de chats diferentes em paralelo (até `max_running`), mas em série e na ordem
+    de chegada dentro de um mesmo chat. Updates sem chat (ex.: inline) não são serializados.
+    """
+
+    def __init__(self, max_running: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates=max(_PENDING_UPDATES_LIMIT, max_running))
+        self.max_running = max_running
+        self._running: Optional[asyncio.Semaphore] = None
+        # chat_id -> [lock, updates aguardando/em andamento]; removido quando o chat fica ocioso.
+        self._chat_locks: Dict[int, List[Any]] = {}
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.max_running)
+
+    async def shutdown(self) -> None:
+        self._chat_locks.clear()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self._running is None:
+            await self.initialize()
+
+        chat_id = None
+        if isinstance(update, Update) and update.effective_chat is not None:
+            chat_id = update.effective_chat.id
+
+        if chat_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock atende em ordem FIFO, e o PTB cria as tarefas na ordem de chegada.
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chat_locks.pop(chat_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Métricas simples para diagnóstico (updates em andamento e chats com fila)."""
+        return {
+            "max_running": self.max_running,
+            "in_flight": self.current_concurrent_updates,
+            "busy_chats": len(self._chat_locks),
+        }
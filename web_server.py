@@ -0,0 +1,207 @@
+"""
+Servidor HTTP do bot, rodando no mesmo event loop (aiohttp).
+
+Atende o healthcheck (/health, usado pelo Render e pelo UptimeRobot), as métricas (/metrics) e,
+no modo webhook, os updates que o Telegram envia por POST. Substitui o Flask, que rodava o
+servidor de desenvolvimento em uma thread separada só para responder o /health.
+
+No modo webhook, cada POST é validado pelo cabeçalho X-Telegram-Bot-Api-Secret-Token
+(o mesmo segredo informado no setWebhook) e o update vai direto para a fila do Application.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+from telegram import Update
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+# O aiohttp (~120 ms de import) só é carregado quando o servidor sobe, não no import do bot.
+
+logger = logging.getLogger(__name__)
+
+PORT = int(os.getenv("PORT", "8080"))
+# URL pública do bot (ex.: https://meu-bot.onrender.com). Se definida, o bot usa webhook em vez de polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "telegram/webhook").strip("/")
+# Segredo conferido em cada POST do Telegram. Sem WEBHOOK_SECRET, um aleatório é gerado a cada start
+# (o setWebhook é refeito no start, então isso funciona; só não sobrevive a várias réplicas).
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# Token das rotas de diagnóstico (/debug/*). Sem ele, essas rotas nem são registradas.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_enabled() -> bool:
+    return bool(WEBHOOK_URL)
+
+
+def build_app(application, metrics: Optional[Callable[[], Dict]] = None) -> "web.Application":
+    """Monta as rotas. `application` é o Application do PTB; `metrics` retorna o JSON de /metrics."""
+    from aiohttp import web
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    async def metrics_handler(request: web.Request) -> web.Response:
+        return web.json_response(metrics() if metrics else {})
+
+    async def telegram_webhook(request: web.Request) -> web.Response:
+        token = request.headers.get(_SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            logger.warning("POST no webhook com segredo inválido (origem %s).", request.remote)
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            logger.warning("Update inválido recebido no webhook: %s", e)
+            return web.Response(status=400)
+        # Responde já: o processamento segue no Application (e o Telegram não reenvia o update).
+        await application.update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/health", health)  # também responde HEAD (UptimeRobot)
+    app.router.add_get("/metrics", metrics_handler)
+    if webhook_enabled():
+        app.router.add_post(WEBHOOK_PATH, telegram_webhook)
+    if ADMIN_TOKEN:
+        _add_debug_routes(app)
+    return app
+
+
+def _is_admin(request: "web.Request") -> bool:
+    auth = request.headers.get("Authorization", "")
+    token = auth[7:] if auth.startswith("Bearer ") else request.headers.get("X-Admin-Token", "")
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def _add_debug_routes(app: "web.Application") -> None:
+    """
+    Diagnóstico em produção (ver profiling.py). Todas as rotas exigem
+    `Authorization: Bearer $ADMIN_TOKEN` (ou o cabeçalho X-Admin-Token).
+
+        POST /debug/profile/start?seconds=30&interval=0.01&threads=all&pstats=1
+        POST /debug/profile/stop
+        GET  /debug/profile           -> collapsed stacks (flamegraph.pl, speedscope)
+        GET  /debug/profile.pstats    -> pstats do event loop (se pedido com pstats=1)
+        POST /debug/tracemalloc/start?frames=10
+        GET  /debug/tracemalloc/snapshot?limit=25&key=lineno
+        POST /debug/tracemalloc/stop
+        GET  /debug/tasks?threads=all -> pilhas das tarefas asyncio e das threads do scraper
+        GET  /debug/stalls            -> últimos travamentos do event loop, com a pilha capturada
+    """
+    from aiohttp import web
+
+    import loop_watchdog
+    import profiling
+    import scraper_pool
+
+    @web.middleware
+    async def require_admin(request: web.Request, handler):
+        if request.path.startswith("/debug/") and not _is_admin(request):
+            logger.warning("Acesso negado a %s (origem %s).", request.path, request.remote)
+            return web.Response(status=401)
+        return await handler(request)
+
+    def _float(request: web.Request, name: str, default: float) -> float:
+        try:
+            return float(request.query.get(name, default))
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"Parâmetro inválido: {name}")
+
+    async def profile_start(request: web.Request) -> web.Response:
+        started = profiling.profiler.start(
+            seconds=_float(request, "seconds", 30),
+            interval=_float(request, "interval", 0.01),
+            all_threads=request.query.get("threads") == "all",
+            with_pstats=request.query.get("pstats") == "1",
+        )
+        if not started:
+            return web.json_response({"error": "já existe um perfil em andamento"}, status=409)
+        return web.json_response(profiling.profiler.status())
+
+    async def profile_stop(request: web.Request) -> web.Response:
+        profiling.profiler.stop()
+        return web.json_response(profiling.profiler.status())
+
+    async def profile_result(request: web.Request) -> web.Response:
+        return web.Response(text=profiling.profiler.collapsed())
+
+    async def profile_pstats(request: web.Request) -> web.Response:
+        data = profiling.profiler.pstats_data()
+        if data is None:
+            return web.json_response({"error": "nenhum pstats disponível (use pstats=1 e espere o perfil terminar)"}, status=404)
+        return web.Response(
+            body=data,
+            content_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="event-loop.prof"'},
+        )
+
+    async def tracemalloc_start(request: web.Request) -> web.Response:
+        profiling.allocations.start(frames=int(_float(request, "frames", 10)))
+        return web.json_response({"tracing": True})
+
+    async def tracemalloc_snapshot(request: web.Request) -> web.Response:
+        key = request.query.get("key", "lineno")
+        if key not in ("lineno", "filename", "traceback"):
+            raise web.HTTPBadRequest(text="key deve ser lineno, filename ou traceback")
+        try:
+            # Tirar o snapshot pode levar centenas de ms com muitos objetos: fora do event loop.
+            text = await asyncio.to_thread(profiling.allocations.snapshot, int(_float(request, "limit", 25)), key)
+        except RuntimeError as e:
+            return web.json_response({"error": str(e)}, status=409)
+        return web.Response(text=text)
+
+    async def tracemalloc_stop(request: web.Request) -> web.Response:
+        profiling.allocations.stop()
+        return web.json_response({"tracing": False})
+
+    async def tasks(request: web.Request) -> web.Response:
+        all_threads = request.query.get("threads") == "all"
+        text = profiling.dump_tasks() + "\n# threads\n" + profiling.dump_threads(scraper_pool.get_executor().current_work(), all_threads)
+        return web.Response(text=text)
+
+    async def stalls(request: web.Request) -> web.Response:
+        return web.json_response(loop_watchdog.watchdog.recent_stacks())
+
+    app.middlewares.append(require_admin)
+    app.router.add_post("/debug/profile/start", profile_start)
+    app.router.add_post("/debug/profile/stop", profile_stop)
+    app.router.add_get("/debug/profile", profile_result)
+    app.router.add_get("/debug/profile.pstats", profile_pstats)
+    app.router.add_post("/debug/tracemalloc/start", tracemalloc_start)
+    app.router.add_get("/debug/tracemalloc/snapshot", tracemalloc_snapshot)
+    app.router.add_post("/debug/tracemalloc/stop", tracemalloc_stop)
+    app.router.add_get("/debug/tasks", tasks)
+    app.router.add_get("/debug/stalls", stalls)
+
+
+async def start(application, metrics: Optional[Callable[[], Dict]] = None, port: int = PORT) -> "web.AppRunner":
+    """Sobe o servidor e retorna o runner (chame `await runner.cleanup()` para parar)."""
+    from aiohttp import web
+
+    runner = web.AppRunner(build_app(application, metrics), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host="0.0.0.0", port=port)
+    await site.start()
+    logger.info("Servidor HTTP ouvindo na porta %s (%s).", port, 'webhook' if webhook_enabled() else 'polling')
+    return runner
+
+
+async def set_webhook(bot) -> None:
+    """Registra o webhook no Telegram, descartando updates acumulados (como o drop_pending_updates do polling)."""
+    await bot.set_webhook(
+        url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True,
+    )
+    logger.info("Webhook registrado em %s%s.", WEBHOOK_URL, WEBHOOK_PATH)